@@ -0,0 +1,237 @@
+'''
+Benchmark of the deploy pipeline against a fake Snowflake session.
+Generates synthetic projects in the snowflake/databases/<db>/schemas/<schema>/... layout and times
+deploy, test_dag --execute and run_script on them. Reports compile time (cold, then with the project
+cache warm), execution wall time, round trips and peak Python memory for every scenario.
+Timings come from an untraced run. Peak memory comes from a second run on a fresh copy of the
+project under tracemalloc, which slows everything down too much to time.
+
+Usage: python benchmarks/bench_deploy.py [--sizes 10,1000,10000] [--dag_tasks N] [--variables N]
+                                         [--staged_files N] [--latency_ms MS] [-j N] [--no_memory] [-o results.json]
+'''
+from pathlib import Path
+import contextlib
+import tracemalloc
+import tempfile
+import argparse
+import logging
+import random
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tests'))
+from snowflow import runner, commands, cache
+from fake_snowflake import FakeSessionFactory
+
+ENVIRONMENT = 'bench'
+DATABASE = 'bench_db'
+SCHEMA = 'bench_schema'
+DAG_NAME = 'bench_dag'
+
+def write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+def generate_variables(root: Path, count: int) -> list[str]:
+    names = [f'!!!BENCH_VARIABLE_{i}!!!' for i in range(count)]
+    lines = [f'{ENVIRONMENT}:'] + [f"  '{name}': value_{i}" for i, name in enumerate(names)]
+    write(Path(root, 'query_variables.yaml'), '\n'.join(lines) + '\n')
+    return names
+
+def generate_account(root: Path, objects: int) -> None:
+    account = Path(root, 'snowflake')
+    roles = max(objects // 100, 1)
+    write(Path(account, 'init.sql'), f"CREATE DATABASE IF NOT EXISTS {DATABASE};\n")
+    for i in range(roles):
+        write(Path(account, 'roles', f'role_{i}.sql'), f"CREATE ROLE IF NOT EXISTS bench_role_{i};\n")
+    write(Path(account, 'warehouses', 'bench_wh.sql'), "CREATE WAREHOUSE IF NOT EXISTS bench_wh WAREHOUSE_SIZE = XSMALL;\n")
+    write(Path(account, 'grants.sql'), ''.join(f"GRANT ROLE bench_role_{i} TO ROLE sysadmin;\n" for i in range(roles)))
+    write(Path(account, 'databases', DATABASE, 'init.sql'), f"CREATE SCHEMA IF NOT EXISTS {DATABASE}.{SCHEMA};\n")
+    write(Path(account, 'databases', DATABASE, 'grants.sql'), '')
+
+def generate_schema(root: Path, objects: int, variables: list[str], staged_files: int) -> None:
+    '''
+    Half the objects are tables, the other half views over one or two of the tables
+    '''
+    schema = Path(root, 'snowflake', 'databases', DATABASE, 'schemas', SCHEMA)
+    tables = max(objects // 2, 1)
+    views = max(objects - tables, 1)
+    variable = (lambda i: variables[i % len(variables)]) if variables else (lambda i: f'value_{i}')
+    write(Path(schema, 'init.sql'), f"CREATE SCHEMA IF NOT EXISTS {SCHEMA};\n")
+    write(Path(schema, 'file_formats', 'csv_ff.sql'), "CREATE FILE FORMAT IF NOT EXISTS csv_ff TYPE = 'CSV' SKIP_HEADER = 1;\n")
+    write(Path(schema, 'stages', 'bench_stage.sql'), "CREATE STAGE IF NOT EXISTS bench_stage FILE_FORMAT = csv_ff;\n")
+    for i in range(tables):
+        write(Path(schema, 'tables', f'table_{i:05d}.sql'),
+              f"-- Table {i}\nCREATE TABLE IF NOT EXISTS table_{i:05d} (\n    id INT,\n    name STRING,\n"
+              f"    source STRING DEFAULT '{variable(i)}',\n    loaded_at TIMESTAMP_LTZ\n);\n")
+    for i in range(views):
+        joined = f"\nJOIN table_{(i * 7 + 1) % tables:05d} b ON a.id = b.id" if i % 3 == 0 else ''
+        write(Path(schema, 'views', f'view_{i:05d}.sql'),
+              f"CREATE OR REPLACE VIEW view_{i:05d} AS\nSELECT a.id, a.name, '{variable(i)}' AS tag\n"
+              f"FROM table_{i % tables:05d} a{joined};\n")
+    for i in range(staged_files):
+        write(Path(schema, 'staged_files', 'bench_stage', f'file_{i:05d}.csv'), 'id,name\n' + f'{i},row_{i}\n' * 20)
+    write(Path(schema, 'grants.sql'), ''.join(f"GRANT SELECT ON VIEW view_{i:05d} TO ROLE bench_role_0;\n"
+                                              for i in range(min(views, 400))))
+
+def generate_dag(root: Path, tasks: int, seed: int = 7) -> str:
+    '''
+    A DAG where every task depends on one to three earlier tasks. Returns the yaml file name
+    '''
+    rng = random.Random(seed)
+    lines = [f'DAG_NAME: {DAG_NAME}', "SCHEDULE: 'USING CRON 0 0 1 * * UTC'", 'WAREHOUSE: bench_wh', 'ROOT_TASK: task_00000',
+             "ALLOW_OVERLAPPING_EXECUTION: 'FALSE'", "ENABLED: 'TRUE'", '', 'TASKS:']
+    dml = Path(root, 'snowflake', 'databases', DATABASE, 'dml', DAG_NAME)
+    for i in range(tasks):
+        name = f'task_{i:05d}'
+        write(Path(dml, f'{name}.sql'), f"INSERT INTO table_{i % 10:05d} SELECT * FROM table_{(i + 1) % 10:05d};\n")
+        lines += [f'  - NAME: {name}', f'    SCRIPT_PATH: {DAG_NAME}/{name}.sql', '    SCRIPT_TYPE: sql']
+        if i:
+            parents = sorted({f'task_{rng.randrange(max(0, i - 50), i):05d}' for _ in range(rng.randint(1, 3))})
+            lines += ['    DEPENDS_ON:'] + [f'      - {parent}' for parent in parents]
+    file_name = f'{DAG_NAME}.yaml'
+    write(Path(root, 'snowflake', 'databases', DATABASE, 'schemas', SCHEMA, 'dags', file_name), '\n'.join(lines) + '\n')
+    return file_name
+
+def generate_script(root: Path, statements: int) -> str:
+    path = Path(root, 'snowflake', 'scripts', 'bench_script.sql')
+    write(path, ''.join(f"INSERT INTO table_00000 (id, name) VALUES ({i}, 'row; {i}');\n" for i in range(statements)))
+    return 'scripts/bench_script.sql'
+
+def generate_project(root: Path, objects: int, dag_tasks: int, variables: int, staged_files: int) -> dict:
+    names = generate_variables(root, variables)
+    generate_account(root, objects)
+    generate_schema(root, objects, names, staged_files)
+    return {'dag': generate_dag(root, dag_tasks) if dag_tasks else None,
+            'script': generate_script(root, objects)}
+
+@contextlib.contextmanager
+def measure(results: dict, name: str):
+    '''
+    Record the wall time of the body under results[name], or its peak memory while tracemalloc is tracing
+    '''
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        yield
+        results[name + '_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    else:
+        start = time.perf_counter()
+        yield
+        results[name + '_seconds'] = time.perf_counter() - start
+
+@contextlib.contextmanager
+def project_directory(path: Path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def use_fake_sessions(args) -> FakeSessionFactory:
+    runner.close_session_pools()
+    # Sessions open in a default database and schema, as with a database in connections.toml
+    factory = FakeSessionFactory(args.latency_ms / 1000, args.latency_ms / 1000, args.login_ms / 1000,
+                                 database=DATABASE.upper(), schema='PUBLIC')
+    runner.set_session_factory(factory)
+    return factory
+
+def bench_deploy(args) -> dict:
+    results = {}
+    options = {'all': True, 'full': True, 'j': args.j, 'schema_workers': args.schema_workers}
+    factory = use_fake_sessions(args)
+    with measure(results, 'compile_cold'):
+        deploy = commands.Deploy(ENVIRONMENT)
+        deploy.set_options(options)
+        deploy.compile_plans(options)
+    with measure(results, 'compile_warm'):
+        warm = commands.Deploy(ENVIRONMENT)
+        warm.set_options(options)
+        warm.compile_plans(options)
+    with measure(results, 'execute'):
+        deploy.execute(options)
+    results.update(factory.get_totals())
+    return results
+
+def bench_test_dag(args, dag_file: str) -> dict:
+    results = {}
+    factory = use_fake_sessions(args)
+    with measure(results, 'execute'):
+        commands.TestDAG(ENVIRONMENT).run({'d': DATABASE, 's': SCHEMA, 'f': dag_file, 'execute': True, 'j': args.j})
+    results.update(factory.get_totals())
+    return results
+
+def bench_run_script(args, script: str) -> dict:
+    results = {}
+    factory = use_fake_sessions(args)
+    with measure(results, 'execute'):
+        commands.RunScript(ENVIRONMENT).run({'d': DATABASE, 's': SCHEMA, 'f': script})
+    results.update(factory.get_totals())
+    return results
+
+def run_scenarios(args, size: int) -> dict:
+    '''
+    Generate a project of size objects in a new folder and run every scenario on it
+    '''
+    with tempfile.TemporaryDirectory(prefix='snowflow_bench_') as root:
+        project = generate_project(Path(root), size, args.dag_tasks, args.variables, args.staged_files)
+        with project_directory(Path(root)):
+            scenarios = {'deploy --all': bench_deploy(args)}
+            if project['dag']:
+                scenarios['test_dag --execute'] = bench_test_dag(args, project['dag'])
+            scenarios['run_script'] = bench_run_script(args, project['script'])
+            # Write the project cache now, while its folder still exists
+            cache.get_project_cache().save()
+    return scenarios
+
+def print_results(scenario: str, results: dict) -> None:
+    timings = '  '.join(f"{key[:-8]} {value:8.3f}s" for key, value in results.items() if key.endswith('_seconds'))
+    peaks = [value for key, value in results.items() if key.endswith('_peak_mb')]
+    peak = f"  peak {max(peaks):8.1f} MB" if peaks else ''
+    print(f"  {scenario:<24} {timings}{peak}  "
+          f"{results['round_trips']:>6} round trips  {results['statements']:>6} statements  {results['puts']:>5} puts")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark snowflow deploys against a fake Snowflake session')
+    parser.add_argument('--sizes', default='10,1000', help='Comma separated numbers of schema objects, e.g. 10,1000,10000')
+    parser.add_argument('--dag_tasks', type=int, default=200, help='Number of tasks in the generated DAG, 0 for none')
+    parser.add_argument('--variables', type=int, default=1000, help='Number of variables in query_variables.yaml')
+    parser.add_argument('--staged_files', type=int, default=100, help='Number of files under staged_files')
+    parser.add_argument('--latency_ms', type=float, default=0.0, help='Simulated round trip latency of every query and upload')
+    parser.add_argument('--login_ms', type=float, default=0.0, help='Simulated time to open a session')
+    parser.add_argument('-j', type=int, default=1, help='Statements, uploads and DAG tasks to run concurrently')
+    parser.add_argument('--schema_workers', type=int, default=1, help='Schemas to deploy concurrently')
+    parser.add_argument('--no_memory', action='store_true', help='Skip the second, traced run that measures peak memory')
+    parser.add_argument('-o', dest='output', help='Also write the results to this json file')
+    parser.add_argument('-v', dest='verbose', action='store_true', help='Show the snowflow log')
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO if args.verbose else logging.ERROR,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
+
+    all_results = {}
+    for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        print(f"{size} objects, {args.dag_tasks} DAG tasks, {args.variables} variables, {args.staged_files} staged files, "
+              f"{args.latency_ms:g} ms latency, -j {args.j}")
+        scenarios = run_scenarios(args, size)
+        if not args.no_memory:
+            tracemalloc.start()
+            traced = run_scenarios(args, size)
+            tracemalloc.stop()
+            for scenario, results in traced.items():
+                scenarios[scenario].update({key: value for key, value in results.items() if key.endswith('_peak_mb')})
+        for scenario, results in scenarios.items():
+            print_results(scenario, results)
+        all_results[size] = scenarios
+    runner.close_session_pools()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': vars(args), 'results': all_results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Cold start benchmark of the snowflow CLI.
+Times a fresh interpreter running each command's help, which builds the whole argument parser
+but does no work, and lists the slowest imports reported by python -X importtime.
+
+Usage: python benchmarks/bench_startup.py [-n REPEAT] [-t TOP] [--max_ms MS]
+'''
+from pathlib import Path
+import subprocess
+import statistics
+import argparse
+import time
+import sys
+import os
+
+ROOT = Path(__file__).resolve().parent.parent
+COMMANDS = [[], ['init'], ['deploy'], ['plan'], ['apply'], ['run_script'], ['clone'], ['test_dag']]
+
+def get_env() -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = str(ROOT) + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+def time_command(command: list[str], repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'from snowflow.handler import main; main()', *command, '-h'],
+                       env=get_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def time_interpreter(repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def get_slowest_imports(top: int) -> list[tuple[int, str]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'from snowflow.handler import main'],
+                            env=get_env(), capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            # Only top level imports, their cumulative time includes everything they pull in
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark snowflow CLI startup')
+    parser.add_argument('-n', dest='repeat', type=int, default=5, help='Number of runs per command')
+    parser.add_argument('-t', dest='top', type=int, default=10, help='Number of slowest imports to list')
+    parser.add_argument('--max_ms', type=float, help='Exit with an error if any command median is slower than this')
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_interpreter(args.repeat))
+    print(f"Bare interpreter start: {baseline * 1000:8.1f} ms")
+    slowest = 0
+    for command in COMMANDS:
+        median = statistics.median(time_command(command, args.repeat))
+        slowest = max(slowest, median)
+        print(f"  snowflow {' '.join(command + ['-h']):<16} {median * 1000:8.1f} ms  (+{(median - baseline) * 1000:.1f} ms)")
+
+    print("Slowest imports of snowflow.handler:")
+    for cumulative, name in get_slowest_imports(args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if args.max_ms is not None and slowest * 1000 > args.max_ms:
+        print(f"Startup regression: slowest command took {slowest * 1000:.1f} ms, limit is {args.max_ms} ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+'''
+Micro-benchmark of query variable substitution.
+Compares the compiled single pass VariableSubstituter with the previous approach of
+calling str.replace once per variable.
+
+Usage: python benchmarks/bench_substitution.py [-v VARIABLES] [-l LINES] [-n REPEAT]
+'''
+from pathlib import Path
+import argparse
+import timeit
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from snowflow.scripts import VariableSubstituter
+
+def replace_per_variable(query: str, substitutions: dict) -> str:
+    for var, val in substitutions.items():
+        query = query.replace(var, str(val))
+    return query
+
+def get_substitutions(count: int) -> dict:
+    return {f'!!!VARIABLE_{i}!!!': f'value_{i}' for i in range(count)}
+
+def get_query(lines: int, variables: int) -> str:
+    return '\n'.join(f"SELECT col_{i}, '!!!VARIABLE_{i % variables}!!!' AS v FROM table_{i} WHERE x = {i};"
+                     for i in range(lines))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark query variable substitution')
+    parser.add_argument('-v', dest='variables', type=int, default=300, help='Number of variables')
+    parser.add_argument('-l', dest='lines', type=int, default=5000, help='Number of lines in the query')
+    parser.add_argument('-n', dest='repeat', type=int, default=20, help='Number of runs to time')
+    args = parser.parse_args()
+
+    substitutions = get_substitutions(args.variables)
+    query = get_query(args.lines, args.variables)
+
+    compile_time = timeit.timeit(lambda: VariableSubstituter(substitutions), number=args.repeat) / args.repeat
+    substituter = VariableSubstituter(substitutions)
+    assert substituter.substitute(query) == replace_per_variable(query, substitutions)
+
+    legacy = timeit.timeit(lambda: replace_per_variable(query, substitutions), number=args.repeat) / args.repeat
+    single_pass = timeit.timeit(lambda: substituter.substitute(query), number=args.repeat) / args.repeat
+
+    print(f"{args.variables} variables, {len(query)} characters, {args.repeat} runs")
+    print(f"  str.replace per variable: {legacy * 1000:9.2f} ms")
+    print(f"  single pass substitution: {single_pass * 1000:9.2f} ms  (compile once: {compile_time * 1000:.2f} ms)")
+    print(f"  speedup:                  {legacy / single_pass:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,17 @@
-from .commands import *
-from .runner import *
-from .scripts import *
-from .handler import main
\ No newline at end of file
+import importlib.util
+import importlib
+from .handler import main
+
+def __getattr__(name: str):
+    '''
+    Resolve the public names of commands, runner and scripts on first use, so importing
+    snowflow to run the CLI does not load Snowpark
+    '''
+    if importlib.util.find_spec('.' + name, __name__) is not None:
+        # from . import <submodule> looks the name up here before importing it
+        return importlib.import_module('.' + name, __name__)
+    for module_name in ['scripts', 'runner', 'commands']:
+        module = importlib.import_module('.' + module_name, __name__)
+        if not name.startswith('_') and hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
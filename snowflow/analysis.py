@@ -0,0 +1,194 @@
+from datetime import datetime
+from pathlib import Path
+from . import executor
+import networkx as nx
+import statistics
+import logging
+import json
+import csv
+import sys
+import re
+
+# A user managed warehouse bills at least this many seconds every time it resumes
+WAREHOUSE_MIN_BILLED_SECONDS = 60
+TIMESTAMP_PATTERN = re.compile(r'^(\S+)[ T](\d{2}:\d{2}:\d{2})(?:\.(\d+))?\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+def parse_timestamp(value: str) -> datetime:
+    '''
+    Parse the timestamps of a Snowsight or SnowSQL export, e.g. 2024-05-01 00:00:03.123 -0700
+    '''
+    match = TIMESTAMP_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Could not parse timestamp {value}")
+    date, clock, fraction, offset = match.groups()
+    text = f"{date}T{clock}"
+    if fraction:
+        text += '.' + fraction[:6].ljust(6, '0')
+    if offset:
+        offset = '+00:00' if offset == 'Z' else offset
+        text += offset if ':' in offset else offset[:3] + ':' + offset[3:]
+    return datetime.fromisoformat(text)
+
+def read_task_history(path: Path) -> dict:
+    '''
+    Returns {task name: [seconds, ...]} from a CSV of task runs.
+    Accepts an export of TASK_HISTORY (NAME, STATE, QUERY_START_TIME, COMPLETED_TIME) or a file with
+    NAME and SECONDS columns, like the one written by test_dag --execute --history_out.
+    Runs that did not succeed are left out.
+    '''
+    runtimes = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip().upper(): (value or '').strip() for key, value in row.items() if key}
+            if row.get('STATE') and row['STATE'].upper() not in ('SUCCEEDED', 'SUCCESS'):
+                continue
+            if row.get('SECONDS'):
+                seconds = float(row['SECONDS'])
+            elif row.get('QUERY_START_TIME') and row.get('COMPLETED_TIME'):
+                seconds = (parse_timestamp(row['COMPLETED_TIME']) - parse_timestamp(row['QUERY_START_TIME'])).total_seconds()
+            else:
+                continue
+            runtimes.setdefault(row['NAME'].lower(), []).append(seconds)
+    return runtimes
+
+def write_task_history(path: Path, timings: dict) -> Path:
+    '''
+    Append {task name: (start offset, seconds, status)} to a CSV that read_task_history understands
+    '''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not path.exists() or path.stat().st_size == 0
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(['NAME', 'STATE', 'SECONDS', 'RECORDED_AT'])
+        recorded_at = datetime.now().isoformat(timespec='seconds')
+        for name, (_, seconds, status) in timings.items():
+            writer.writerow([name, status.upper(), f"{seconds:.3f}", recorded_at])
+    return path
+
+class DAGAnalysis:
+    '''
+    Scheduling analysis of a task DAG given a runtime for every task.
+    Assumes a task starts as soon as all of its predecessors finish, with overhead seconds
+    of scheduling delay in front of every task.
+    '''
+    def __init__(self, digraph: nx.DiGraph, durations: dict, overhead: float = 0.0):
+        self.digraph = digraph
+        self.durations = {node: durations.get(node, 0.0) + overhead for node in digraph.nodes}
+        self.overhead = overhead
+        self.earliest_start, self.earliest_finish = self._forward_pass()
+        self.latency = max(self.earliest_finish.values(), default=0.0)
+        self.latest_start = self._backward_pass()
+        self.critical_path, _ = executor.get_critical_path(digraph, self.durations)
+
+    def _forward_pass(self) -> tuple[dict, dict]:
+        start, finish = {}, {}
+        for node in nx.topological_sort(self.digraph):
+            start[node] = max((finish[p] for p in self.digraph.predecessors(node)), default=0.0)
+            finish[node] = start[node] + self.durations[node]
+        return start, finish
+
+    def _backward_pass(self) -> dict:
+        latest_start = {}
+        for node in reversed(list(nx.topological_sort(self.digraph))):
+            latest_finish = min((latest_start[s] for s in self.digraph.successors(node)), default=self.latency)
+            latest_start[node] = latest_finish - self.durations[node]
+        return latest_start
+
+    def get_slack(self) -> dict:
+        '''
+        Seconds each task can be delayed without delaying the end of the DAG
+        '''
+        return {node: self.latest_start[node] - self.earliest_start[node] for node in self.digraph.nodes}
+
+    def get_max_width(self) -> int:
+        '''
+        Most tasks running at the same time when every task starts as early as it can
+        '''
+        points = sorted([(self.earliest_start[n], 1) for n in self.digraph.nodes if self.durations[n] > 0] +
+                        [(self.earliest_finish[n], -1) for n in self.digraph.nodes if self.durations[n] > 0])
+        width = running = 0
+        for _, change in points:
+            running += change
+            width = max(width, running)
+        return width
+
+    def get_total_work(self) -> float:
+        return sum(self.durations.values())
+
+    def get_fan_out_findings(self, short_seconds: float = 10.0) -> list[str]:
+        '''
+        Look at every task with more than one dependent for branches worth splitting or merging
+        '''
+        findings = []
+        slack = self.get_slack()
+        for node in nx.topological_sort(self.digraph):
+            children = sorted(self.digraph.successors(node), key=lambda child: self.durations[child], reverse=True)
+            if len(children) < 2:
+                continue
+            longest, runner_up = children[0], children[1]
+            if longest in self.critical_path and self.durations[longest] > 2 * self.durations[runner_up]:
+                findings.append(f"{longest} takes {self.durations[longest]:.1f}s while the other branches after {node} take at most "
+                                f"{self.durations[runner_up]:.1f}s. Splitting it into parallel tasks could shorten the DAG by up to "
+                                f"{self.durations[longest] - self.durations[runner_up]:.1f}s.")
+            short = [child for child in children if self.durations[child] - self.overhead < short_seconds and slack[child] > 0
+                     and self.digraph.in_degree(child) == 1 and self.digraph.out_degree(child) == 0]
+            if len(short) > 1:
+                findings.append(f"{len(short)} short leaf tasks after {node} ({', '.join(sorted(short))}) each run under {short_seconds:g}s "
+                                f"and are off the critical path. Merging them into one task saves {len(short) - 1} task runs per DAG run.")
+        return findings
+
+    def get_warehouse_advice(self, configured: str = None) -> str:
+        '''
+        Rough guidance on serverless (INITIAL_WAREHOUSE_SIZE) vs a user managed WAREHOUSE for the DAG
+        '''
+        parallelism = self.get_total_work() / self.latency if self.latency else 0.0
+        if self.latency < WAREHOUSE_MIN_BILLED_SECONDS:
+            advice = (f"The DAG runs for {self.latency:.1f}s, under the {WAREHOUSE_MIN_BILLED_SECONDS}s minimum billed each time a warehouse resumes. "
+                      "Serverless tasks (INITIAL_WAREHOUSE_SIZE) avoid paying for the idle remainder.")
+        elif parallelism >= 2:
+            advice = (f"Tasks overlap well (on average {parallelism:.1f} running at once, at most {self.get_max_width()}). "
+                      f"A dedicated WAREHOUSE shares its billed time across concurrent tasks; size it for {self.get_max_width()} concurrent queries.")
+        else:
+            advice = (f"Tasks mostly run one at a time (on average {parallelism:.1f} at once). Serverless tasks (INITIAL_WAREHOUSE_SIZE) "
+                      "are billed only for the compute each task uses and resize themselves from past runs.")
+        if configured:
+            advice += f" The DAG currently uses {configured}."
+        return advice
+
+    def to_dict(self) -> dict:
+        slack = self.get_slack()
+        return {
+            'latency_seconds': self.latency,
+            'total_task_seconds': self.get_total_work(),
+            'max_parallel_width': self.get_max_width(),
+            'critical_path': self.critical_path,
+            'tasks': {node: {'seconds': self.durations[node], 'earliest_start': self.earliest_start[node],
+                             'latest_start': self.latest_start[node], 'slack': slack[node]}
+                      for node in nx.topological_sort(self.digraph)}
+        }
+
+    def write(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+def get_durations(digraph: nx.DiGraph, runtimes: dict) -> dict:
+    '''
+    Median runtime of every task in digraph. Tasks without history count as taking no time
+    '''
+    durations = {}
+    for node in digraph.nodes:
+        history = runtimes.get(node.lower())
+        if history:
+            durations[node] = statistics.median(history)
+        else:
+            logging.warning(f"No runtime history for task {node}, assuming 0 seconds")
+    return durations
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
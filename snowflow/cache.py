@@ -0,0 +1,159 @@
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import atexit
+import json
+import sys
+import os
+
+CACHE_VERSION = 1
+# Files larger than this are split on every run instead of being kept in the cache
+MAX_CACHED_FILE_SIZE = 8 * 1024 * 1024
+
+class ProjectCache:
+    '''
+    Keeps split SQL statements, parsed yaml files and folder listings of the project between runs.
+    Entries are keyed on the file path and are only used while the file mtime and size are unchanged.
+    Parsed yaml is also keyed on the variables substituted into it.
+    The cache is written to .snowflow/cache.json when the process exits.
+    Set the environment variable SNOWFLOW_CACHE=0 to turn it off.
+    '''
+    def __init__(self, path: Path, enabled: bool = True):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.entries = self._load() if enabled else {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_VERSION:
+                return {}
+            return data.get('entries', {})
+        except (json.JSONDecodeError, OSError) as e:
+            logging.debug(f"Ignoring unreadable project cache {self.path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        with self.lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix('.tmp')
+                with open(tmp_path, 'w') as f:
+                    json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except OSError as e:
+                logging.warning(f"Could not write project cache {self.path}: {e}")
+
+    def get_stamp(self, path: Path) -> list:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get(self, kind: str, path: Path, extra: str = ''):
+        '''
+        Return the cached value for path, or None if there is none or the file changed since
+        '''
+        if not self.enabled:
+            return None
+        key = kind + ':' + os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            if entry['stamp'] != self.get_stamp(path) or entry.get('extra', '') != extra:
+                return None
+        except OSError:
+            return None
+        return entry['value']
+
+    def put(self, kind: str, path: Path, value, extra: str = '') -> None:
+        if not self.enabled:
+            return
+        try:
+            entry = {'stamp': self.get_stamp(path), 'extra': extra, 'value': value}
+            json.dumps(value)
+        except (OSError, TypeError, ValueError):
+            return
+        with self.lock:
+            self.entries[kind + ':' + os.path.abspath(path)] = entry
+            self.dirty = True
+
+    def invalidate(self, paths: list[Path]) -> int:
+        '''
+        Drop the entries of paths and the folder listings that include them. Returns how many were dropped
+        '''
+        paths = {os.path.abspath(path) for path in paths}
+        paths |= {os.path.dirname(path) for path in paths}
+        with self.lock:
+            keys = [key for key in self.entries if key.partition(':')[2] in paths]
+            for key in keys:
+                del self.entries[key]
+            if keys:
+                self.dirty = True
+        return len(keys)
+
+    def list_files(self, folder: Path, pattern: str) -> list[Path]:
+        '''
+        Sorted files in folder matching pattern. A folder mtime changes when files are added or removed
+        '''
+        folder = Path(folder)
+        if not folder.is_dir():
+            return []
+        cached = self.get('glob', folder, pattern)
+        if cached is not None:
+            return [Path(f) for f in cached]
+        files = sorted(folder.glob(pattern))
+        self.put('glob', folder, [str(f) for f in files], pattern)
+        return files
+
+    def get_statements(self, path: Path):
+        '''
+        Return the cached [[text, line], ...] statements of a sql file, or None
+        '''
+        return self.get('sql', path)
+
+    def put_statements(self, path: Path, statements: list) -> None:
+        self.put('sql', path, statements)
+
+    def is_cacheable(self, path: Path) -> bool:
+        try:
+            return self.enabled and os.stat(path).st_size <= MAX_CACHED_FILE_SIZE
+        except OSError:
+            return False
+
+def get_fingerprint(values: dict) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+_project_cache = None
+_project_cache_lock = threading.Lock()
+
+def get_project_cache() -> ProjectCache:
+    '''
+    The cache of the project in the current working directory, shared by the whole process
+    '''
+    global _project_cache
+    with _project_cache_lock:
+        path = Path(os.getcwd(), '.snowflow', 'cache.json')
+        if _project_cache is None or _project_cache.path != path:
+            if _project_cache is not None:
+                _project_cache.save()
+            _project_cache = ProjectCache(path, os.environ.get('SNOWFLOW_CACHE', '1') != '0')
+        return _project_cache
+
+@atexit.register
+def _save_project_cache() -> None:
+    if _project_cache is not None:
+        _project_cache.save()
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
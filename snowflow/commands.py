@@ -1,14 +1,35 @@
+from __future__ import annotations
+from .lazy import LazyModule
 import logging
-from . import runner
-from . import scripts
-from snowflake.connector.errors import ProgrammingError, DatabaseError
+# Heavy modules are imported on first use so the CLI starts without loading Snowpark or networkx
+runner = LazyModule('snowflow.runner')
+scripts = LazyModule('snowflow.scripts')
+executor = LazyModule('snowflow.executor')
+manifest = LazyModule('snowflow.manifest')
+plan = LazyModule('snowflow.plan')
+state = LazyModule('snowflow.state')
+profiling = LazyModule('snowflow.profiling')
+analysis = LazyModule('snowflow.analysis')
+results = LazyModule('snowflow.results')
+server = LazyModule('snowflow.server')
+watch = LazyModule('snowflow.watch')
+loader = LazyModule('snowflow.loader')
+errors = LazyModule('snowflake.connector.errors')
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+import threading
+import fnmatch
+import os
+import time
 import sys
 
 class Argument:
-    def __init__(self, option, required, help):
+    def __init__(self, option, required, help, action=None):
         self.option = option
         self.required = required
         self.help = help
+        self.action = action
 
 class SnowFlowCommand:
     def __init__(self) -> None:
@@ -22,17 +43,52 @@ class SnowFlowCommand:
     def run(self, options) -> None:
         pass
 
+class DeployStopped(Exception):
+    pass
+
 class Deploy:
-    help = 'Deploy account, database, or schema objects. Requires -e to specify the environment.'
+    help = 'Deploy account, database, or schema objects. Requires -e to specify the environment, or a comma separated list of environments to deploy to concurrently.'
     args = [
+        Argument('--continue_on_error', False, 'With several environments, keep deploying the others when one fails instead of stopping them all', action='store_true'),
+        Argument('--all', False, 'Deploy the account, every database and every schema in one run', action='store_true'),
+        Argument('--schemas', False, 'Comma separated glob patterns of database.schema to deploy, e.g. "demo.*,sales.raw_*"'),
+        Argument('--schema_workers', False, 'Max number of schemas to compile and deploy concurrently, each deploying on its own session. Defaults to 1'),
         Argument('-d', False, 'Specify Database name - Should match the folder'),
-        Argument('-s', False, 'Specify Schema name - Should match the folder')
+        Argument('-s', False, 'Specify Schema name - Should match the folder'),
+        Argument('-j', False, 'Max number of statements to run concurrently within an object group. Defaults to 1'),
+        Argument('-w', False, 'After deploying, keep the session open and redeploy each object file of the deployed schemas when it is saved', action='store_true'),
+        Argument('--full', False, 'Deploy every object, including objects unchanged since the last deploy', action='store_true'),
+        Argument('--state_diff', False, 'Skip views, udfs and stored procedures whose definition in Snowflake already matches the local SQL', action='store_true'),
+        Argument('--resume', False, 'Continue a failed deploy from the statements that did not complete, unless its plan changed since', action='store_true'),
+        Argument('--state_table', False, 'Fully qualified Snowflake table to keep the deploy manifest in. Defaults to a local file under .snowflow/'),
+        Argument('--async', False, 'Submit concurrent statements as async queries and poll them instead of holding a thread per statement', action='store_true'),
+        Argument('--timeout', False, 'Cancel a concurrent statement that runs for longer than this many seconds'),
+        Argument('--batch_size', False, 'Max statements sent in one round trip for grants, roles and other short DDL. Defaults to 50, 1 sends every statement on its own'),
+        Argument('--compress_mb', False, 'Gzip staged CSV files of at least this many MB when uploading them'),
+        Argument('--profile', False, 'Time every compile step, statement and upload and log the slowest at the end', action='store_true'),
+        Argument('--profile_top', False, 'Number of slowest statements in the profile report. Defaults to 20'),
+        Argument('--profile_out', False, 'Also write the profile to this file: .csv for CSV, .trace.json for a Chrome trace, otherwise JSON')
     ]
 
     def __init__(self, environment: str = None) -> None:
         self.name = 'Deploy'
         self.environment = environment
         self.args = self.get_args()
+        self.max_workers = 1
+        self.asynchronous = False
+        self.timeout = None
+        self.batch_size = 1
+        self.compress_min_size = None
+        self.manifest = None
+        self.checkpoint = None
+        self.state_diff = False
+        self.schema_states = {}
+        self.profiler = None
+        self.profile_top = 20
+        self.profile_out = None
+        self.plans = {}
+        self.shared_plans = None
+        self.stop_event = None
     
     @classmethod
     def get_args(cls):
@@ -41,9 +97,39 @@ class Deploy:
     def run(self, args: dict) -> None:
         if self.environment is None:
             raise ValueError("The '-e' argument is required for 'deploy' command.")
+        environments = [env.strip() for env in self.environment.split(',') if env.strip()]
+        if args.get('w') and (len(environments) > 1 or not (args.get('all') or args.get('schemas') or args.get('s'))):
+            raise ValueError("deploy -w watches schemas of one environment. Give -d and -s, --schemas or --all.")
+        if len(environments) > 1:
+            self.deploy_environments(environments, args)
+            return
         try:
-            user = runner.SnowflakeUser(self.environment)
-            if args.get('d')==None:
+            self.set_options(args)
+            # Compile everything first, so missing files and circular references fail before logging in
+            self.compile_plans(args)
+            self.execute(args)
+        except ValueError as ve:
+            logging.error(f"Deployment error: {ve}")
+            raise 
+        except errors.DatabaseError as de:
+            logging.error(f"Database error during deployment: {de}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error during deployment: {e}")
+            raise
+        finally:
+            self.report_profile()
+
+    def execute(self, args: dict) -> None:
+        '''
+        Log in and deploy the compiled plans
+        '''
+        with runner.SnowflakeUser(self.environment, profiler=self.profiler) as user:
+            self.manifest = self.get_manifest(user, args.get('state_table'), bool(args.get('full')))
+            if args.get('all') or args.get('schemas'):
+                logging.info('Snowflow deploy all')
+                self.deploy_all(user, bool(args.get('all')), args.get('schemas') or '*.*', int(args.get('schema_workers') or 1))
+            elif args.get('d')==None:
                 logging.info('Snowflow deploy account')
                 self.account(user)
             elif args.get('s')==None:
@@ -52,58 +138,388 @@ class Deploy:
             else:
                 logging.info('Snowflow deploy schema')
                 self.schema(user, args.get('d'), args.get('s'))
-        except ValueError as ve:
-            logging.error(f"Deployment error: {ve}")
-            raise 
-        except DatabaseError as de:
-            logging.error(f"Database error during deployment: {de}")
-            raise
-        except Exception as e:
-            logging.error(f"Unexpected error during deployment: {e}")
-            logging.warning("Continuing execution; non-critical error")
+            if args.get('w'):
+                self.watch(user, args)
+
+    def watch(self, user: runner.SnowflakeUser, args: dict) -> None:
+        '''
+        Redeploy the changed files of the deployed schemas until interrupted
+        '''
+        if args.get('all') or args.get('schemas'):
+            schemas = [(schema.database.name, schema.name)
+                       for schema in self.select_schemas(scripts.SnowflakeAcct(self.environment), args.get('schemas') or '*.*')]
+        else:
+            schemas = [(args.get('d'), args.get('s'))]
+        watch.DeployWatch(self, user, schemas).run()
+
+    def deploy_environments(self, environments: list[str], args: dict) -> dict:
+        '''
+        Deploy the same scope to several environments at once, each with its own session and manifest.
+        Plans are compiled once for every distinct set of query variables, before any environment logs in.
+        Unless continue_on_error is set, the first failure stops the other environments at their next step.
+        Returns {environment: (seconds, status, error)}.
+        '''
+        continue_on_error = bool(args.get('continue_on_error'))
+        stop_event = threading.Event()
+        shared_plans = {}
+        results = {}
+        deploys = {}
+        for env in environments:
+            deploy = type(self)(env)
+            deploy.set_options(args)
+            deploy.shared_plans = shared_plans
+            deploy.stop_event = None if continue_on_error else stop_event
+            if deploy.profile_out:
+                # profile.trace.json becomes profile_<env>.trace.json
+                path = Path(deploy.profile_out)
+                base, dot, suffixes = path.name.partition('.')
+                deploy.profile_out = path.with_name(f"{base}_{env}{dot}{suffixes}")
+            try:
+                deploy.compile_plans(args)
+                deploys[env] = deploy
+            except Exception as e:
+                logging.error(f"Could not compile the deploy for {env}: {e}")
+                if not continue_on_error:
+                    raise
+                results[env] = (0.0, 'failed', str(e))
+
+        def deploy_environment(env: str) -> None:
+            start = time.perf_counter()
+            try:
+                deploys[env].execute(args)
+                results[env] = (time.perf_counter() - start, 'deployed', '')
+            except Exception as e:
+                status = 'stopped' if isinstance(e, DeployStopped) else 'failed'
+                results[env] = (time.perf_counter() - start, status, str(e))
+                logging.error(f"Deploy to {env} {status}: {e}")
+                stop_event.set()
+            finally:
+                deploys[env].report_profile()
+
+        logging.info(f"Deploying to {len(deploys)} environments: {', '.join(deploys)}")
+        with ThreadPoolExecutor(max_workers=max(len(deploys), 1)) as pool:
+            list(pool.map(deploy_environment, deploys))
+        self.log_environment_results(environments, results)
+        failed = [env for env in environments if results.get(env, (0, 'failed'))[1] != 'deployed']
+        if failed:
+            raise RuntimeError(f"Deploy did not complete for {', '.join(failed)}")
+        return results
+
+    def log_environment_results(self, environments: list[str], results: dict) -> None:
+        logging.info('Environment deploy summary:')
+        for env in environments:
+            seconds, status, error = results.get(env, (0.0, 'failed', ''))
+            logging.info(f"  {env:<30} {seconds:>9.2f}s  {status}{'  ' + error if error else ''}")
+
+    def set_options(self, args: dict) -> None:
+        self.max_workers = int(args.get('j') or 1)
+        self.asynchronous = bool(args.get('async'))
+        self.timeout = float(args['timeout']) if args.get('timeout') else None
+        self.batch_size = int(args.get('batch_size') or executor.DEFAULT_BATCH_SIZE)
+        self.state_diff = bool(args.get('state_diff')) and not args.get('full')
+        self.checkpoint = manifest.DeployCheckpoint(manifest.get_local_checkpoint_path(self.environment), bool(args.get('resume')))
+        self.compress_min_size = int(float(args['compress_mb']) * 1024 * 1024) if args.get('compress_mb') else None
+        if args.get('profile') or args.get('profile_out'):
+            self.profiler = profiling.DeployProfiler()
+            self.profile_top = int(args.get('profile_top') or 20)
+            self.profile_out = args.get('profile_out')
+
+    def report_profile(self) -> None:
+        if self.profiler is None:
+            return
+        self.profiler.log_report(self.profile_top)
+        if self.profile_out:
+            path = self.profiler.write(self.profile_out)
+            logging.info(f"Deploy profile written to {path}")
+
+    def get_manifest(self, user: runner.SnowflakeUser, state_table: str = None, full: bool = False) -> manifest.DeployManifest:
+        if state_table:
+            store = manifest.SnowflakeManifestStore(user, state_table)
+        else:
+            store = manifest.LocalManifestStore(manifest.get_local_manifest_path(self.environment))
+        return manifest.DeployManifest(store, full)
+
+    def get_plan(self, db_name: str = None, schema_name: str = None) -> plan.DeployPlan:
+        '''
+        The compiled plan of the account, a database or a schema, compiled once per run
+        '''
+        key = (db_name, schema_name)
+        if key not in self.plans:
+            self.plans[key] = self.compile_plan(db_name, schema_name)
+        return self.plans[key]
+
+    def compile_plan(self, db_name: str = None, schema_name: str = None) -> plan.DeployPlan:
+        '''
+        Compile a plan, or with shared_plans reuse the plan of another environment that has the same query variables
+        '''
+        if self.shared_plans is None:
+            return plan.PlanCompiler(self.environment, self.profiler).compile(db_name, schema_name)
+        fingerprint = scripts.Environment(self.environment).sp.get_substitutions_fingerprint()
+        key = (fingerprint, db_name, schema_name)
+        if key in self.shared_plans:
+            shared = self.shared_plans[key]
+            logging.info(f"Reusing the {shared} plan compiled for {shared.environment} in {self.environment}, the query variables match")
+            return plan.DeployPlan(self.environment, shared.scope, shared.steps)
+        self.shared_plans[key] = plan.PlanCompiler(self.environment, self.profiler).compile(db_name, schema_name)
+        return self.shared_plans[key]
+
+    def compile_plans(self, args: dict) -> None:
+        '''
+        Compile every plan the deploy needs. With schema_workers, plans compile concurrently:
+        each compiles in its own variable scope, so they share nothing that changes
+        '''
+        if args.get('all') or args.get('schemas'):
+            acct = scripts.SnowflakeAcct(self.environment)
+            keys = []
+            if args.get('all'):
+                keys.append((None, None))
+                keys.extend((db.name, None) for db in acct.get_databases())
+            keys.extend((schema.database.name, schema.name) for schema in self.select_schemas(acct, args.get('schemas') or '*.*'))
+        else:
+            keys = [(args.get('d'), args.get('s') if args.get('d') else None)]
+        keys = [key for key in keys if key not in self.plans]
+        workers = min(int(args.get('schema_workers') or 1), len(keys))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                compiled = list(pool.map(lambda key: self.compile_plan(*key), keys))
+            self.plans.update(zip(keys, compiled))
+        for key in keys:
+            self.get_plan(*key)
 
     def account(self, user: runner.SnowflakeUser) -> None:
-        user.session.query_tag= 'Snowflow deploy account'
-        acct = scripts.SnowflakeAcct(self.environment)
-        user.run_queries(acct.get_init(), object_type = "init")
-
-        user.run_queries(acct.get_path_objects('roles'), object_type = "roles")
-        user.run_queries(acct.get_path_objects('warehouses'), object_type = "warehouses")
-        user.run_queries(acct.get_path_objects('integrations'), object_type = "integrations")
-        user.run_queries(acct.get_path_objects('network_rules'), object_type = "network_rules")
-        user.run_queries(acct.get_path_objects('network_policies'), object_type = "network_policies")
-        user.run_queries(acct.get_grants(), object_type = "grants")
+        self.apply(user, self.get_plan())
         logging.info('Account deployed')
 
     def database(self, user: runner.SnowflakeUser, db_name:str) -> None:
-        user.session.query_tag= 'Snowflow Deploy Database: '+db_name
-        acct = scripts.SnowflakeAcct(self.environment)
-        db = scripts.SnowflakeDB(db_name,acct)
-        user.run_queries(db.get_db_init())
+        self.apply(user, self.get_plan(db_name))
         logging.info('Database Deployed')
 
     def schema(self, user: runner.SnowflakeUser, db_name:str, schema_name: str) -> None:
-        user.session.query_tag= 'Snowflow Deploy Schema: '+db_name+'.'+schema_name
+        self.apply(user, self.get_plan(db_name, schema_name))
+        logging.info('Schema Deployed')
+
+    def apply(self, user: runner.SnowflakeUser, deploy_plan: plan.DeployPlan) -> None:
+        '''
+        Run the steps of a compiled plan in order, checkpointing every completed step and statement.
+        Steps that completed before a failure are skipped when resuming, except the ones that set session state.
+        '''
+        progress = self.checkpoint.start(deploy_plan) if self.checkpoint is not None else None
+        schema_state = self.get_schema_state(user, deploy_plan)
+        user.on_query_done = progress.mark_statement if progress is not None else None
+        try:
+            for index, step in enumerate(deploy_plan.steps):
+                if self.stop_event is not None and self.stop_event.is_set():
+                    raise DeployStopped(f"Stopped deploying {deploy_plan} in {self.environment} because another environment failed")
+                phase = step.get('object_type') or step['action']
+                if progress is not None and progress.is_step_done(index) and step['action'] in ('run', 'put'):
+                    logging.info(f"Skipping {deploy_plan} {phase}, it completed before the last failure")
+                    continue
+                with profiling.measure(self.profiler, 'step', phase, f"{deploy_plan} {phase}"):
+                    self.apply_step(user, step, progress, schema_state)
+                if progress is not None:
+                    progress.complete_step(index)
+        finally:
+            user.on_query_done = None
+        if self.checkpoint is not None:
+            self.checkpoint.finish(deploy_plan)
+
+    def get_schema_state(self, user: runner.SnowflakeUser, deploy_plan: plan.DeployPlan) -> state.SchemaState:
+        '''
+        The existing objects of the plan's schema with state_diff, fetched once per deploy
+        '''
+        if not self.state_diff or not deploy_plan.scope.get('schema'):
+            return None
+        key = (deploy_plan.scope['database'], deploy_plan.scope['schema'])
+        if key not in self.schema_states:
+            self.schema_states[key] = state.SchemaState(user, *key)
+        return self.schema_states[key]
+
+    def apply_step(self, user: runner.SnowflakeUser, step: dict, progress: manifest.PlanProgress = None,
+                   schema_state: state.SchemaState = None) -> None:
+        if step['action'] == 'query_tag':
+            user.session.query_tag = step['value']
+        elif step['action'] == 'use_schema':
+            user.session.use_schema(step['name'])
+        elif step['action'] == 'put':
+            self.post_files(user, step['files'])
+        elif step['action'] == 'run' and step.get('tracked'):
+            self.run_files(user, step['files'], object_type = step['object_type'], parallel = step.get('parallel', False),
+                           progress = progress, schema_state = schema_state)
+        elif step['action'] == 'run':
+            file_queries = progress.get_remaining(step['files']) if progress is not None else step['files']
+            if self.is_batched(step['object_type']):
+                executor.BatchExecutor(user, self.batch_size).run(file_queries, object_type = step['object_type'])
+            else:
+                queries = [query for queries in file_queries.values() for query in queries]
+                user.run_queries(queries, object_type = step['object_type'])
+        else:
+            raise ValueError(f"Unknown plan step action {step['action']}")
+
+    def deploy_all(self, user: runner.SnowflakeUser, include_account: bool = True, patterns: str = '*.*', workers: int = 1) -> dict:
+        '''
+        Deploy every schema matching patterns, optionally after the account and database objects.
+        Schemas that do not reference each other are deployed concurrently, up to workers at a time, each on
+        a session from the environment's session pool. With one worker every schema is deployed on user.
+        Returns {schema: (seconds, status)}.
+        '''
         acct = scripts.SnowflakeAcct(self.environment)
-        db = scripts.SnowflakeDB(db_name,acct)
-        schema = scripts.SnowflakeSchema(schema_name, db)
+        if include_account:
+            self.account(user)
+            for db in acct.get_databases():
+                self.database(user, db.name)
 
-        user.run_queries(schema.get_schema_init(),  object_type = "init")
-        user.session.use_schema(schema_name)
-
-        user.run_queries(schema.get_path_objects('file_formats'), object_type = "file_formats")
-        user.run_queries(schema.get_path_objects('stages'), object_type = "stages")
-        user.post_files(schema.get_staged_files())
-        user.run_queries(schema.get_path_objects('udfs'), object_type = "udfs")
-        user.run_queries(schema.get_path_objects('tables'), object_type = "tables")
-        user.run_queries(schema.get_path_objects('views'), object_type = "views")
-        user.run_queries(schema.get_path_objects('streams'), object_type = "streams")
-        user.run_queries(schema.get_path_objects('stored_procs', single_transaction=True), object_type = "stored_procs")
-        user.run_queries(schema.get_path_objects('tasks'), object_type = "tasks")
-        user.run_queries(schema.get_dags(), object_type = "dags")
-        user.run_queries(schema.get_path_objects('post_deploy'), object_type = "post_deploy")
-        user.run_queries(schema.get_grants(), object_type = "grants")
-        logging.info('Schema Deployed')
+        schemas = {str(schema): schema for schema in self.select_schemas(acct, patterns)}
+        digraph = acct.get_schema_digraph(list(schemas.values()))
+        # The user keeps its own session for the manifest, the workers share the rest of the pool
+        pool = runner.get_session_pool(self.environment, workers + 1) if workers > 1 else None
+        logging.info(f"Deploying {len(schemas)} schemas with up to {workers} sessions")
+        timings = {}
+
+        def deploy_schema(key: str) -> None:
+            schema = schemas[key]
+            start = time.perf_counter()
+            status = 'failed'
+            try:
+                with (pool.user(self.profiler) if pool else nullcontext(user)) as schema_user:
+                    schema_user.session.use_database(schema.database.name)
+                    self.schema(schema_user, schema.database.name, schema.name)
+                status = 'deployed'
+            finally:
+                timings[key] = (time.perf_counter() - start, status)
+
+        try:
+            executor.run_dag(digraph, deploy_schema, workers)
+        finally:
+            self.log_timings(timings)
+        return timings
+
+    def select_schemas(self, acct: scripts.SnowflakeAcct, patterns: str) -> list:
+        patterns = [p.strip().lower() for p in patterns.split(',') if p.strip()]
+        schemas = [schema for db in acct.get_databases() for schema in db.get_schemas()]
+        return [schema for schema in schemas if any(fnmatch.fnmatchcase(str(schema).lower(), p) for p in patterns)]
+
+    def log_timings(self, timings: dict) -> None:
+        logging.info('Schema deploy timings:')
+        for key, (seconds, status) in sorted(timings.items(), key=lambda item: item[1][0], reverse=True):
+            logging.info(f"  {key:<40} {seconds:>9.2f}s  {status}")
+
+    def is_batched(self, object_type: str) -> bool:
+        return self.batch_size > 1 and object_type in executor.BATCH_OBJECT_TYPES
+
+    def run_group(self, user: runner.SnowflakeUser, queries: list[str], object_type: str = "") -> list:
+        '''
+        Run one object group, executing independent statements concurrently up to max_workers.
+        The group finishes before the next one starts, so phase ordering is preserved.
+        '''
+        return executor.ParallelExecutor(user, self.max_workers, self.asynchronous, self.timeout).run(queries, object_type=object_type)
+
+    def post_files(self, user: runner.SnowflakeUser, file_configs: list[dict]) -> list:
+        '''
+        Upload the staged files that changed since the last deploy, then record them in the manifest.
+        '''
+        if self.manifest is not None:
+            file_configs = self.manifest.get_changed_staged_files(file_configs)
+        outp = user.post_files(file_configs, max_workers=self.max_workers, compress_min_size=self.compress_min_size)
+        if self.manifest is not None:
+            self.manifest.mark_staged_files(file_configs)
+        return outp
+
+    def run_files(self, user: runner.SnowflakeUser, file_queries: dict, object_type: str = "", parallel: bool = True,
+                  progress: manifest.PlanProgress = None, schema_state: state.SchemaState = None) -> list:
+        '''
+        Run the queries of every object file that changed since the last deploy, then record them in the manifest.
+        If a statement fails, only the files whose statements all completed are recorded.
+        With progress, statements that completed before a failed deploy are not run again.
+        With schema_state, statements that would recreate an object exactly as it exists are not run either.
+        '''
+        if self.manifest is not None:
+            file_queries = self.manifest.get_changed(file_queries, object_type)
+        remaining = progress.get_remaining(file_queries) if progress is not None else file_queries
+        if schema_state is not None and object_type in state.OBJECT_TYPES and remaining:
+            remaining = schema_state.get_changed(object_type, remaining)
+        queries = [query for queries in remaining.values() for query in queries]
+        completion = manifest.FileCompletion(remaining)
+        on_query_done = user.on_query_done
+
+        def mark_statement(query: str) -> None:
+            completion.mark_statement(query)
+            if on_query_done is not None:
+                on_query_done(query)
+
+        user.on_query_done = mark_statement
+        try:
+            if self.is_batched(object_type):
+                outp = executor.BatchExecutor(user, self.batch_size).run(remaining, object_type=object_type)
+            elif parallel:
+                outp = self.run_group(user, queries, object_type=object_type)
+            else:
+                outp = user.run_queries(queries, object_type=object_type)
+        finally:
+            user.on_query_done = on_query_done
+            if self.manifest is not None:
+                self.manifest.mark_deployed({path: file_queries[path] for path in file_queries if completion.is_complete(path)})
+        return outp
+
+class Plan:
+    help = 'Compile the statements a deploy would run into a json plan or SQL bundle, without connecting to Snowflake. Requires -e to specify the environment.'
+    args = [
+        Argument('-d', False, 'Specify Database name - Should match the folder'),
+        Argument('-s', False, 'Specify Schema name - Should match the folder'),
+        Argument('-o', False, 'Output file. Defaults to snowflow_plan.json, or snowflow_plan.sql with --format sql'),
+        Argument('--format', False, 'Output format, json (default, can be applied with snowflow apply) or sql')
+    ]
+
+    def __init__(self, environment: str = None) -> None:
+        self.name = 'plan'
+        self.environment = environment
+
+    @classmethod
+    def get_args(cls):
+        return cls.args
+
+    def run(self, args: dict) -> None:
+        output_format = (args.get('format') or 'json').lower()
+        if output_format not in ('json', 'sql'):
+            raise ValueError(f"Unknown plan format {output_format}. Expected json or sql.")
+        try:
+            deploy_plan = plan.PlanCompiler(self.environment).compile(args.get('d'), args.get('s'))
+            path = deploy_plan.write(args.get('o') or 'snowflow_plan.'+output_format, output_format)
+            logging.info(f"Plan for {deploy_plan} with {len(deploy_plan.get_queries())} statements written to {path}")
+            logging.info(f"Plan hash: {deploy_plan.get_hash()}")
+        except Exception as e:
+            logging.error(f"Unexpected error while compiling plan: {e}")
+            raise
+
+class Apply(Deploy):
+    help = 'Run a json plan compiled by snowflow plan. Requires -e to specify the environment.'
+    args = [
+        Argument('-f', True, 'Plan file written by snowflow plan'),
+    ] + [arg for arg in Deploy.args if arg.option in ('-j', '--full', '--state_diff', '--resume', '--state_table', '--async', '--timeout', '--batch_size', '--compress_mb',
+                                                      '--profile', '--profile_top', '--profile_out')]
+
+    def __init__(self, environment: str = None) -> None:
+        super().__init__(environment)
+        self.name = 'apply'
+
+    def run(self, args: dict) -> None:
+        deploy_plan = plan.DeployPlan.read(args.get('f'))
+        if deploy_plan.environment != self.environment:
+            raise ValueError(f"Plan was compiled for environment {deploy_plan.environment}, not {self.environment}.")
+        try:
+            self.set_options(args)
+            with runner.SnowflakeUser(self.environment, profiler=self.profiler) as user:
+                self.manifest = self.get_manifest(user, args.get('state_table'), bool(args.get('full')))
+                logging.info(f"Snowflow apply plan {deploy_plan.get_hash()} for {deploy_plan}")
+                self.apply(user, deploy_plan)
+                logging.info(f"Plan applied for {deploy_plan}")
+        except errors.DatabaseError as de:
+            logging.error(f"Database error while applying plan: {de}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error while applying plan: {e}")
+            raise
+        finally:
+            self.report_profile()
 
 class Init:
     help = 'Initialize folder structure for account, database, or schema. Does not require -e.'
@@ -191,16 +607,16 @@ class Clone:
                 source = sd+'.'+ss
                 tgt = td+'.'+ts
                 query = 'create or replace schema '+tgt+' clone '+source
-            user = runner.SnowflakeUser(self.environment)
-            logging.info(user.run_query(query))
+            with runner.SnowflakeUser(self.environment) as user:
+                logging.info(user.run_query(query))
 
         except ValueError as ve:
             logging.error(f"Clone error: {ve}")
             raise
-        except DatabaseError as de:
+        except errors.DatabaseError as de:
             logging.error(f"Database error during cloning: {de}")
             raise
-        except ProgrammingError as pe:
+        except errors.ProgrammingError as pe:
             logging.error(f"Programming error during cloning: {pe}")
             raise
         except Exception as e:
@@ -212,7 +628,11 @@ class RunScript:
     args = [
         Argument('-d', False, 'Database name. Specified in a use_database statement'),
         Argument('-s', False, 'Schema name. Specified in a use_schema statement'),
-        Argument('-f', True, 'Script Path relative to the Root folder')
+        Argument('-f', True, 'Script Path relative to the Root folder'),
+        Argument('--head', False, 'Number of rows of each result to log. Defaults to 10'),
+        Argument('--output', False, 'Stream the rows of each statement to this csv, jsonl or parquet file instead of logging them. With several statements, files are numbered from 1'),
+        Argument('--format', False, 'Format of --output when its extension does not say: csv, jsonl or parquet'),
+        Argument('--discard', False, 'Do not fetch or log any result rows', action='store_true')
     ]
 
     def __init__(self, environment: str = None) -> None:
@@ -229,20 +649,30 @@ class RunScript:
             schema= args.get('s')
             script_path= args.get('f')
 
-            user = runner.SnowflakeUser(self.environment)
+            handler = results.ResultHandler(int(args.get('head') or results.DEFAULT_HEAD_ROWS), args.get('output'),
+                                            args.get('format'), bool(args.get('discard')))
+
             env = scripts.Environment(self.environment)
             path = env.dh.get_absolute_path(script_path)
-            queries = env.sp.read_file_queries(path)
-            if database:
-                user.session.use_database(database)
-            if schema:
-                user.session.use_schema(schema)
-            logging.info(user.run_queries(queries))
+            statements = list(env.sp.read_file_statements(path))
+            with runner.SnowflakeUser(self.environment) as user:
+                if database:
+                    user.session.use_database(database)
+                if schema:
+                    user.session.use_schema(schema)
+                for index, statement in enumerate(statements):
+                    logging.info(f"Executing statement at {statement.get_location()}")
+                    try:
+                        # Rows are fetched while the handler consumes them, so a large result is never held in memory
+                        handler.handle(user.stream_query(statement.text), statement.get_location(), index, len(statements))
+                    except (errors.ProgrammingError, errors.DatabaseError):
+                        logging.error(f"Statement failed at {statement.get_location()}")
+                        raise
 
         except ValueError as ve:
             logging.error(f"RunScript error: {ve}")
             raise
-        except DatabaseError as de:
+        except errors.DatabaseError as de:
             logging.error(f"Database error while running script: {de}")
             raise
         except Exception as e:
@@ -253,7 +683,10 @@ class TestDAG:
     args = [
         Argument('-d', True, 'Database name'),
         Argument('-s', True, 'Schema name'),
-        Argument('-f', True, 'DAG file name relative to DAG folder')
+        Argument('-f', True, 'DAG file name relative to DAG folder'),
+        Argument('--execute', False, 'Run the SQL of every task directly in dependency order instead of creating the tasks', action='store_true'),
+        Argument('-j', False, 'With --execute, max number of tasks to run concurrently. Defaults to 1'),
+        Argument('--history_out', False, 'With --execute, append the task runtimes to this CSV for analyze_dag')
     ]
 
     def __init__(self, environment: str = None) -> None:
@@ -271,21 +704,207 @@ class TestDAG:
         acct = scripts.SnowflakeAcct(self.environment)
         db = scripts.SnowflakeDB(database,acct)
         schema = scripts.SnowflakeSchema(schema_name, db)
-        queries= schema.get_dag(script_path)
+        dag = schema.get_task_dag(script_path)
+        if dag is None:
+            raise ValueError(f"Could not find DAG {script_path} in {schema}")
         try:
-            user = runner.SnowflakeUser(self.environment)
-            user.session.use_schema(schema_name)
-            logging.info(user.run_queries(queries))
-        except DatabaseError as de:
+            with runner.SnowflakeUser(self.environment) as user:
+                user.session.use_database(database)
+                user.session.use_schema(schema_name)
+                if args.get('execute'):
+                    timings = self.execute(user, dag, int(args.get('j') or 1))
+                else:
+                    logging.info(user.run_queries(dag.get_all_queries()))
+            if args.get('execute') and args.get('history_out'):
+                path = analysis.write_task_history(args['history_out'], timings)
+                logging.info(f"Task runtimes appended to {path}")
+        except errors.DatabaseError as de:
             logging.error(f"Database error during DAG test: {de}")
             raise
-        except ProgrammingError as pe:
+        except errors.ProgrammingError as pe:
             logging.error(f"Programming error during DAG test: {pe}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error during DAG test: {e}")
             raise
 
+    def execute(self, user: runner.SnowflakeUser, dag: scripts.TaskDAG, max_workers: int = 1) -> dict:
+        '''
+        Run the script of every task in dag directly, starting a task once the tasks it depends on have finished.
+        Independent tasks run concurrently, up to max_workers at a time. WHEN conditions and schedules are ignored.
+        With more than one worker, each task borrows its own session from the environment's session pool,
+        so a USE, SET or transaction in one task's script does not reach the tasks running beside it.
+        Returns {task name: (start offset, seconds, status)}.
+        '''
+        task_queries = dag.get_task_queries()
+        logging.info(f"Executing {len(task_queries)} tasks of DAG {dag.name} with up to {max_workers} workers")
+        started = time.perf_counter()
+        timings = {}
+        # The user keeps its own session, the tasks share the rest of the pool
+        pool = runner.get_session_pool(user.environment, max_workers + 1) if max_workers > 1 else None
+
+        def run_task(name: str) -> None:
+            start = time.perf_counter()
+            status = 'failed'
+            try:
+                logging.info(f"Starting task {name}")
+                with (pool.user(user.profiler) if pool else nullcontext(user)) as task_user:
+                    if pool:
+                        task_user.session.use_database(dag.schema.database.name)
+                        task_user.session.use_schema(dag.schema.name)
+                    task_user.run_queries(task_queries[name], object_type=name)
+                status = 'succeeded'
+            finally:
+                timings[name] = (start - started, time.perf_counter() - start, status)
+
+        try:
+            executor.run_dag(dag.digraph, run_task, max_workers)
+        finally:
+            self.log_timings(dag, timings, time.perf_counter() - started)
+        return timings
+
+    def log_timings(self, dag: scripts.TaskDAG, timings: dict, total: float) -> None:
+        logging.info(f"DAG {dag.name} task timings:")
+        for name in sorted(dag.digraph.nodes, key=lambda name: timings.get(name, (float('inf'),))[0]):
+            if name in timings:
+                start, seconds, status = timings[name]
+                logging.info(f"  {name:<40} start {start:>8.2f}s  took {seconds:>8.2f}s  {status}")
+            else:
+                logging.info(f"  {name:<40} not run")
+        path, seconds = executor.get_critical_path(dag.digraph, {name: timing[1] for name, timing in timings.items()})
+        logging.info(f"Critical path ({seconds:.2f}s of {total:.2f}s wall time): {' -> '.join(path)}")
+
+class AnalyzeDAG:
+    help = 'Find the critical path, slack and parallelism of a DAG from past task runtimes. Requires -e to specify the environment.'
+    args = [
+        Argument('-d', True, 'Database name'),
+        Argument('-s', True, 'Schema name'),
+        Argument('-f', True, 'DAG file name relative to DAG folder'),
+        Argument('--history', True, 'CSV of task runs, either a TASK_HISTORY export or a file written by test_dag --history_out'),
+        Argument('--overhead', False, 'Seconds of scheduling delay to add in front of every task. Defaults to 0'),
+        Argument('-o', False, 'Also write the analysis to this json file')
+    ]
+
+    def __init__(self, environment: str = None) -> None:
+        self.name = 'analyze_dag'
+        self.environment = environment
+
+    @classmethod
+    def get_args(cls):
+        return cls.args
+
+    def run(self, args: dict) -> None:
+        try:
+            acct = scripts.SnowflakeAcct(self.environment)
+            db = scripts.SnowflakeDB(args.get('d'), acct)
+            schema = scripts.SnowflakeSchema(args.get('s'), db)
+            dag = schema.get_task_dag(args.get('f'))
+            if dag is None:
+                raise ValueError(f"Could not find DAG {args.get('f')} in {schema}")
+            runtimes = analysis.read_task_history(args.get('history'))
+            durations = analysis.get_durations(dag.digraph, runtimes)
+            result = analysis.DAGAnalysis(dag.digraph, durations, float(args.get('overhead') or 0))
+            self.log_analysis(dag, result)
+            if args.get('o'):
+                path = result.write(args['o'])
+                logging.info(f"Analysis written to {path}")
+        except Exception as e:
+            logging.error(f"Unexpected error during DAG analysis: {e}")
+            raise
+
+    def log_analysis(self, dag: scripts.TaskDAG, result: analysis.DAGAnalysis) -> None:
+        slack = result.get_slack()
+        logging.info(f"DAG {dag.name}: {len(dag.digraph)} tasks, expected end to end latency {result.latency:.1f}s, "
+                     f"{result.get_total_work():.1f}s of task time, at most {result.get_max_width()} tasks at once")
+        logging.info(f"Critical path: {' -> '.join(result.critical_path)}")
+        for node in sorted(dag.digraph.nodes, key=lambda node: result.earliest_start[node]):
+            logging.info(f"  {node:<40} {result.durations[node]:>8.1f}s  starts at {result.earliest_start[node]:>8.1f}s  "
+                         f"slack {slack[node]:>8.1f}s{'  critical' if node in result.critical_path else ''}")
+        for finding in result.get_fan_out_findings():
+            logging.info(f"Fan out: {finding}")
+        configured = next((f"{key} {dag.config_dict[key]}" for key in ['INITIAL_WAREHOUSE_SIZE', 'WAREHOUSE'] if dag.config_dict.get(key)), None)
+        logging.info(f"Warehouse: {result.get_warehouse_advice(configured)}")
+
+class Load:
+    help = 'Bulk load the CSV and JSON files under staged_files into tables, in compressed chunks uploaded in parallel. Requires -e to specify the environment.'
+    args = [
+        Argument('-d', True, 'Database name'),
+        Argument('-s', True, 'Schema name'),
+        Argument('--stages', False, 'Comma separated stage folders under staged_files to load. Defaults to all'),
+        Argument('--tables', False, 'Comma separated target tables to load. Defaults to all'),
+        Argument('--chunk_mb', False, 'Compressed size of each chunk in MB. Defaults to 200'),
+        Argument('-j', False, 'Max number of chunks to upload concurrently. Defaults to 4'),
+        Argument('--skip_header', False, 'Header lines of the CSV files, repeated in every chunk. Must match the SKIP_HEADER of the file format. Defaults to 1'),
+        Argument('--file_format', False, 'Named file format for COPY. Defaults to the file format of the stage, or JSON for JSON files'),
+        Argument('--force', False, 'Load every file again, even files that already loaded', action='store_true')
+    ]
+
+    def __init__(self, environment: str = None) -> None:
+        self.name = 'load'
+        self.environment = environment
+
+    @classmethod
+    def get_args(cls):
+        return cls.args
+
+    def run(self, args: dict) -> None:
+        database = args.get('d')
+        schema_name = args.get('s')
+        acct = scripts.SnowflakeAcct(self.environment)
+        schema = scripts.SnowflakeSchema(schema_name, scripts.SnowflakeDB(database, acct))
+        stages = [stage.strip().lower() for stage in (args.get('stages') or '').split(',') if stage.strip()]
+        tables = [table.strip().lower() for table in (args.get('tables') or '').split(',') if table.strip()]
+        journal = loader.LoadJournal(loader.get_local_load_journal_path(self.environment))
+        try:
+            with runner.SnowflakeUser(self.environment) as user:
+                user.session.use_database(database)
+                user.session.use_schema(schema_name)
+                bulk_loader = loader.BulkLoader(user, schema, journal,
+                                                chunk_size=int(float(args.get('chunk_mb') or loader.DEFAULT_CHUNK_MB) * 1024 * 1024),
+                                                skip_header=int(args['skip_header']) if args.get('skip_header') is not None else loader.DEFAULT_SKIP_HEADER,
+                                                workers=int(args.get('j') or 4), file_format=args.get('file_format'),
+                                                force=bool(args.get('force')))
+                loaded_rows = bulk_loader.load(stages, tables)
+            if not loaded_rows:
+                logging.info('Every file has already loaded, nothing to load')
+            for table, rows in loaded_rows.items():
+                logging.info(f"  {table:<40} {rows:>12} rows loaded")
+        except errors.DatabaseError as de:
+            logging.error(f"Database error during load: {de}")
+            raise
+        except errors.ProgrammingError as pe:
+            logging.error(f"Programming error during load: {pe}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error during load: {e}")
+            raise
+
+class Serve:
+    help = 'Run a local server that keeps sessions and the parsed project warm. deploy, run_script and test_dag in the project then run on it. -e optionally lists environments to log in to right away.'
+    args = [
+        Argument('--stop', False, 'Stop the server of the project in the current directory', action='store_true'),
+        Argument('--port', False, 'Local port to listen on. Defaults to any free port'),
+        Argument('--watch_interval', False, 'Seconds between checks of the project files for changes. Defaults to 1')
+    ]
+
+    def __init__(self, environment: str = None) -> None:
+        self.name = 'serve'
+        self.environment = environment
+
+    @classmethod
+    def get_args(cls):
+        return cls.args
+
+    def run(self, args: dict) -> None:
+        if args.get('stop'):
+            server.stop_server()
+            return
+        if server.connect() is not None:
+            raise ValueError(f"A snowflow server is already running for this project, see {server.get_server_file()}")
+        environments = [env.strip() for env in (self.environment or '').split(',') if env.strip()]
+        server.SnowflowServer(os.getcwd(), environments, int(args.get('port') or 0),
+                              float(args.get('watch_interval') or server.DEFAULT_WATCH_INTERVAL)).serve_forever()
+
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,260 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from snowflake.connector.errors import ProgrammingError, DatabaseError
+from .references import get_created_name, get_referenced_names, strip_comments
+import networkx as nx
+import itertools
+import logging
+import sys
+import re
+
+# Object types made of short DDL, where a round trip per statement costs more than running it
+BATCH_OBJECT_TYPES = ['init', 'roles', 'warehouses', 'integrations', 'network_rules', 'network_policies', 'grants']
+DEFAULT_BATCH_SIZE = 50
+# Statements that are safe to run a second time, so a failed batch can be rerun one statement at a time
+BATCHABLE_PATTERN = re.compile(
+    r"^\s*(?:GRANT|REVOKE|COMMENT\s+(?:IF\s+EXISTS\s+)?ON|CREATE\s+OR\s+REPLACE|CREATE\s+(?:[\w$]+\s+){1,3}IF\s+NOT\s+EXISTS"
+    r"|DROP\s+(?:[\w$]+\s+){1,2}IF\s+EXISTS|ALTER\s+(?:[\w$]+\s+){1,2}(?:IF\s+EXISTS\s+)?\S+\s+(?:UN)?SET)\b",
+    re.I)
+# Statements that change the context of the session that every worker shares
+SESSION_PATTERN = re.compile(
+    r"^\s*(?:USE|SET|UNSET|ALTER\s+SESSION|BEGIN|START\s+TRANSACTION|COMMIT|ROLLBACK"
+    r"|CREATE\s+(?:OR\s+REPLACE\s+)?(?:TRANSIENT\s+)?(?:DATABASE|SCHEMA))\b",
+    re.I)
+
+class StatementGraph:
+    '''
+    Dependency graph between the statements of one object group.
+    Nodes are statement indexes. An edge i -> j means statement j has to wait for statement i.
+    Only CREATE statements of objects run concurrently. Any other statement, including every statement
+    that changes the session context, waits for the statements before it and blocks the ones after it.
+    '''
+    def __init__(self, queries: list[str]):
+        self.queries = queries
+        self.digraph = self._get_digraph()
+
+    def _get_digraph(self) -> nx.DiGraph:
+        digraph = nx.DiGraph()
+        digraph.add_nodes_from(range(len(self.queries)))
+        names = [get_object_name(query) for query in self.queries]
+        created = {}
+        for index, name in enumerate(names):
+            if name is None:
+                continue
+            if name in created:
+                # The same object created twice keeps file order
+                digraph.add_edge(created[name][-1], index)
+            created.setdefault(name, []).append(index)
+
+        barrier = None
+        for index, (query, name) in enumerate(zip(self.queries, names)):
+            if name is None:
+                # Anything other than a CREATE (ALTER, INSERT, ...) runs in file order
+                # against every statement before and after it
+                for prior in range(barrier + 1 if barrier is not None else 0, index):
+                    digraph.add_edge(prior, index)
+                if barrier is not None:
+                    digraph.add_edge(barrier, index)
+                barrier = index
+                continue
+            if barrier is not None:
+                digraph.add_edge(barrier, index)
+            for ref in get_referenced_names(query) - {name}:
+                for definer in created.get(ref, []):
+                    digraph.add_edge(definer, index)
+        return digraph
+
+    def is_acyclic(self) -> bool:
+        return nx.is_directed_acyclic_graph(self.digraph)
+
+class ParallelExecutor:
+    '''
+    Runs the statements of an object group concurrently, honoring the dependencies between them.
+    A call to run only returns once every statement in the group has finished, so consecutive
+    calls act as barriers between deploy phases.
+    With asynchronous, statements are submitted as async queries one dependency level at a time
+    instead of holding a thread each.
+    Every worker runs on the session of user, so the statements that run concurrently must not depend on
+    anything one of them changes. StatementGraph only lets CREATE statements overlap, and statements that
+    change the session context (USE, SET, ALTER SESSION, transactions, CREATE DATABASE or SCHEMA) always
+    run on their own.
+    '''
+    def __init__(self, user, max_workers: int = 1, asynchronous: bool = False, timeout: float = None):
+        self.user = user
+        self.max_workers = max(int(max_workers or 1), 1)
+        self.asynchronous = asynchronous
+        self.timeout = timeout
+
+    def run(self, queries: list[str], object_type: str = "") -> list:
+        if self.max_workers == 1 or len(queries) <= 1:
+            return self.user.run_queries(queries, object_type=object_type)
+
+        graph = StatementGraph(queries)
+        if not graph.is_acyclic():
+            logging.warning(f"Circular references found between {object_type} statements. Running them in file order.")
+            return self.user.run_queries(queries, object_type=object_type)
+
+        logging.info(f"Executing {len(queries)} queries for {object_type} with up to {self.max_workers} workers")
+        if self.asynchronous:
+            return self._run_async(graph, object_type)
+        return self._run_graph(graph, object_type)
+
+    def _run_async(self, graph: StatementGraph, object_type: str) -> list:
+        results = [None] * len(graph.queries)
+        for generation in nx.topological_generations(graph.digraph):
+            generation = sorted(generation)
+            for start in range(0, len(generation), self.max_workers):
+                batch = generation[start:start + self.max_workers]
+                batch_results = self.user.run_queries_async([graph.queries[i] for i in batch], object_type=object_type, timeout=self.timeout)
+                for index, result in zip(batch, batch_results):
+                    results[index] = result
+        return results
+
+    def _run_graph(self, graph: StatementGraph, object_type: str) -> list:
+        completed = itertools.count(1)
+
+        def run_query(index: int) -> list:
+            logging.debug(f"Submitting query {index + 1}/{len(graph.queries)} for {object_type}: {graph.queries[index]}")
+            try:
+                result = self.user.run_query(graph.queries[index], object_type)
+            except (ProgrammingError, DatabaseError) as db_error:
+                logging.error(f"Database error in {object_type} query execution: {db_error}")
+                logging.error(f"Query: {graph.queries[index]}")
+                raise
+            logging.info(f"Completed query {next(completed)}/{len(graph.queries)} for {object_type}")
+            return result
+
+        outp = run_dag(graph.digraph, run_query, self.max_workers)
+        logging.debug(f"Completed all queries for {object_type}, with {len(outp)} successful executions.")
+        return [outp[index] for index in range(len(graph.queries))]
+
+def changes_session(query: str) -> bool:
+    return bool(SESSION_PATTERN.match(strip_comments(query)))
+
+def get_object_name(query: str) -> str:
+    '''
+    The object created by query when it can run concurrently with other CREATE statements, otherwise None
+    '''
+    return None if changes_session(query) else get_created_name(query)
+
+def is_batchable(query: str) -> bool:
+    return bool(BATCHABLE_PATTERN.match(strip_comments(query)))
+
+class BatchExecutor:
+    '''
+    Runs the statements of object files in multi-statement batches, one round trip per batch.
+    Only consecutive batchable statements are packed together, up to batch_size at a time; anything else
+    runs on its own in between, in file order. When a batch fails, its statements are run again one at
+    a time to find the statement that failed, which is logged with its file and position.
+    '''
+    def __init__(self, user, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = max(int(batch_size or 1), 1)
+
+    def get_batches(self, statements: list[tuple[str, int, str]]) -> list[list[int]]:
+        '''
+        Group the indexes of (source, number, query) statements into the batches they run in
+        '''
+        batches = []
+        current = []
+        for index, (_, _, query) in enumerate(statements):
+            if not query.strip() or not is_batchable(query):
+                if current:
+                    batches.append(current)
+                    current = []
+                batches.append([index])
+                continue
+            current.append(index)
+            if len(current) >= self.batch_size:
+                batches.append(current)
+                current = []
+        if current:
+            batches.append(current)
+        return batches
+
+    def run(self, file_queries: dict, object_type: str = "") -> list:
+        '''
+        Run {source: [queries]} in order and return the result of every query
+        '''
+        statements = [(source, number, query) for source, queries in file_queries.items()
+                      for number, query in enumerate(queries, start=1)]
+        if self.batch_size == 1 or not self.user.supports_batches():
+            return self.user.run_queries([query for _, _, query in statements], object_type=object_type)
+        batches = self.get_batches(statements)
+        logging.info(f"Executing {len(statements)} queries for {object_type} in {len(batches)} round trips")
+        results = [[] for _ in statements]
+        for batch in batches:
+            queries = [statements[index][2] for index in batch]
+            if len(batch) == 1:
+                results[batch[0]] = self.run_statement(statements[batch[0]], object_type)
+                continue
+            try:
+                batch_results = self.user.run_batch(queries, object_type)
+            except (ProgrammingError, DatabaseError):
+                logging.warning(f"A batch of {len(batch)} {object_type} statements failed, running them one at a time")
+                batch_results = [self.run_statement(statements[index], object_type) for index in batch]
+            for index, result in zip(batch, batch_results):
+                results[index] = result
+        return results
+
+    def run_statement(self, statement: tuple[str, int, str], object_type: str = "") -> list:
+        source, number, query = statement
+        try:
+            return self.user.run_query(query, object_type)
+        except (ProgrammingError, DatabaseError):
+            logging.error(f"Statement {number} of {source} failed")
+            raise
+
+def run_dag(digraph: nx.DiGraph, work, max_workers: int = 1) -> dict:
+    '''
+    Call work(node) for every node of digraph on a thread pool, starting a node once all of its
+    predecessors have finished. Returns {node: result}.
+    The first error stops new nodes from being started and is raised once the running ones finish.
+    '''
+    outp = {}
+    waiting_on = {node: digraph.in_degree(node) for node in digraph.nodes}
+    ready = sorted(node for node, count in waiting_on.items() if count == 0)
+    running = {}
+
+    pool = ThreadPoolExecutor(max_workers=max(int(max_workers or 1), 1))
+    try:
+        while ready or running:
+            while ready:
+                node = ready.pop(0)
+                running[pool.submit(work, node)] = node
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                outp[node] = future.result()
+                for successor in sorted(digraph.successors(node)):
+                    waiting_on[successor] -= 1
+                    if waiting_on[successor] == 0:
+                        ready.append(successor)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return outp
+
+def get_critical_path(digraph: nx.DiGraph, durations: dict) -> tuple[list, float]:
+    '''
+    Return the chain of nodes through digraph with the longest total duration, and that duration.
+    Nodes missing from durations count as taking no time.
+    '''
+    finish = {}
+    previous = {}
+    for node in nx.topological_sort(digraph):
+        slowest = max(digraph.predecessors(node), key=lambda predecessor: finish[predecessor], default=None)
+        previous[node] = slowest
+        finish[node] = (finish[slowest] if slowest is not None else 0.0) + durations.get(node, 0.0)
+    if not finish:
+        return [], 0.0
+    node = max(finish, key=finish.get)
+    total = finish[node]
+    path = []
+    while node is not None:
+        path.append(node)
+        node = previous[node]
+    return path[::-1], total
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
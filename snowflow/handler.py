@@ -1,7 +1,10 @@
 import logging
 import sys
+import os
 import argparse
 from . import commands
+from .lazy import LazyModule
+server = LazyModule('snowflow.server')
 
 class ArgHandler:
     def __init__(self) -> None:
@@ -16,6 +19,11 @@ class ArgHandler:
             'clone': commands.Clone,
             'run_script': commands.RunScript,
             'test_dag': commands.TestDAG,
+            'analyze_dag': commands.AnalyzeDAG,
+            'plan': commands.Plan,
+            'apply': commands.Apply,
+            'serve': commands.Serve,
+            'load': commands.Load,
         }
         return mapper
 
@@ -51,11 +59,24 @@ class ArgHandler:
             usage=argparse.SUPPRESS  
         )
     
-        if command_name != 'init':
+        if command_name == 'serve':
+            parser.add_argument('-e', dest='environment', required=False, help='Comma separated environments to log in to when the server starts', metavar='')
+        elif command_name != 'init':
             parser.add_argument('-e', dest='environment', required=True, help='Specify the environment', metavar='')
 
         for arg in command_args:
-            parser.add_argument(arg.option, required=arg.required, help=arg.help, metavar='')
+            if arg.action:
+                parser.add_argument(arg.option, required=arg.required, help=arg.help, action=arg.action)
+            else:
+                parser.add_argument(arg.option, required=arg.required, help=arg.help, metavar='')
+
+    def is_served(self, cmd: str, args: dict) -> bool:
+        '''
+        Whether to send the command to a snowflow serve process of this project, when one is running.
+        Set SNOWFLOW_SERVER=0 to always run locally. deploy -w runs locally, it would hold the server forever.
+        '''
+        return (cmd in ('deploy', 'run_script', 'test_dag') and not args.get('w') and os.environ.get('SNOWFLOW_SERVER', '1') != '0'
+                and os.path.exists(os.path.join(os.getcwd(), '.snowflow', 'server.json')))
 
     def exec(self):
         parsed_args = vars(self.parser.parse_args())
@@ -68,10 +89,16 @@ class ArgHandler:
         command_class = self.mapper[cmd]
         if cmd == 'init':
             command_instance = command_class()
+        elif cmd == 'serve':
+            command_instance = command_class(parsed_args.pop('environment', None))
         else:
             environment = parsed_args.pop('environment', None)
             if not environment:
                 raise ValueError("The '-e' argument is required for this command")
+            if self.is_served(cmd, parsed_args):
+                status = server.send_command(cmd, environment, parsed_args)
+                if status is not None:
+                    sys.exit(status)
         
             command_instance = command_class(environment)
 
@@ -0,0 +1,364 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import shutil
+import gzip
+import json
+import sys
+import os
+import re
+
+# Compressed size Snowflake loads fastest at, one chunk per thread of the warehouse
+DEFAULT_CHUNK_MB = 200
+# Header lines of CSV files, repeated at the top of every chunk
+DEFAULT_SKIP_HEADER = 1
+# Stage folder chunks are uploaded to, under the stage the source file is in
+LOAD_FOLDER = 'snowflow_load'
+LOAD_FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'json', '.ndjson': 'json'}
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*$')
+
+def get_local_load_journal_path(environment: str) -> Path:
+    return Path(os.getcwd(), '.snowflow', 'load_' + environment + '.json')
+
+def get_load_format(path: Path) -> tuple:
+    '''
+    (format, gzipped) of a file by its extension, e.g. ('csv', True) for data.csv.gz, or (None, False) for a file not to load
+    '''
+    suffixes = [suffix.lower() for suffix in Path(path).suffixes]
+    gzipped = bool(suffixes) and suffixes[-1] == '.gz'
+    if gzipped:
+        suffixes = suffixes[:-1]
+    return (LOAD_FORMATS.get(suffixes[-1]) if suffixes else None), gzipped
+
+def get_chunk_base(path: Path, digest: str) -> str:
+    '''
+    The start of the chunk names of a file: its name without extensions and a digest of its contents and split options
+    '''
+    stem = Path(path).name.split('.')[0]
+    return re.sub(r'[^A-Za-z0-9_-]', '_', stem) + '_' + digest
+
+def is_json_lines(path: Path, gzipped: bool) -> bool:
+    '''
+    Whether a json file holds one document per line, so it can be split between lines
+    '''
+    with (gzip.open(path, 'rb') if gzipped else open(path, 'rb')) as f:
+        first_line = f.readline()
+    try:
+        return isinstance(json.loads(first_line), dict)
+    except ValueError:
+        return False
+
+class ChunkWriter:
+    '''
+    Writes gzipped chunks of about chunk_size compressed bytes, starting each one with the header lines.
+    Chunks have no gzip timestamp, so splitting the same file again writes the same chunks.
+    '''
+    def __init__(self, folder: Path, base: str, extension: str, chunk_size: int, header: bytes = b''):
+        self.folder = Path(folder)
+        self.base = base
+        self.extension = extension
+        self.chunk_size = chunk_size
+        self.header = header
+        self.count = 0
+        self._raw = None
+        self._gz = None
+        self.path = None
+
+    def open(self) -> None:
+        self.count += 1
+        self.path = Path(self.folder, f"{self.base}_{self.count:05d}.{self.extension}.gz")
+        self._raw = open(self.path, 'wb')
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6, mtime=0, filename='')
+        self._gz.write(self.header)
+
+    def write(self, data: bytes) -> None:
+        self._gz.write(data)
+
+    def close(self) -> Path:
+        self._gz.close()
+        self._raw.close()
+        self._gz = self._raw = None
+        return self.path
+
+    def is_full(self) -> bool:
+        # Compressed bytes written so far. zlib holds back a little, which is fine for a rough size
+        return self._raw.tell() >= self.chunk_size
+
+class SourceFile:
+    '''
+    A local file under staged_files/<stage>/ and the table it loads into: the folder under the stage
+    it is in, or for a file directly in the stage folder, its name without extensions
+    '''
+    def __init__(self, path: Path, stage: str, table: str, format: str, gzipped: bool):
+        self.path = Path(path)
+        self.stage = stage
+        self.table = table
+        self.format = format
+        self.gzipped = gzipped
+
+    def get_key(self) -> str:
+        return Path(os.path.relpath(self.path)).as_posix()
+
+    def get_digest(self, chunk_size: int, skip_header: int) -> str:
+        stat = self.path.stat()
+        return hashlib.sha1(f"{self.get_key()}|{stat.st_mtime_ns}|{stat.st_size}|{chunk_size}|{skip_header}".encode()).hexdigest()[:8]
+
+    def open(self):
+        return gzip.open(self.path, 'rb') if self.gzipped else open(self.path, 'rb')
+
+    def split(self, folder: Path, base: str, chunk_size: int, skip_header: int = 0):
+        '''
+        Yield the chunks of the file as each one is written, reading the file a line at a time.
+        CSV is only split between records, so a quoted value spanning lines stays in one chunk.
+        JSON that is not one document per line cannot be split and becomes a single chunk.
+        '''
+        folder.mkdir(parents=True, exist_ok=True)
+        with self.open() as f:
+            if self.format == 'json' and not is_json_lines(self.path, self.gzipped):
+                logging.warning(f"{self.path} is not one JSON document per line, loading it as a single chunk")
+                writer = ChunkWriter(folder, base, self.format, chunk_size)
+                writer.open()
+                shutil.copyfileobj(f, writer)
+                yield writer.close()
+                return
+            header = b''.join(f.readline() for _ in range(skip_header)) if self.format == 'csv' else b''
+            writer = ChunkWriter(folder, base, self.format, chunk_size, header)
+            in_quotes = False
+            writer.open()
+            for line in f:
+                if not in_quotes and writer.is_full():
+                    yield writer.close()
+                    writer.open()
+                writer.write(line)
+                if self.format == 'csv' and line.count(b'"') % 2:
+                    # An escaped quote is doubled, so only an odd count opens or closes a quoted value
+                    in_quotes = not in_quotes
+            yield writer.close()
+
+class LoadJournal:
+    '''
+    Keeps the chunks of each loaded file and whether they loaded, in a json file in the project folder.
+    A file is keyed by its path, and its chunks are only reused while its digest is unchanged.
+    '''
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries = self.load()
+
+    def load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            logging.warning(f"Could not read load journal {self.path}: {e}. Checking load status in Snowflake only.")
+            return {}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+
+    def get_chunks(self, key: str, digest: str) -> dict:
+        entry = self.entries.get(key)
+        return dict(entry['chunks']) if entry and entry.get('digest') == digest else {}
+
+    def set_chunks(self, key: str, digest: str, chunks: dict) -> None:
+        self.entries[key] = {'digest': digest, 'chunks': chunks}
+
+class BulkLoader:
+    '''
+    Loads the CSV and JSON files under staged_files into tables. Each file is split into gzipped chunks
+    of about chunk_size bytes while it is read, the chunks are uploaded on up to workers threads as they
+    are written, and each target table is loaded with one COPY INTO ... PATTERN, so the warehouse loads
+    the chunks in parallel. COPY purges the chunks it loaded from the stage.
+    Each upload runs on a session borrowed from the user's session pool, never on a session another
+    thread is using. Without a pool, the chunks are uploaded one at a time on the user's session.
+    Chunks that loaded before, by the journal or Snowflake's COPY_HISTORY, are not uploaded again,
+    and files whose chunks all loaded are not read at all.
+    '''
+    def __init__(self, user, schema, journal: LoadJournal, chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+                 skip_header: int = DEFAULT_SKIP_HEADER, workers: int = 1, file_format: str = None, force: bool = False):
+        self.user = user
+        self.schema = schema
+        self.journal = journal
+        self.chunk_size = chunk_size
+        self.skip_header = skip_header
+        self.workers = max(workers, 1)
+        self.file_format = file_format
+        self.force = force
+        self.chunk_folder = Path(journal.path.parent, 'load', schema.database.name, schema.name)
+
+    def get_source_files(self, stages: list = None, tables: list = None) -> list[SourceFile]:
+        staged_files_path = Path(self.schema.schema_path, 'staged_files')
+        sources = []
+        for file_config in self.schema.get_staged_files():
+            path = Path(file_config['local_path'])
+            format, gzipped = get_load_format(path)
+            if format is None:
+                continue
+            parts = path.relative_to(staged_files_path).parts
+            stage = parts[0]
+            table = parts[1] if len(parts) > 2 else path.name.split('.')[0]
+            if not IDENTIFIER.match(table):
+                logging.warning(f"Skipping {path}, {table} is not a table name")
+                continue
+            if (stages and stage.lower() not in stages) or (tables and table.lower() not in tables):
+                continue
+            sources.append(SourceFile(path, stage, table, format, gzipped))
+        return sorted(sources, key=lambda source: str(source.path))
+
+    def get_loaded_in_snowflake(self, table: str) -> set:
+        '''
+        Names of the chunks COPY_HISTORY has as loaded into table, over the 14 days it keeps
+        '''
+        rows = self.user.run_query("SELECT FILE_NAME, STATUS FROM TABLE(INFORMATION_SCHEMA.COPY_HISTORY("
+                                   f"TABLE_NAME => '{table}', START_TIME => DATEADD(DAY, -14, CURRENT_TIMESTAMP())))") or []
+        return {Path(row[0]).name for row in rows if row and str(row[1]).upper() == 'LOADED'}
+
+    def get_stage_path(self, source: SourceFile) -> str:
+        # Qualified, so uploads do not depend on the database and schema of the session they run on
+        return f"@{self.schema.database.name}.{self.schema.name}.{source.stage}/{LOAD_FOLDER}/{source.table}"
+
+    def get_copy_query(self, source: SourceFile, bases: list) -> str:
+        if self.file_format:
+            file_format = f" FILE_FORMAT = (FORMAT_NAME = '{self.file_format}')"
+        elif source.format == 'json':
+            file_format = ' FILE_FORMAT = (TYPE = JSON STRIP_OUTER_ARRAY = TRUE)'
+        else:
+            # The stage's own file format applies
+            file_format = ''
+        pattern = f".*({'|'.join(bases)})_[0-9]+[.]{source.format}[.]gz"
+        return (f"COPY INTO {source.table} FROM {self.get_stage_path(source)}/{file_format} PATTERN = '{pattern}' PURGE = TRUE"
+                + (' FORCE = TRUE' if self.force else ''))
+
+    def load(self, stages: list = None, tables: list = None) -> dict:
+        '''
+        Load the source files, one COPY per target table and format. Returns {table: rows loaded} of the tables that had anything to load
+        '''
+        groups = {}
+        for source in self.get_source_files(stages, tables):
+            groups.setdefault((source.stage, source.table, source.format), []).append(source)
+        if not groups:
+            logging.info(f"No CSV or JSON files to load under the staged_files of {self.schema}")
+            return {}
+        loaded_rows = {}
+        for (stage, table, format), sources in groups.items():
+            rows = self.load_table(sources)
+            if rows is not None:
+                loaded_rows[table] = loaded_rows.get(table, 0) + rows
+        return loaded_rows
+
+    def load_table(self, sources: list[SourceFile]) -> int:
+        '''
+        Load the sources of one table and format, returns the rows loaded or None when every chunk had already loaded
+        '''
+        table = sources[0].table
+        loaded_in_snowflake = None
+        pending = {}
+        for source in sources:
+            key = source.get_key()
+            digest = source.get_digest(self.chunk_size, self.skip_header)
+            chunks = {} if self.force else self.journal.get_chunks(key, digest)
+            if chunks and all(status == 'LOADED' for status in chunks.values()):
+                logging.info(f"Skipping {source.path}, its {len(chunks)} chunks already loaded into {table}")
+                continue
+            if loaded_in_snowflake is None:
+                loaded_in_snowflake = set() if self.force else self.get_loaded_in_snowflake(table)
+            loaded = {name for name, status in chunks.items() if status == 'LOADED'} | loaded_in_snowflake
+            chunks = self.upload(source, get_chunk_base(source.path, digest), loaded)
+            self.journal.set_chunks(key, digest, chunks)
+            self.journal.save()
+            if any(status != 'LOADED' for status in chunks.values()):
+                pending[source] = (key, digest, chunks)
+        if not pending:
+            return None
+        return self.copy(table, pending)
+
+    def upload(self, source: SourceFile, base: str, loaded: set) -> dict:
+        '''
+        Split source and upload the chunks not in loaded as they are written, returns {chunk name: status}
+        '''
+        chunks = {}
+        stage_path = self.get_stage_path(source)
+        # Splitting waits when this many chunks are waiting for upload, so the disk holds only a few at a time
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        skipped = 0
+
+        pool = self.user.pool
+        workers = self.workers
+        if pool is not None:
+            # Every upload borrows its own session, the user's session stays free for COPY
+            pool.resize(workers + 1)
+        elif workers > 1:
+            logging.info(f"Uploading the chunks of {source.path} one at a time, {self.user.environment} has no session pool to upload from in parallel")
+            workers = 1
+
+        def upload_chunk(path: Path) -> None:
+            try:
+                if pool is None:
+                    self.user.post_files([{'local_path': str(path), 'stage_path': stage_path}])
+                else:
+                    with pool.user(self.user.profiler) as user:
+                        user.post_files([{'local_path': str(path), 'stage_path': stage_path}])
+            finally:
+                path.unlink()
+                slots.release()
+
+        logging.info(f"Splitting {source.path} into chunks of about {self.chunk_size // (1024 * 1024)} MB for {source.table}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for path in source.split(Path(self.chunk_folder, source.stage, source.table), base, self.chunk_size, self.skip_header):
+                if path.name in loaded:
+                    chunks[path.name] = 'LOADED'
+                    path.unlink()
+                    skipped += 1
+                    continue
+                chunks[path.name] = 'UPLOADED'
+                slots.acquire()
+                futures.append(executor.submit(upload_chunk, path))
+            for future in futures:
+                future.result()
+        logging.info(f"Uploaded {len(futures)} chunks of {source.path}" + (f", {skipped} had already loaded" if skipped else ''))
+        return chunks
+
+    def copy(self, table: str, pending: dict) -> int:
+        '''
+        Load the uploaded chunks of every pending source of table with one COPY, and record each chunk's status
+        '''
+        source = next(iter(pending))
+        query = self.get_copy_query(source, [get_chunk_base(src.path, digest) for src, (key, digest, chunks) in pending.items()])
+        logging.info(f"Loading {sum(status != 'LOADED' for key, digest, chunks in pending.values() for status in chunks.values())} chunks into {table}")
+        rows = self.user.run_query(query, object_type='load') or []
+        statuses = {}
+        loaded_rows = 0
+        for row in rows:
+            record = {str(name).lower(): value for name, value in (row.as_dict() if hasattr(row, 'as_dict') else dict(row)).items()}
+            if record.get('file'):
+                statuses[Path(str(record['file'])).name] = str(record.get('status') or '').upper()
+                loaded_rows += int(record.get('rows_loaded') or 0)
+        failed = []
+        unprocessed = 0
+        for src, (key, digest, chunks) in pending.items():
+            for name, status in chunks.items():
+                if name in statuses:
+                    chunks[name] = statuses[name]
+                    if statuses[name] != 'LOADED':
+                        failed.append(f"{name} ({statuses[name]})")
+                elif status != 'LOADED':
+                    unprocessed += 1
+            self.journal.set_chunks(key, digest, chunks)
+        self.journal.save()
+        logging.info(f"Loaded {loaded_rows} rows into {table} from {len(statuses)} chunks")
+        if unprocessed:
+            # COPY skips files its load metadata has as loaded. The next load finds them in COPY_HISTORY
+            logging.warning(f"COPY did not process {unprocessed} uploaded chunks for {table}, they may have loaded in an earlier run")
+        if failed:
+            raise ValueError(f"Some chunks did not load into {table}: {', '.join(failed)}")
+        return loaded_rows
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,317 @@
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import json
+import sys
+import os
+import re
+
+class LocalManifestStore:
+    '''
+    Keeps deploy manifest hashes in a json file in the project folder
+    '''
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def load(self) -> dict:
+        if not self.path.exists():
+            logging.debug(f"No deploy manifest found at {self.path}")
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            logging.warning(f"Could not read deploy manifest {self.path}: {e}. Deploying all objects.")
+            return {}
+
+    def save(self, updates: dict) -> None:
+        hashes = self.load()
+        hashes.update(updates)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(hashes, f, indent=2, sort_keys=True)
+
+class SnowflakeManifestStore:
+    '''
+    Keeps deploy manifest hashes in a Snowflake state table.
+    The user only needs a run_query method, so a local stand-in can replace it. The state table's
+    queries run untracked, so they are never checkpointed as statements of the deploy.
+    '''
+    def __init__(self, user, table_name: str):
+        self.user = user
+        self.table_name = table_name
+
+    def load(self) -> dict:
+        self.run_query('CREATE TABLE IF NOT EXISTS ' + self.table_name +
+                       ' (OBJECT_KEY STRING, CONTENT_HASH STRING, DEPLOYED_AT TIMESTAMP_LTZ)')
+        rows = self.run_query('SELECT OBJECT_KEY, CONTENT_HASH FROM ' + self.table_name) or []
+        return {row[0]: row[1] for row in rows if row}
+
+    def save(self, updates: dict) -> None:
+        if not updates:
+            return
+        values = ','.join("('" + self._escape(k) + "','" + self._escape(v) + "')" for k, v in updates.items())
+        query = ('MERGE INTO ' + self.table_name + ' t USING (SELECT column1 AS OBJECT_KEY, column2 AS CONTENT_HASH FROM VALUES ' + values + ') s '
+                 'ON t.OBJECT_KEY = s.OBJECT_KEY '
+                 'WHEN MATCHED THEN UPDATE SET t.CONTENT_HASH = s.CONTENT_HASH, t.DEPLOYED_AT = CURRENT_TIMESTAMP() '
+                 'WHEN NOT MATCHED THEN INSERT (OBJECT_KEY, CONTENT_HASH, DEPLOYED_AT) VALUES (s.OBJECT_KEY, s.CONTENT_HASH, CURRENT_TIMESTAMP())')
+        self.run_query(query)
+
+    def run_query(self, query: str) -> list:
+        return self.user.run_query(query, 'manifest', tracked=False)
+
+    def _escape(self, value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace("'", "''")
+
+class DeployManifest:
+    '''
+    Tracks a hash of every deployed object file after variable substitution,
+    so files that have not changed since the last deploy can be skipped.
+    '''
+    def __init__(self, store, full: bool = False):
+        self.store = store
+        self.full = full
+        self._hashes = None
+        self._lock = threading.Lock()
+
+    @property
+    def hashes(self) -> dict:
+        with self._lock:
+            if self._hashes is None:
+                self._hashes = self.store.load()
+        return self._hashes
+
+    def get_key(self, path: Path) -> str:
+        try:
+            return Path(path).relative_to(os.getcwd()).as_posix()
+        except ValueError:
+            return Path(path).as_posix()
+
+    def get_hash(self, queries: list[str]) -> str:
+        return hashlib.sha256('\n;\n'.join(queries).encode('utf-8')).hexdigest()
+
+    def get_file_hash(self, path: Path) -> str:
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def get_changed_staged_files(self, file_configs: list[dict]) -> list[dict]:
+        '''
+        Return the staged file configs whose local file differs from the last uploaded version
+        '''
+        if self.full:
+            return file_configs
+        changed = [fc for fc in file_configs
+                   if self.hashes.get(self.get_key(fc['local_path'])) != self.get_file_hash(fc['local_path'])]
+        skipped = len(file_configs) - len(changed)
+        if skipped:
+            logging.info(f"Skipping {skipped} unchanged staged files")
+        return changed
+
+    def mark_staged_files(self, file_configs: list[dict]) -> None:
+        if not file_configs:
+            return
+        updates = {self.get_key(fc['local_path']): self.get_file_hash(fc['local_path']) for fc in file_configs}
+        self.save(updates)
+
+    def get_changed(self, file_queries: dict, object_type: str = "") -> dict:
+        '''
+        Return the subset of {file: queries} whose content differs from the last deploy
+        '''
+        if self.full:
+            return file_queries
+        changed = {f: q for f, q in file_queries.items() if self.hashes.get(self.get_key(f)) != self.get_hash(q)}
+        skipped = len(file_queries) - len(changed)
+        if skipped:
+            logging.info(f"Skipping {skipped} unchanged {object_type} files")
+        return changed
+
+    def mark_deployed(self, file_queries: dict) -> None:
+        if not file_queries:
+            return
+        updates = {self.get_key(f): self.get_hash(q) for f, q in file_queries.items()}
+        self.save(updates)
+
+    def save(self, updates: dict) -> None:
+        hashes = self.hashes
+        with self._lock:
+            hashes.update(updates)
+            self.store.save(updates)
+
+class FileCompletion:
+    '''
+    Counts the statements of each object file as they complete, so that after a failure only the
+    files whose statements all ran are recorded in the manifest. Statements are matched by text,
+    so it does not matter in which order or on which thread they ran.
+    '''
+    def __init__(self, file_queries: dict):
+        self._lock = threading.Lock()
+        self.pending = {}
+        for path, queries in file_queries.items():
+            counts = {}
+            for query in queries:
+                if query.strip():
+                    counts[query] = counts.get(query, 0) + 1
+            self.pending[path] = counts
+
+    def mark_statement(self, query: str) -> None:
+        with self._lock:
+            for counts in self.pending.values():
+                if counts.get(query):
+                    counts[query] -= 1
+                    return
+
+    def is_complete(self, path: Path) -> bool:
+        with self._lock:
+            return not any(self.pending.get(path, {}).values())
+
+class DeployCheckpoint:
+    '''
+    Journal of the steps and statements of each plan that completed, so a failed deploy can resume
+    where it stopped. An entry is only resumed while its plan hash is unchanged.
+    The journal is a json lines file that every completed step and statement is appended to. It is
+    compacted to the unfinished plans when a deploy starts.
+    '''
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = Path(path)
+        self.resume = resume
+        self._lock = threading.Lock()
+        self.entries = self.load()
+        self.compact()
+
+    def load(self) -> dict:
+        '''
+        Replay the journal into {plan: {'hash':, 'steps':, 'statements': {statement hash: count}}}
+        '''
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash, the statement it recorded will run again
+                    logging.debug(f"Ignoring an incomplete line in deploy checkpoint {self.path}")
+                    continue
+                key = record.get('plan')
+                if record.get('finished'):
+                    entries.pop(key, None)
+                elif 'steps' in record:
+                    entries[key] = {'hash': record['hash'], 'steps': record['steps'], 'statements': {}}
+                elif key in entries and 'statement' in record:
+                    statements = entries[key]['statements']
+                    statements[record['statement']] = statements.get(record['statement'], 0) + 1
+        return entries
+
+    def compact(self) -> None:
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                for key, entry in self.entries.items():
+                    f.write(json.dumps({'plan': key, 'hash': entry['hash'], 'steps': entry['steps']}) + '\n')
+                    for statement, count in entry['statements'].items():
+                        f.write((json.dumps({'plan': key, 'statement': statement}) + '\n') * count)
+            os.replace(temp_path, self.path)
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def start(self, deploy_plan) -> 'PlanProgress':
+        '''
+        The progress of deploy_plan to resume from, or a new one
+        '''
+        key = str(deploy_plan)
+        plan_hash = deploy_plan.get_hash()
+        entry = self.entries.get(key)
+        if self.resume and entry is not None and entry.get('hash') == plan_hash:
+            logging.info(f"Resuming {key} after {entry['steps']} completed steps and {sum(entry['statements'].values())} statements")
+        else:
+            if self.resume and entry is not None:
+                logging.info(f"The plan of {key} changed since the last checkpoint, deploying it from the start")
+            elif self.resume:
+                logging.info(f"No checkpoint for {key}, deploying it from the start")
+            entry = {'hash': plan_hash, 'steps': 0, 'statements': {}}
+            self.append({'plan': key, 'hash': plan_hash, 'steps': 0})
+        with self._lock:
+            self.entries[key] = entry
+        return PlanProgress(self, key, entry)
+
+    def finish(self, deploy_plan) -> None:
+        with self._lock:
+            self.entries.pop(str(deploy_plan), None)
+        self.append({'plan': str(deploy_plan), 'finished': True})
+
+class PlanProgress:
+    '''
+    The completed steps of one plan, and the statements completed in the step after them.
+    Statements are counted by hash, so it does not matter in which order or on which thread they ran.
+    '''
+    # Statements that set session state are run again on resume, later statements may rely on it
+    SESSION_PATTERN = re.compile(r"^\s*(?:USE|ALTER\s+SESSION)\b", re.I)
+
+    def __init__(self, checkpoint: DeployCheckpoint, key: str, entry: dict):
+        self.checkpoint = checkpoint
+        self.key = key
+        self.entry = entry
+
+    def is_step_done(self, index: int) -> bool:
+        return index < self.entry['steps']
+
+    def complete_step(self, index: int) -> None:
+        if self.is_step_done(index):
+            # A session step run again while resuming
+            return
+        with self.checkpoint._lock:
+            self.entry['steps'] = index + 1
+            self.entry['statements'] = {}
+        self.checkpoint.append({'plan': self.key, 'hash': self.entry['hash'], 'steps': index + 1})
+
+    def mark_statement(self, query: str) -> None:
+        key = get_statement_hash(query)
+        with self.checkpoint._lock:
+            self.entry['statements'][key] = self.entry['statements'].get(key, 0) + 1
+        self.checkpoint.append({'plan': self.key, 'statement': key})
+
+    def get_remaining(self, file_queries: dict) -> dict:
+        '''
+        {file: queries} without the statements that already completed in this step
+        '''
+        with self.checkpoint._lock:
+            done = dict(self.entry['statements'])
+        if not done:
+            return file_queries
+        remaining = {}
+        skipped = 0
+        for path, queries in file_queries.items():
+            remaining[path] = []
+            for query in queries:
+                key = get_statement_hash(query)
+                if done.get(key) and not self.SESSION_PATTERN.match(query):
+                    done[key] -= 1
+                    skipped += 1
+                else:
+                    remaining[path].append(query)
+        if skipped:
+            logging.info(f"Skipping {skipped} statements that completed before the last failure")
+        return {path: queries for path, queries in remaining.items() if queries}
+
+def get_statement_hash(query: str) -> str:
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]
+
+def get_local_manifest_path(environment: str) -> Path:
+    return Path(os.getcwd(), '.snowflow', 'manifest_' + environment + '.json')
+
+def get_local_checkpoint_path(environment: str) -> Path:
+    return Path(os.getcwd(), '.snowflow', 'checkpoint_' + environment + '.jsonl')
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
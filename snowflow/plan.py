@@ -0,0 +1,193 @@
+from pathlib import Path
+from . import scripts
+from . import profiling
+from . import references
+import hashlib
+import logging
+import json
+import sys
+import os
+
+class DeployPlan:
+    '''
+    The ordered list of steps a deploy runs, compiled without connecting to Snowflake.
+    Each step is a dict with an action:
+      query_tag  - set the session query tag to value
+      use_schema - switch the session to schema name
+      put        - upload files, a list of {'local_path':, 'stage_path':}
+      run        - run files, a dict of {relative file path: [queries]}. parallel steps may run
+                   independent statements concurrently, tracked steps are skipped when unchanged
+    '''
+    version = 2
+
+    def __init__(self, environment: str, scope: dict, steps: list[dict] = None):
+        self.environment = environment
+        self.scope = scope
+        self.steps = steps or []
+
+    def __str__(self):
+        return '.'.join(self.scope.get(k) for k in ['database', 'schema'] if self.scope.get(k)) or 'account'
+
+    def add_step(self, action: str, object_type: str = "", **kwargs) -> None:
+        step = {'action': action, 'object_type': object_type}
+        step.update(kwargs)
+        self.steps.append(step)
+
+    def add_queries(self, object_type: str, queries: list[str], source: Path) -> None:
+        self.add_step('run', object_type, files={relative_path(source): queries}, parallel=False, tracked=False)
+
+    def add_files(self, object_type: str, file_queries: dict, parallel: bool = True) -> None:
+        files = {relative_path(f): q for f, q in file_queries.items()}
+        self.add_step('run', object_type, files=files, parallel=parallel, tracked=True)
+
+    def get_queries(self) -> list[str]:
+        return [query for step in self.steps if step['action'] == 'run' for queries in step['files'].values() for query in queries]
+
+    def get_hash(self) -> str:
+        # Keys are not sorted, the order of the files in a step is the order they run in
+        return hashlib.sha256(json.dumps(self.steps).encode('utf-8')).hexdigest()
+
+    def to_dict(self) -> dict:
+        return {'version': self.version, 'environment': self.environment, 'scope': self.scope,
+                'hash': self.get_hash(), 'steps': self.steps}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_sql(self) -> str:
+        '''
+        Render the plan as a single SQL bundle, with a comment naming the source of every statement
+        '''
+        lines = [f"-- Snowflow plan for {self} in environment {self.environment}", f"-- Plan hash: {self.get_hash()}"]
+        for step in self.steps:
+            if step['action'] == 'query_tag':
+                lines.append(f"ALTER SESSION SET QUERY_TAG = '{step['value']}';")
+            elif step['action'] == 'use_schema':
+                lines.append(f"USE SCHEMA {step['name']};")
+            elif step['action'] == 'put':
+                for file_config in step['files']:
+                    lines.append(f"PUT 'file://{file_config['local_path']}' '{file_config['stage_path']}' AUTO_COMPRESS = FALSE OVERWRITE = TRUE;")
+            elif step['action'] == 'run':
+                for source, queries in step['files'].items():
+                    lines.append(f"-- {step['object_type']}: {source}")
+                    lines.extend(query.strip().rstrip(';') + ';' for query in queries if query.strip())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Path, output_format: str = 'json') -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.to_sql() if output_format == 'sql' else self.to_json())
+        return path
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DeployPlan':
+        if data.get('version') != cls.version:
+            raise ValueError(f"Unsupported plan version {data.get('version')}. Recompile the plan with snowflow plan.")
+        plan = cls(data['environment'], data.get('scope', {}), data.get('steps', []))
+        if data.get('hash') and data['hash'] != plan.get_hash():
+            raise ValueError('Plan file has been modified after it was compiled. Recompile the plan with snowflow plan.')
+        return plan
+
+    @classmethod
+    def read(cls, path: Path) -> 'DeployPlan':
+        try:
+            with open(path, 'r') as f:
+                return cls.from_dict(json.load(f))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Could not read plan file {path}. Only json plans can be applied: {e}")
+
+class PlanCompiler:
+    '''
+    Compiles the deploy plan of an account, database or schema from the repo files.
+    Never opens a Snowflake session. With a profiler, reading each object type is timed into it.
+    '''
+    def __init__(self, environment: str, profiler: profiling.DeployProfiler = None):
+        self.environment = environment
+        self.profiler = profiler
+
+    def timer(self, deploy_plan: DeployPlan, object_type: str):
+        return profiling.measure(self.profiler, 'compile', object_type, f"{deploy_plan} {object_type}")
+
+    def add_object_files(self, deploy_plan: DeployPlan, source, object_type: str) -> None:
+        with self.timer(deploy_plan, object_type):
+            deploy_plan.add_files(object_type, source.get_path_object_files(object_type))
+
+    def account(self) -> DeployPlan:
+        acct = scripts.SnowflakeAcct(self.environment)
+        plan = DeployPlan(self.environment, {})
+        plan.add_step('query_tag', value='Snowflow deploy account')
+        with self.timer(plan, 'init'):
+            plan.add_queries('init', acct.get_init(), Path(acct.env_dir, 'init.sql'))
+        for object_type in ['roles', 'warehouses', 'integrations', 'network_rules', 'network_policies']:
+            self.add_object_files(plan, acct, object_type)
+        with self.timer(plan, 'grants'):
+            plan.add_queries('grants', acct.get_grants(), Path(acct.env_dir, 'grants.sql'))
+        return plan
+
+    def database(self, db_name: str) -> DeployPlan:
+        acct = scripts.SnowflakeAcct(self.environment)
+        db = scripts.SnowflakeDB(db_name, acct)
+        plan = DeployPlan(self.environment, {'database': db_name})
+        plan.add_step('query_tag', value='Snowflow Deploy Database: '+db_name)
+        with self.timer(plan, 'init'):
+            plan.add_queries('init', db.get_db_init(), db.init_file)
+        return plan
+
+    def schema(self, db_name: str, schema_name: str) -> DeployPlan:
+        acct = scripts.SnowflakeAcct(self.environment)
+        db = scripts.SnowflakeDB(db_name, acct)
+        schema = scripts.SnowflakeSchema(schema_name, db)
+        plan = DeployPlan(self.environment, {'database': db_name, 'schema': schema_name})
+        plan.add_step('query_tag', value='Snowflow Deploy Schema: '+db_name+'.'+schema_name)
+        with self.timer(plan, 'init'):
+            plan.add_queries('init', schema.get_schema_init(), Path(schema.schema_path, 'init.sql'))
+        plan.add_step('use_schema', name=schema_name)
+
+        self.add_object_files(plan, schema, 'file_formats')
+        self.add_object_files(plan, schema, 'stages')
+        with self.timer(plan, 'staged_files'):
+            plan.add_step('put', 'staged_files', files=[{'local_path': relative_path(fc['local_path']), 'stage_path': fc['stage_path']}
+                                                        for fc in schema.get_staged_files()])
+        for object_type in ['udfs', 'tables', 'views', 'streams', 'stored_procs', 'tasks']:
+            self.add_object_files(plan, schema, object_type)
+        with self.timer(plan, 'dependencies'):
+            self.order_object_files(plan)
+        with self.timer(plan, 'dags'):
+            plan.add_files('dags', schema.get_dag_files(), parallel=False)
+        with self.timer(plan, 'post_deploy'):
+            plan.add_queries('post_deploy', schema.get_path_objects('post_deploy'), schema.path_lookup['post_deploy'])
+        with self.timer(plan, 'grants'):
+            plan.add_queries('grants', schema.get_grants(), Path(schema.schema_path, 'grants.sql'))
+        return plan
+
+    def order_object_files(self, deploy_plan: DeployPlan) -> None:
+        '''
+        Check the references between the object files compiled so far for cycles, and reorder the files
+        of each phase so objects are created after the objects they reference
+        '''
+        steps = [step for step in deploy_plan.steps if step['action'] == 'run' and step.get('tracked')]
+        graph = references.DependencyGraph([(step['object_type'], step['files']) for step in steps])
+        graph.check()
+        for step in steps:
+            step['files'] = graph.order(step['object_type'], step['files'])
+
+    def compile(self, db_name: str = None, schema_name: str = None) -> DeployPlan:
+        if db_name is None:
+            return self.account()
+        elif schema_name is None:
+            return self.database(db_name)
+        return self.schema(db_name, schema_name)
+
+def relative_path(path) -> str:
+    '''
+    Path relative to the project root as a posix string, so plans compiled on one machine apply on another
+    '''
+    try:
+        return Path(path).relative_to(os.getcwd()).as_posix()
+    except ValueError:
+        return Path(path).as_posix()
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,146 @@
+from contextlib import contextmanager
+from pathlib import Path
+import threading
+import logging
+import json
+import time
+import csv
+import sys
+import os
+
+FIELDS = ['kind', 'phase', 'name', 'start', 'seconds', 'query_id', 'rows', 'status', 'thread']
+
+class DeployProfiler:
+    '''
+    Records how long each step of a deploy takes: compiling object files, running statements and uploading files.
+    Every event has a kind (compile, step, query or put), the deploy phase it belongs to (usually the object type),
+    a name, its start offset and duration in seconds, and for queries the Snowflake query ID and rows affected.
+    Safe to record into from several threads.
+    '''
+    def __init__(self):
+        self.started = time.monotonic()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, phase: str, name: str, start: float, seconds: float, **fields) -> dict:
+        '''
+        Add an event. start is a time.monotonic() value
+        '''
+        event = {'kind': kind, 'phase': phase, 'name': name, 'start': start - self.started, 'seconds': seconds,
+                 'query_id': None, 'rows': None, 'status': 'ok', 'thread': threading.get_ident()}
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+        return event
+
+    @contextmanager
+    def timer(self, kind: str, phase: str, name: str, **fields):
+        '''
+        Time the body of a with block. It receives a dict that query_id and rows can be set on
+        '''
+        details = dict(fields)
+        start = time.monotonic()
+        try:
+            yield details
+        except BaseException:
+            details['status'] = 'failed'
+            raise
+        finally:
+            self.record(kind, phase, name, start, time.monotonic() - start, **details)
+
+    def get_events(self, kinds: list[str] = None) -> list[dict]:
+        with self.lock:
+            return [event for event in self.events if kinds is None or event['kind'] in kinds]
+
+    def get_slowest(self, top: int = 20, kinds: list[str] = None) -> list[dict]:
+        events = self.get_events(kinds or ['query', 'put'])
+        return sorted(events, key=lambda event: event['seconds'], reverse=True)[:top]
+
+    def get_totals(self) -> dict:
+        '''
+        Return {(kind, phase): (count, seconds)}
+        '''
+        totals = {}
+        for event in self.get_events():
+            count, seconds = totals.get((event['kind'], event['phase']), (0, 0.0))
+            totals[(event['kind'], event['phase'])] = (count + 1, seconds + event['seconds'])
+        return totals
+
+    def log_report(self, top: int = 20) -> None:
+        totals = self.get_totals()
+        logging.info(f"Deploy profile, {time.monotonic() - self.started:.2f}s in total:")
+        for kind in ['compile', 'query', 'put']:
+            count = sum(c for (k, _), (c, _) in totals.items() if k == kind)
+            seconds = sum(s for (k, _), (_, s) in totals.items() if k == kind)
+            logging.info(f"  {kind:<20} {count:>6} x {seconds:>9.2f}s")
+        logging.info('Wall time by deploy phase:')
+        phases = sorted(((phase, seconds) for (kind, phase), (_, seconds) in totals.items() if kind == 'step'),
+                        key=lambda item: item[1], reverse=True)
+        for phase, seconds in phases:
+            logging.info(f"  {phase:<20} {seconds:>18.2f}s")
+        logging.info(f"Top {top} slowest statements and uploads:")
+        for event in self.get_slowest(top):
+            rows = '' if event['rows'] is None else f"{event['rows']} rows"
+            logging.info(f"  {event['seconds']:>9.2f}s  {event['phase']:<14} {event['query_id'] or '-':<38} {rows:<12} {event['name']}")
+
+    def write(self, path: Path) -> Path:
+        '''
+        Write every event to path. A .csv path writes CSV, a .trace.json path writes the Chrome trace
+        format (chrome://tracing or https://ui.perfetto.dev), anything else writes JSON.
+        '''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        events = self.get_events()
+        with open(path, 'w', newline='') as f:
+            if path.suffix.lower() == '.csv':
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(events)
+            elif path.name.lower().endswith('.trace.json'):
+                json.dump(self.to_chrome_trace(events), f)
+            else:
+                json.dump({'seconds': time.monotonic() - self.started, 'events': events}, f, indent=2)
+        return path
+
+    def to_chrome_trace(self, events: list[dict]) -> dict:
+        trace_events = []
+        for event in events:
+            trace_events.append({
+                'name': event['name'], 'cat': f"{event['kind']},{event['phase']}", 'ph': 'X',
+                'ts': round(event['start'] * 1e6), 'dur': round(event['seconds'] * 1e6),
+                'pid': os.getpid(), 'tid': event['thread'],
+                'args': {key: event[key] for key in ['phase', 'query_id', 'rows', 'status'] if event.get(key) is not None}
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+@contextmanager
+def measure(profiler: DeployProfiler, kind: str, phase: str, name: str, **fields):
+    '''
+    profiler.timer, or a no-op when profiler is None
+    '''
+    if profiler is None:
+        yield {}
+        return
+    with profiler.timer(kind, phase, name, **fields) as details:
+        yield details
+
+def get_rows_affected(result: list) -> int:
+    '''
+    Rows inserted, updated or deleted by a DML statement, otherwise the number of rows returned
+    '''
+    if not result:
+        return 0
+    counts = []
+    for row in result:
+        values = row.asDict() if hasattr(row, 'asDict') else {}
+        counts.extend(value for key, value in values.items()
+                      if key.lower().startswith('number of rows') and isinstance(value, int))
+    return sum(counts) if counts else len(result)
+
+def get_statement_name(query: str, length: int = 80) -> str:
+    name = ' '.join(query.split())
+    return name if len(name) <= length else name[:length - 3] + '...'
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,147 @@
+import networkx as nx
+import itertools
+import logging
+import sys
+import re
+
+COMMENT_PATTERN = re.compile(r"--[^\n]*|//[^\n]*|/\*.*?\*/", re.S)
+STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'", re.S)
+IDENTIFIER_PATTERN = re.compile(r'"[^"]+"|[A-Za-z_][\w$]*')
+CREATE_PATTERN = re.compile(
+    r"^\s*CREATE\s+(?:OR\s+REPLACE\s+)?"
+    r"(?:(?:SECURE|TEMPORARY|TEMP|TRANSIENT|VOLATILE|LOCAL|GLOBAL|MATERIALIZED|EXTERNAL|DYNAMIC|RECURSIVE)\s+)*"
+    r"(?:TABLE|VIEW|STREAM|FUNCTION|PROCEDURE|TASK|FILE\s+FORMAT|STAGE|SEQUENCE|PIPE)\s+"
+    r"(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"((?:\"[^\"]+\"|[\w$]+)(?:\.(?:\"[^\"]+\"|[\w$]+))*)",
+    re.I)
+# Qualified names, stage references and the punctuation the reference scan cares about
+TOKEN_PATTERN = re.compile(r'@?(?:"[^"]+"|[A-Za-z_][\w$]*)(?:\s*\.\s*(?:"[^"]+"|[A-Za-z_][\w$]*))*|[(),=]')
+# A name right after one of these is an object the statement reads or writes
+RELATION_KEYWORDS = {'FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE', 'VIEW', 'STAGE', 'CLONE', 'LIKE', 'USING', 'CALL'}
+# Option names whose value is an object name, as in FILE_FORMAT = csv_ff
+OPTION_KEYWORDS = {'FILE_FORMAT', 'FORMAT_NAME'}
+# Keywords that end the comma separated table list of a FROM clause
+CLAUSE_KEYWORDS = {'WHERE', 'GROUP', 'ORDER', 'HAVING', 'QUALIFY', 'LIMIT', 'UNION', 'EXCEPT', 'MINUS', 'INTERSECT',
+                   'SELECT', 'JOIN', 'ON', 'WINDOW', 'SET', 'VALUES', 'FILE_FORMAT', 'PATTERN', 'FILES'}
+
+def strip_comments(query: str) -> str:
+    '''
+    Remove comments and string literals so only SQL tokens are left for analysis
+    '''
+    query = STRING_PATTERN.sub("''", query)
+    return COMMENT_PATTERN.sub(' ', query)
+
+def normalize_name(name: str) -> str:
+    '''
+    Reduce a possibly qualified object name to its unqualified, upper case form
+    '''
+    last = IDENTIFIER_PATTERN.findall(name)[-1]
+    if last.startswith('"'):
+        return last.strip('"')
+    return last.upper()
+
+def get_created_name(query: str) -> str:
+    '''
+    The unqualified name of the object a CREATE statement creates, or None for any other statement
+    '''
+    match = CREATE_PATTERN.match(strip_comments(query))
+    if match:
+        return normalize_name(match.group(1))
+    return None
+
+def get_referenced_names(query: str) -> set[str]:
+    '''
+    Unqualified names of the objects a statement refers to: relations after FROM, JOIN, INTO and the like
+    (including every table of a comma separated FROM list), functions and procedures that are called,
+    stages after @ and named file formats. Column names are not included.
+    '''
+    names = set()
+    tokens = TOKEN_PATTERN.findall(strip_comments(query))
+    in_from = False
+    for index, token in enumerate(tokens):
+        word = token.upper()
+        previous = tokens[index - 1].upper() if index > 0 else None
+        if word in CLAUSE_KEYWORDS or token == ')':
+            in_from = False
+        if word == 'FROM':
+            in_from = True
+        if token in '(),=' or word in RELATION_KEYWORDS:
+            continue
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        if token.startswith('@'):
+            names.add(normalize_name(token[1:]))
+        elif previous in RELATION_KEYWORDS or following == '(' or (in_from and previous == ','):
+            names.add(normalize_name(token))
+        elif previous == '=' and index > 1 and tokens[index - 2].upper() in OPTION_KEYWORDS:
+            names.add(normalize_name(token))
+    return names
+
+class DependencyGraph:
+    '''
+    Dependencies between the object files of a schema, across object types.
+    Built from the tracked run steps of a plan, as a list of (object_type, {file: [queries]}) in deploy order.
+    Nodes are (object_type, file). An edge a -> b means a file of b references an object created in a.
+    '''
+    def __init__(self, phases: list[tuple[str, dict]]):
+        self.phases = phases
+        self.phase_order = {object_type: index for index, (object_type, _) in enumerate(phases)}
+        self.digraph = self._get_digraph()
+
+    def _get_digraph(self) -> nx.DiGraph:
+        digraph = nx.DiGraph()
+        created = {}
+        for object_type, file_queries in self.phases:
+            for path, queries in file_queries.items():
+                node = (object_type, path)
+                digraph.add_node(node)
+                for query in queries:
+                    name = get_created_name(query)
+                    if name is not None:
+                        created.setdefault(name, set()).add(node)
+        for object_type, file_queries in self.phases:
+            for path, queries in file_queries.items():
+                node = (object_type, path)
+                own = {get_created_name(query) for query in queries}
+                for query in queries:
+                    for ref in get_referenced_names(query) - own:
+                        for definer in created.get(ref, ()):
+                            digraph.add_edge(definer, node, name=ref)
+        return digraph
+
+    def get_cycles(self, limit: int = 5) -> list[list]:
+        if nx.is_directed_acyclic_graph(self.digraph):
+            return []
+        return list(itertools.islice(nx.simple_cycles(self.digraph), limit))
+
+    def check(self) -> None:
+        '''
+        Raise if objects reference each other in a circle, and warn about objects that
+        reference something deployed in a later phase
+        '''
+        cycles = self.get_cycles()
+        if cycles:
+            # Edges point from an object to the files that use it, so reverse them to read as "references"
+            described = '; '.join(' -> '.join(str(path) for _, path in (cycle + cycle[:1])[::-1]) for cycle in cycles)
+            raise ValueError(f"Circular references between object files, each referencing the next: {described}")
+        for definer, user, data in self.digraph.edges(data=True):
+            if self.phase_order[definer[0]] > self.phase_order[user[0]]:
+                logging.warning(f"{user[1]} references {data['name']}, which is only created later by {definer[1]} "
+                                f"({definer[0]} deploy after {user[0]}). It has to exist already.")
+
+    def order(self, object_type: str, file_queries: dict) -> dict:
+        '''
+        The files of one phase, reordered so that every file comes after the files it depends on.
+        Independent files keep their original order.
+        '''
+        paths = list(file_queries)
+        position = {path: index for index, path in enumerate(paths)}
+        subgraph = nx.DiGraph()
+        subgraph.add_nodes_from(paths)
+        subgraph.add_edges_from((a[1], b[1]) for a, b in self.digraph.edges
+                                if a[0] == object_type and b[0] == object_type and a[1] != b[1])
+        ordered = nx.lexicographical_topological_sort(subgraph, key=lambda path: position[path])
+        return {path: file_queries[path] for path in ordered}
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
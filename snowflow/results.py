@@ -0,0 +1,135 @@
+from pathlib import Path
+import itertools
+import logging
+import json
+import csv
+import sys
+
+FORMATS = ['csv', 'jsonl', 'parquet']
+DEFAULT_HEAD_ROWS = 10
+# Rows held in memory at a time while writing parquet
+PARQUET_BATCH_ROWS = 10000
+
+def get_format(path: Path, format: str = None) -> str:
+    '''
+    The output format named by format, or else by the extension of path
+    '''
+    format = (format or Path(path).suffix.lstrip('.')).lower()
+    if format == 'json':
+        format = 'jsonl'
+    if format not in FORMATS:
+        raise ValueError(f"Unknown result format '{format}' for {path}. Use one of {', '.join(FORMATS)}")
+    return format
+
+def get_output_path(path: Path, index: int, count: int) -> Path:
+    '''
+    Where the result of statement index (from 0) of count goes. With several statements, each gets
+    its own file numbered from 1, e.g. results_1.csv, results_2.csv
+    '''
+    path = Path(path)
+    if count == 1:
+        return path
+    return path.with_name(f"{path.stem}_{index + 1}{path.suffix}")
+
+def get_record(row) -> dict:
+    return row.as_dict() if hasattr(row, 'as_dict') else dict(row)
+
+def write_csv(rows, path: Path) -> int:
+    count = 0
+    with open(path, 'w', newline='') as f:
+        writer = None
+        for row in rows:
+            record = get_record(row)
+            if writer is None:
+                writer = csv.writer(f)
+                writer.writerow(record.keys())
+            writer.writerow(record.values())
+            count += 1
+    return count
+
+def write_jsonl(rows, path: Path) -> int:
+    count = 0
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write(json.dumps(get_record(row), default=str) + '\n')
+            count += 1
+    return count
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ValueError("Writing parquet needs pyarrow. Install it with: pip install pyarrow")
+
+def write_parquet(rows, path: Path, batch_rows: int = PARQUET_BATCH_ROWS) -> int:
+    '''
+    Write rows in batches of batch_rows. Needs pyarrow, which Snowpark's pandas extra installs
+    '''
+    pyarrow = import_pyarrow()
+    count = 0
+    writer = None
+    rows = iter(rows)
+    try:
+        while True:
+            batch = [get_record(row) for row in itertools.islice(rows, batch_rows)]
+            if not batch:
+                break
+            if writer is None:
+                table = pyarrow.Table.from_pylist(batch)
+                writer = pyarrow.parquet.ParquetWriter(str(path), table.schema)
+            else:
+                table = pyarrow.Table.from_pylist(batch, schema=writer.schema)
+            writer.write_table(table)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+class ResultHandler:
+    '''
+    What run_script does with the rows of each statement. Rows are consumed from an iterator,
+    so memory stays flat however large the result is:
+    write them to a csv, jsonl or parquet file, log only the first head rows, or discard them.
+    '''
+    def __init__(self, head: int = DEFAULT_HEAD_ROWS, output: str = None, format: str = None, discard: bool = False):
+        self.head = head
+        self.output = Path(output) if output else None
+        self.format = get_format(self.output, format) if self.output else None
+        self.discard = discard
+        if self.format == 'parquet':
+            # Fail before any statement runs rather than after the first one
+            import_pyarrow()
+
+    def handle(self, rows, location: str, index: int = 0, count: int = 1) -> int:
+        '''
+        Consume the rows of statement index of count, returning how many were written or logged
+        '''
+        if self.output is not None:
+            path = get_output_path(self.output, index, count)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            written = WRITERS[self.format](rows, path)
+            logging.info(f"Wrote {written} rows of the statement at {location} to {path}")
+            return written
+        if self.discard:
+            logging.info(f"Discarded the result of the statement at {location}")
+            return 0
+        # One more row than shown tells whether the result was cut off
+        shown = list(itertools.islice(rows, self.head + 1))
+        more = len(shown) > self.head
+        shown = shown[:self.head]
+        if not shown:
+            logging.info(f"No rows from the statement at {location}")
+            return 0
+        logging.info(f"Result of the statement at {location}" + (f", first {self.head} rows:" if more else ':'))
+        for row in shown:
+            logging.info(f"  {row}")
+        return len(shown)
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -1,9 +1,18 @@
 from snowflake.snowpark import Session, Row
 from snowflake.connector.errors import ProgrammingError, DatabaseError
+from snowflake.connector import DictCursor
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from . import profiling
+import threading
 import logging
+import atexit
+import json
 import platform
 import os
 import toml
+import time
 import sys
 
 class ConnectionFile:
@@ -75,20 +84,43 @@ class ConnectionFile:
             logging.error(f'Could not find all required connection parameters in environment {self.environment} in connection file {self.config_path}')
             raise
 
-class SnowflakeUser:
-    def __init__(self, environment: str):
-        if not environment:
-            raise ValueError("Environment not specified. Please provide a valid environment.")
-        self.environment = environment
-        self.connection_file = ConnectionFile(self.environment)
-        self.session = self._get_session()
+_connection_files = {}
+_connection_files_lock = threading.Lock()
 
+def get_connection_file(environment: str) -> ConnectionFile:
+    '''
+    The validated connections.toml entry of an environment, read once per process
+    '''
+    with _connection_files_lock:
+        if environment not in _connection_files:
+            _connection_files[environment] = ConnectionFile(environment)
+        return _connection_files[environment]
 
-    def _get_session(self) -> Session:
-        try:
-            session = Session.builder.config("connection_name", self.environment).create()
+def clear_connection_files() -> list[str]:
+    '''
+    Forget the connections.toml entries read so far, so they are read again. Returns the files they came from
+    '''
+    with _connection_files_lock:
+        paths = sorted({connection_file.config_path for connection_file in _connection_files.values()})
+        _connection_files.clear()
+    return paths
+
+def get_connection_paths() -> list[str]:
+    '''
+    The connections.toml files read by this process
+    '''
+    with _connection_files_lock:
+        return sorted({connection_file.config_path for connection_file in _connection_files.values()})
 
-            return session
+class SessionFactory:
+    '''
+    Opens Snowpark sessions for environments in connections.toml.
+    Any object with a create(environment) method returning a session can be used instead, e.g. a local fake.
+    '''
+    def create(self, environment: str) -> Session:
+        get_connection_file(environment)
+        try:
+            return Session.builder.config("connection_name", environment).create()
         except ValueError as ve:
             logging.error(f"ValueError: {ve}")
             raise
@@ -99,32 +131,196 @@ class SnowflakeUser:
             logging.error(f"Unexpected error: {e}")
             raise RuntimeError('Failed to establish Snowflake session')
 
-    def run_query(self, query:str) -> list[Row]:
+class AsyncQuery:
+    '''
+    A statement submitted with collect_nowait, tracked until it finishes, fails, times out or is cancelled
+    '''
+    def __init__(self, index: int, query: str, job, timeout: float = None):
+        self.index = index
+        self.query = query
+        self.job = job
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.finished = self.started if job is None else None
+        self.result = None
+        self.error = None
+        self.done = job is None
+
+    @property
+    def query_id(self) -> str:
+        return getattr(self.job, 'query_id', None)
+
+    def is_timed_out(self) -> bool:
+        return self.timeout is not None and time.monotonic() - self.started > self.timeout
+
+    def poll(self) -> bool:
+        '''
+        Check on the statement, returns True once it is no longer running
+        '''
+        if self.done:
+            return True
+        if self.job.is_done():
+            try:
+                self.result = self.job.result()
+            except Exception as e:
+                self.error = e
+            self.done = True
+            self.finished = time.monotonic()
+        elif self.is_timed_out():
+            self.cancel()
+            self.error = TimeoutError(f"Query {self.query_id} exceeded the timeout of {self.timeout} seconds and was cancelled")
+        return self.done
+
+    def cancel(self) -> None:
+        if not self.done:
+            try:
+                self.job.cancel()
+            except Exception as e:
+                logging.warning(f"Could not cancel query {self.query_id}: {e}")
+            self.done = True
+            self.finished = time.monotonic()
+
+class SnowflakeUser:
+    '''
+    Runs queries against Snowflake for an environment in connections.toml.
+    Without a session, one is borrowed from the session pool of the environment; call release() when done.
+    A session can be passed in instead. It only needs a sql(query) method returning an object
+    with collect() and collect_nowait(), where collect_nowait() returns a job with
+    query_id, is_done(), result() and cancel(), like a Snowpark Session does.
+    With a profiler, every query and file upload is timed into it.
+    on_query_done, when set, is called with every query that completes, e.g. to checkpoint progress.
+    '''
+    def __init__(self, environment: str, session: Session = None, profiler: profiling.DeployProfiler = None):
+        if not environment:
+            raise ValueError("Environment not specified. Please provide a valid environment.")
+        self.environment = environment
+        self.pool = None
+        if session is None:
+            # Borrow a session of the process wide pool, so logins are shared across commands
+            self.pool = get_session_pool(self.environment)
+            self.session = self.pool.acquire_session(wait=False)
+        else:
+            self.session = session
+        self.profiler = profiler
+        self.on_query_done = None
+
+    def release(self) -> None:
+        '''
+        Give a pooled session back to its pool. The user should not run queries afterwards
+        '''
+        if self.pool is not None:
+            self.pool.release_session(self.session)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def run_query(self, query:str, object_type: str = "", tracked: bool = True) -> list[Row]:
+        '''
+        Run one query and collect its rows. Bookkeeping queries that are not part of what is being
+        deployed, like the deploy manifest's, pass tracked=False so on_query_done does not see them
+        '''
         try:
-            if query.strip() != '':
+            if query.strip() == '':
+                res = [Row()]
+            elif self.profiler is None:
                 res = self.session.sql(query).collect()
             else:
-                res = [Row()]    
+                res = self._run_profiled_query(query, object_type)
+            if tracked:
+                self._query_done(query)
             return res
         except (ProgrammingError, DatabaseError) as db_error:
             logging.error(f"Snowflake query execution error: {db_error}")
             logging.error(f"Query: {query}")
             raise
         except Exception as e:
-            logging.error(f"Error during query execution: {e}. Query: {query}. Skipping query execution.")
-    
-    def run_queries(self, queries: list, object_type: str = "") -> list:
+            logging.error(f"Error during query execution: {e}. Query: {query}")
+            raise
+
+    def stream_query(self, query: str, object_type: str = ""):
+        '''
+        Run a query and return an iterator over its rows that fetches them from Snowflake in chunks,
+        instead of collecting the whole result into memory like run_query
+        '''
+        try:
+            if query.strip() == '':
+                return iter([Row()])
+            if self.profiler is None:
+                rows = self.session.sql(query).to_local_iterator()
+            else:
+                with self.profiler.timer('query', object_type, profiling.get_statement_name(query)):
+                    rows = self.session.sql(query).to_local_iterator()
+            self._query_done(query)
+            return rows
+        except (ProgrammingError, DatabaseError) as db_error:
+            logging.error(f"Snowflake query execution error: {db_error}")
+            logging.error(f"Query: {query}")
+            raise
+
+    def _query_done(self, query: str) -> None:
+        if self.on_query_done is not None and query.strip():
+            self.on_query_done(query)
+
+    def _run_profiled_query(self, query: str, object_type: str = "") -> list[Row]:
+        '''
+        Run through an async job so the query ID is known, and wait for it like collect() does
+        '''
+        with self.profiler.timer('query', object_type, profiling.get_statement_name(query)) as details:
+            job = self.session.sql(query).collect_nowait()
+            details['query_id'] = getattr(job, 'query_id', None)
+            res = job.result()
+            details['rows'] = profiling.get_rows_affected(res)
+        return res
+
+    def supports_batches(self) -> bool:
+        return hasattr(self.session, 'connection')
+
+    def run_batch(self, queries: list[str], object_type: str = "") -> list[list[Row]]:
+        '''
+        Run several statements in one round trip as a multi-statement request, returning the result of each.
+        Uses the Snowflake connection under the session. If a statement fails the whole request raises,
+        and the statements before it have already run.
+        '''
+        text = '\n;\n'.join(query.strip().rstrip(';') for query in queries)
+        name = f"batch of {len(queries)}: {profiling.get_statement_name(queries[0], 60)}"
+        try:
+            with profiling.measure(self.profiler, 'query', object_type, name) as details:
+                cursor = self.session.connection.cursor(DictCursor)
+                try:
+                    cursor.execute(text, num_statements=len(queries))
+                    details['query_id'] = cursor.sfqid
+                    results = [[Row(**record) for record in cursor.fetchall()]]
+                    while cursor.nextset():
+                        results.append([Row(**record) for record in cursor.fetchall()])
+                finally:
+                    cursor.close()
+                details['rows'] = sum(profiling.get_rows_affected(result) for result in results)
+            for query in queries:
+                self._query_done(query)
+            return results
+        except (ProgrammingError, DatabaseError) as db_error:
+            logging.error(f"Snowflake error in a {object_type} batch of {len(queries)} statements: {db_error}")
+            raise
+
+    def run_queries(self, queries: list, object_type: str = "", asynchronous: bool = False, timeout: float = None) -> list:
         """
         Executes a list of queries in order and returns a list of output results.
-        Logs and skips execution if no queries are provided.
+        Stops at the first query that fails and raises its error.
+        With asynchronous, the queries are treated as independent and submitted together, see run_queries_async.
         """
+        if asynchronous:
+            return self.run_queries_async(queries, object_type=object_type, timeout=timeout)
         outp = []
 
         for index, query in enumerate(queries):
             try:
                 logging.info(f"Executing query {index + 1}/{len(queries)} for {object_type}")
                 logging.debug(f"Executing query {index + 1}/{len(queries)} for {object_type}: {query}")
-                result = self.run_query(query)
+                result = self.run_query(query, object_type)
                 outp.append(result)
                 logging.debug(f"Query executed successfully: {result}")
             except (ProgrammingError, DatabaseError) as db_error:
@@ -132,18 +328,421 @@ class SnowflakeUser:
                 logging.error(f"Query: {query}")
                 raise
             except Exception as e:
-                logging.error(f"Unexpected error in {object_type} query execution: {e}. Query: {query}. Skipping query.")
+                logging.error(f"Unexpected error in {object_type} query execution: {e}. Query: {query}")
+                raise
     
         logging.debug(f"Completed all queries for {object_type}, with {len(outp)} successful executions.")
         return outp
     
-    def post_files(self, file_configs: list[dict]) -> list:
-        outp = []
+    def submit_query(self, index: int, query: str, timeout: float = None) -> AsyncQuery:
+        if query.strip() == '':
+            async_query = AsyncQuery(index, query, None, timeout)
+            async_query.result = [Row()]
+            return async_query
+        job = self.session.sql(query).collect_nowait()
+        logging.debug(f"Submitted query {index + 1} as {getattr(job, 'query_id', None)}: {query}")
+        return AsyncQuery(index, query, job, timeout)
+
+    def run_queries_async(self, queries: list, object_type: str = "", timeout: float = None, poll_interval: float = 0.5) -> list:
+        """
+        Submits independent queries without waiting on each other, then polls them together.
+        Queries still running after timeout seconds are cancelled.
+        Returns the results in query order once every query has finished, and raises the first
+        database error (or timeout) after the other queries are done.
+        """
+        submitted = []
+        try:
+            for index, query in enumerate(queries):
+                logging.info(f"Submitting query {index + 1}/{len(queries)} for {object_type}")
+                submitted.append(self.submit_query(index, query, timeout))
+        except (ProgrammingError, DatabaseError) as db_error:
+            logging.error(f"Database error in {object_type} query submission: {db_error}")
+            for async_query in submitted:
+                async_query.cancel()
+            raise
+
+        pending = list(submitted)
+        while pending:
+            pending = [async_query for async_query in pending if not async_query.poll()]
+            if pending:
+                time.sleep(poll_interval)
+        if self.profiler is not None:
+            self.record_async_queries(submitted, object_type)
+
+        for async_query in submitted:
+            if async_query.error is None:
+                self._query_done(async_query.query)
+        errors = [async_query for async_query in submitted if async_query.error is not None]
+        for async_query in errors:
+            logging.error(f"Error in {object_type} query {async_query.index + 1}/{len(queries)} ({async_query.query_id}): {async_query.error}")
+            logging.error(f"Query: {async_query.query}")
+        if errors:
+            raise errors[0].error
+
+        logging.debug(f"Completed all queries for {object_type}, with {len(submitted)} successful executions.")
+        return [async_query.result for async_query in submitted]
+
+    def record_async_queries(self, submitted: list[AsyncQuery], object_type: str = "") -> None:
+        for async_query in submitted:
+            if async_query.job is None:
+                continue
+            self.profiler.record('query', object_type, profiling.get_statement_name(async_query.query), async_query.started,
+                                 async_query.finished - async_query.started, query_id=async_query.query_id,
+                                 rows=None if async_query.error else profiling.get_rows_affected(async_query.result),
+                                 status='failed' if async_query.error else 'ok')
+
+    def post_files(self, file_configs: list[dict], max_workers: int = 1, compress_min_size: int = None) -> list:
+        """
+        Uploads local files to their stages and returns the PUT results.
+        Files bound for the same stage directory are uploaded with one wildcard PUT when they make up
+        the whole local directory, and the PUTs run on up to max_workers threads.
+        CSV files of at least compress_min_size bytes are gzipped on upload.
+        """
+        put_groups = self.get_put_groups(file_configs, compress_min_size)
+        if max_workers <= 1 or len(put_groups) <= 1:
+            return [self._put_file(*put_group) for put_group in put_groups]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda put_group: self._put_file(*put_group), put_groups))
+
+    def get_put_groups(self, file_configs: list[dict], compress_min_size: int = None) -> list[tuple]:
+        """
+        Return (local_path, stage_path, auto_compress) for each PUT needed to upload file_configs
+        """
+        grouped = {}
         for file_config in file_configs:
-            logging.info(f"Loading local file {file_config['local_path']} to {file_config['stage_path']}")
-            outp.append(self.session.file.put(file_config['local_path'], file_config['stage_path'], auto_compress=False, overwrite=True))
-        return outp
+            local_path = Path(file_config['local_path'])
+            compress = self.should_compress(local_path, compress_min_size)
+            grouped.setdefault((local_path.parent, file_config['stage_path'], compress), []).append(local_path)
+
+        put_groups = []
+        for (local_dir, stage_path, compress), files in grouped.items():
+            dir_files = {f for f in local_dir.iterdir() if f.is_file()}
+            if len(files) > 1 and set(files) == dir_files:
+                put_groups.append((str(Path(local_dir, '*')), stage_path, compress))
+            else:
+                put_groups.extend((str(f), stage_path, compress) for f in files)
+        return put_groups
+
+    def should_compress(self, local_path: Path, compress_min_size: int = None) -> bool:
+        if compress_min_size is None or local_path.suffix.lower() != '.csv':
+            return False
+        return local_path.stat().st_size >= compress_min_size
+
+    def _put_file(self, local_path: str, stage_path: str, auto_compress: bool = False) -> list:
+        logging.info(f"Loading local file {local_path} to {stage_path}")
+        with profiling.measure(self.profiler, 'put', 'staged_files', local_path) as details:
+            result = self.session.file.put(local_path, stage_path, auto_compress=auto_compress, overwrite=True)
+            details['rows'] = len(result)
+        return result
     
+class SessionContext:
+    '''
+    The role, secondary roles, warehouse, database, schema and query tag a session was opened with,
+    so it can be put back that way before the next command borrows it
+    '''
+    query = ('SELECT CURRENT_DATABASE(), CURRENT_SCHEMA(), CURRENT_ROLE(), CURRENT_WAREHOUSE(), '
+             'CURRENT_SECONDARY_ROLES()')
+
+    def __init__(self, session: Session):
+        self.database, self.schema, self.role, self.warehouse, self.secondary_roles = self.get_current(session)
+        self.query_tag = getattr(session, 'query_tag', None)
+
+    def get_current(self, session: Session) -> tuple:
+        rows = session.sql(self.query).collect()
+        if not rows:
+            return (None, None, None, None, None)
+        return tuple(rows[0][index] for index in range(5))
+
+    def restore(self, session: Session) -> None:
+        '''
+        Undo the USE and query tag changes of the last borrower. Raises ValueError when the session
+        cannot be put back, e.g. it was opened without a database or warehouse and has one now
+        '''
+        if getattr(session, 'query_tag', None) != self.query_tag:
+            session.query_tag = self.query_tag
+        database, schema, role, warehouse, secondary_roles = self.get_current(session)
+        if role != self.role and self.role is not None:
+            # Before anything else, the warehouse and database may only be usable by this role
+            session.sql(f"USE ROLE {quote_identifier(self.role)}").collect()
+        if secondary_roles != self.secondary_roles and self.secondary_roles is not None:
+            session.sql(f"USE SECONDARY ROLES {get_secondary_roles(self.secondary_roles)}").collect()
+        if warehouse != self.warehouse:
+            if self.warehouse is None:
+                raise ValueError(f"the session was opened without a warehouse and now uses {warehouse}")
+            session.sql(f"USE WAREHOUSE {quote_identifier(self.warehouse)}").collect()
+        if (database, schema) == (self.database, self.schema):
+            return
+        if self.database is None:
+            raise ValueError(f"the session was opened without a database and is now in {database}")
+        session.use_database(quote_identifier(self.database))
+        if self.schema is not None:
+            session.use_schema(quote_identifier(self.schema))
+
+    def clear_variables(self, session: Session) -> None:
+        '''
+        Unset the session variables that SET statements left on the session
+        '''
+        rows = session.sql('SHOW VARIABLES').collect()
+        names = []
+        for row in rows:
+            record = {str(key).lower(): value for key, value in (row.as_dict() if hasattr(row, 'as_dict') else dict(row)).items()}
+            if record.get('name'):
+                names.append(quote_identifier(str(record['name'])))
+        if names:
+            session.sql(f"UNSET ({', '.join(names)})").collect()
+
+def get_secondary_roles(current: str) -> str:
+    '''
+    The USE SECONDARY ROLES argument that brings back what CURRENT_SECONDARY_ROLES() returned,
+    json like {"roles": "A,B", "value": ""} where value is ALL when every granted role is active
+    '''
+    try:
+        record = json.loads(current)
+    except (TypeError, ValueError):
+        return 'NONE'
+    if str(record.get('value') or '').upper() == 'ALL':
+        return 'ALL'
+    roles = [role.strip() for role in str(record.get('roles') or '').split(',') if role.strip()]
+    return ', '.join(quote_identifier(role) for role in roles) if roles else 'NONE'
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+class SessionPool:
+    '''
+    Hands out sessions for one environment. Idle sessions are reused, and a new login only
+    happens when every open session is busy and fewer than size sessions are open.
+    Sessions are opened with factory, a SessionFactory by default. With heartbeat_interval, idle
+    sessions run SELECT 1 that often to stay logged in, and sessions that fail it are dropped.
+    A released session gets back the role, warehouse, database, schema and query tag it was opened
+    with, so one command's USE statements never leak into the next. A session that cannot be reset is closed.
+    '''
+    def __init__(self, environment: str, size: int = 1, user: SnowflakeUser = None, factory = None,
+                 heartbeat_interval: float = None):
+        self.environment = environment
+        self.size = max(int(size or 1), 1)
+        self.factory = factory or SessionFactory()
+        self.heartbeat_interval = heartbeat_interval
+        self.profiler = user.profiler if user is not None else None
+        self._idle = []
+        self._open = 0
+        self._contexts = {}
+        self._condition = threading.Condition()
+        self._closed = threading.Event()
+        self._heartbeat = None
+        if user is not None:
+            # The user keeps using its session too, as when it deploys the account before the schemas
+            self._contexts[user.session] = SessionContext(user.session)
+            self._idle.append(user.session)
+            self._open += 1
+
+    def resize(self, size: int) -> None:
+        '''
+        Allow at least size sessions to be open at once
+        '''
+        with self._condition:
+            if size > self.size:
+                self.size = size
+                self._condition.notify_all()
+
+    def acquire_session(self, wait: bool = True) -> Session:
+        '''
+        An idle session, or a new one. With wait, blocks while size sessions are already in use,
+        otherwise opens one more than size instead
+        '''
+        with self._condition:
+            while wait and not self._idle and self._open >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        session = None
+        try:
+            logging.info(f"Opening a new session for {self.environment}")
+            session = self.factory.create(self.environment)
+            context = SessionContext(session)
+        except Exception:
+            if session is not None:
+                self._close_session(session)
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._contexts[session] = context
+        self._start_heartbeat()
+        return session
+
+    def release_session(self, session: Session) -> None:
+        if not self._closed.is_set() and self.reset_session(session):
+            with self._condition:
+                if not self._closed.is_set():
+                    self._idle.append(session)
+                    self._condition.notify()
+                    return
+        with self._condition:
+            self._open -= 1
+            self._contexts.pop(session, None)
+            self._condition.notify()
+        self._close_session(session)
+
+    def reset_session(self, session: Session) -> bool:
+        '''
+        Put a session back in the context it was opened in, returns False if it could not be
+        '''
+        context = self._contexts.get(session)
+        if context is None:
+            return True
+        try:
+            context.restore(session)
+            return True
+        except Exception as e:
+            logging.warning(f"Closing a {self.environment} session that could not be reset: {e}")
+            return False
+
+    def reset_idle_sessions(self) -> int:
+        '''
+        Reset every idle session and clear its session variables, closing the ones that fail.
+        Returns the number still open
+        '''
+        with self._condition:
+            sessions, self._idle = self._idle, []
+        clean = []
+        for session in sessions:
+            context = self._contexts.get(session)
+            try:
+                if context is not None:
+                    context.restore(session)
+                    context.clear_variables(session)
+                clean.append(session)
+            except Exception as e:
+                logging.warning(f"Closing a {self.environment} session that could not be reset: {e}")
+                self._close_session(session)
+        with self._condition:
+            for session in sessions:
+                if session not in clean:
+                    self._contexts.pop(session, None)
+            self._idle.extend(clean)
+            self._open -= len(sessions) - len(clean)
+            self._condition.notify_all()
+        return len(clean)
+
+    def acquire(self, profiler: profiling.DeployProfiler = None) -> SnowflakeUser:
+        user = SnowflakeUser(self.environment, session=self.acquire_session(), profiler=profiler or self.profiler)
+        user.pool = self
+        return user
+
+    def release(self, user: SnowflakeUser) -> None:
+        user.release()
+
+    @contextmanager
+    def user(self, profiler: profiling.DeployProfiler = None):
+        user = self.acquire(profiler)
+        try:
+            yield user
+        finally:
+            self.release(user)
+
+    def _start_heartbeat(self) -> None:
+        if not self.heartbeat_interval or self._heartbeat is not None:
+            return
+        with self._condition:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._run_heartbeat, name=f"snowflow-heartbeat-{self.environment}", daemon=True)
+                self._heartbeat.start()
+
+    def _run_heartbeat(self) -> None:
+        while not self._closed.wait(self.heartbeat_interval):
+            self.heartbeat()
+
+    def heartbeat(self) -> int:
+        '''
+        Ping every idle session, dropping the ones that fail. Returns the number still open
+        '''
+        with self._condition:
+            sessions, self._idle = self._idle, []
+        alive = []
+        for session in sessions:
+            try:
+                session.sql('SELECT 1').collect()
+                alive.append(session)
+            except Exception as e:
+                logging.warning(f"Dropping a {self.environment} session that failed its heartbeat: {e}")
+                self._close_session(session)
+        with self._condition:
+            for session in sessions:
+                if session not in alive:
+                    self._contexts.pop(session, None)
+            self._idle.extend(alive)
+            self._open -= len(sessions) - len(alive)
+            self._condition.notify_all()
+        return len(alive)
+
+    def close(self) -> None:
+        '''
+        Stop the heartbeat and log out the idle sessions
+        '''
+        self._closed.set()
+        with self._condition:
+            sessions, self._idle = self._idle, []
+            self._open -= len(sessions)
+            for session in sessions:
+                self._contexts.pop(session, None)
+        for session in sessions:
+            self._close_session(session)
+
+    def _close_session(self, session: Session) -> None:
+        try:
+            if hasattr(session, 'close'):
+                session.close()
+        except Exception as e:
+            logging.debug(f"Could not close a {self.environment} session: {e}")
+
+# Idle sessions are pinged this often so they outlive the Snowflake idle session timeout
+DEFAULT_HEARTBEAT_INTERVAL = 15 * 60
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+_session_factory = None
+
+def set_session_factory(factory) -> None:
+    '''
+    Open the sessions of pools created from now on with factory, e.g. a local fake in tests
+    '''
+    global _session_factory
+    _session_factory = factory
+
+def get_session_pool(environment: str, size: int = 1) -> SessionPool:
+    '''
+    The session pool of environment shared by the whole process, grown to allow at least size sessions
+    '''
+    with _session_pools_lock:
+        pool = _session_pools.get(environment)
+        if pool is None:
+            pool = SessionPool(environment, size, factory=_session_factory, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL)
+            _session_pools[environment] = pool
+        else:
+            pool.resize(size)
+        return pool
+
+def reset_session_pools() -> None:
+    '''
+    Put every idle pooled session back in the context it was opened in, without session variables,
+    e.g. before a long running process starts a command for another client
+    '''
+    with _session_pools_lock:
+        pools = list(_session_pools.values())
+    for pool in pools:
+        pool.reset_idle_sessions()
+
+@atexit.register
+def close_session_pools() -> None:
+    with _session_pools_lock:
+        pools = list(_session_pools.values())
+        _session_pools.clear()
+    for pool in pools:
+        pool.close()
+
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
\ No newline at end of file
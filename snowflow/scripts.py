@@ -1,26 +1,165 @@
+from __future__ import annotations
 from pathlib import Path
+from typing import Iterator
+from .lazy import LazyModule
+from . import splitter
+from . import cache
+from types import MappingProxyType
+import functools
 import yaml
+import copy
 import logging
-import networkx as nx
+nx = LazyModule('networkx')
 import sys
+import re
 import os
 
+# Object types whose files are sent whole, as one statement, instead of split on semicolons
+SINGLE_TRANSACTION_TYPES = ['stored_procs']
+
+def is_single_transaction(obj_type: str) -> bool:
+    return obj_type in SINGLE_TRANSACTION_TYPES
+
+class VariableSubstituter:
+    '''
+    Replaces every variable of a substitution set in a single pass over the text.
+    The variable names are compiled once into a regex shaped like a trie, and the longest name wins
+    where one name is a prefix of another, so results do not depend on the order of the variables.
+    '''
+    placeholder_pattern = re.compile(r'!!![A-Za-z0-9_]+!!!')
+
+    def __init__(self, substitutions: dict):
+        self.substitutions = {str(var): str(val) for var, val in substitutions.items() if str(var) != ''}
+        self.pattern = re.compile(self._get_trie_pattern(self.substitutions.keys())) if self.substitutions else None
+
+    def _get_trie_pattern(self, names) -> str:
+        trie = {}
+        for name in names:
+            node = trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        return self._get_node_pattern(trie)
+
+    def _get_node_pattern(self, node: dict) -> str:
+        branches = [re.escape(char) + self._get_node_pattern(child) for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A name ends here, but a longer name may continue. The greedy ? tries the longer one first
+            pattern = ('(?:' + pattern + ')' if len(branches) == 1 else pattern) + '?'
+        return pattern
+
+    def substitute(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda match: self.substitutions[match.group(0)], text)
+
+    def get_unresolved(self, text: str) -> set[str]:
+        '''
+        Return the !!!VAR!!! style placeholders left in text
+        '''
+        return set(self.placeholder_pattern.findall(text))
+
+@functools.lru_cache(maxsize=128)
+def get_substituter(variables: tuple) -> VariableSubstituter:
+    '''
+    The compiled substituter of a set of (variable, value) pairs, shared by every scope in the process that has the same set
+    '''
+    return VariableSubstituter(dict(variables))
+
+class VariableScope:
+    '''
+    An immutable layer of query variables on top of an optional parent scope: the environment's
+    query_variables.yaml, then a DAG's settings, then a task's name and script.
+    child() makes a new scope and never changes this one, so scopes can be shared between threads
+    and schemas, DAGs and tasks compiled one after another or concurrently do not leak variables.
+    Each layer compiles only its own variables. Variables of an inner layer win over the outer ones.
+    '''
+    def __init__(self, variables: dict = None, parent: VariableScope = None):
+        self.parent = parent
+        self.variables = MappingProxyType({str(var): str(val) for var, val in (variables or {}).items() if str(var) != ''})
+        self._substituter = None
+        self._fingerprint = None
+
+    def child(self, variables: dict) -> VariableScope:
+        return VariableScope(variables, self)
+
+    def get_all(self) -> dict:
+        '''
+        Every variable visible in this scope
+        '''
+        merged = self.parent.get_all() if self.parent is not None else {}
+        merged.update(self.variables)
+        return merged
+
+    def get_fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = cache.get_fingerprint(self.get_all())
+        return self._fingerprint
+
+    def get_substituter(self) -> VariableSubstituter:
+        if self._substituter is None:
+            self._substituter = get_substituter(tuple(sorted(self.variables.items())))
+        return self._substituter
+
+    def substitute(self, text: str) -> str:
+        '''
+        Replace this layer's variables, and the parent's in the text between them, in a single pass
+        '''
+        pattern = self.get_substituter().pattern
+        if pattern is None:
+            return self.parent.substitute(text) if self.parent is not None else text
+        if self.parent is None:
+            return pattern.sub(lambda match: self.variables[match.group(0)], text)
+        parts = []
+        position = 0
+        for match in pattern.finditer(text):
+            parts.append(self.parent.substitute(text[position:match.start()]))
+            parts.append(self.variables[match.group(0)])
+            position = match.end()
+        parts.append(self.parent.substitute(text[position:]))
+        return ''.join(parts)
+
 class ScriptParser:
-    def __init__(self, substitutions=dict()):
-        self.substitutions: dict = substitutions or {}
+    '''
+    Reads sql and yaml files of the project with the variables of one scope substituted.
+    with_variables() returns a parser for a child scope and leaves this one unchanged.
+    '''
+    def __init__(self, scope=None, reported_unresolved: set = None):
+        self.scope: VariableScope = scope if isinstance(scope, VariableScope) else VariableScope(scope)
+        self.reported_unresolved = reported_unresolved if reported_unresolved is not None else set()
 
-    def parse_yaml_file(self, file_path: Path) -> dict:
+    @property
+    def substitutions(self) -> dict:
+        return self.scope.get_all()
+
+    def with_variables(self, variables: dict) -> ScriptParser:
+        return ScriptParser(self.scope.child(variables), self.reported_unresolved)
+
+    def get_substitutions_fingerprint(self) -> str:
+        return self.scope.get_fingerprint()
+
+    def parse_yaml_file(self, file_path: Path, substitute: bool = True) -> dict:
         '''
         Load a yaml file as a python dictionary
         '''
         try:
+            project_cache = cache.get_project_cache()
+            variables = self.get_substitutions_fingerprint() if substitute else ''
+            data = project_cache.get('yaml', file_path, variables)
+            if data is not None:
+                return copy.deepcopy(data)
             with open(file_path, 'r') as raw_yaml:
                 string_file = raw_yaml.read()
                 string_file = string_file.replace('\t','  ')
-                string_file = self.substitute_vars(string_file)
+                if substitute:
+                    string_file = self.substitute_vars(string_file)
                 data = yaml.safe_load(string_file)
                 if data is None:
                     return {}
+                project_cache.put('yaml', file_path, copy.deepcopy(data), variables)
                 return data
         except yaml.YAMLError as e:
             logging.error(f"YAML parsing error in {file_path}. Error: {e}")
@@ -32,7 +171,7 @@ class ScriptParser:
     def get_path_yamls(self, path: Path) -> list[dict]:
         try:
             yamls=[]
-            for f in path.glob("*.yaml"):
+            for f in cache.get_project_cache().list_files(path, "*.yaml"):
                 yamls.append(self.parse_yaml_file(f))
             return yamls
         except FileNotFoundError as e:
@@ -52,9 +191,8 @@ class ScriptParser:
 
     def substitute_vars(self, query: str) -> str:
         try:
-            if self.substitutions:
-                for var, val in self.substitutions.items():
-                    query = query.replace(var, str(val))
+            query = self.scope.substitute(query)
+            self.report_unresolved(self.scope.get_substituter().get_unresolved(query))
             return query
         except TypeError as te:
             logging.error(f"TypeError in substitute_vars: {te}. Substitutions: {self.substitutions}")
@@ -64,6 +202,12 @@ class ScriptParser:
             logging.error(f"Query: {query}, Substitutions: {self.substitutions}")
             raise
     
+    def report_unresolved(self, placeholders: set[str]) -> None:
+        new = placeholders - self.reported_unresolved
+        if new:
+            self.reported_unresolved.update(new)
+            logging.warning(f"No value found in query_variables.yaml for: {', '.join(sorted(new))}")
+
     def strip_special_chars(self, query: str) -> str:
         try:
             return query.rstrip()
@@ -106,9 +250,30 @@ class ScriptParser:
             return ''
 
     
+    def read_file_statements(self, path: Path) -> Iterator[splitter.Statement]:
+        '''
+        Lazily read the statements of a sql file, with variables substituted and the line each one starts on
+        '''
+        project_cache = cache.get_project_cache()
+        cached = project_cache.get_statements(path)
+        if cached is not None:
+            for text, line in cached:
+                yield splitter.Statement(self.substitute_vars(text), line, path)
+            return
+
+        raw = [] if project_cache.is_cacheable(path) else None
+        for statement in splitter.split_file(path):
+            if raw is not None:
+                raw.append([statement.text, statement.line])
+            statement.text = self.substitute_vars(statement.text)
+            yield statement
+        if raw is not None:
+            project_cache.put_statements(path, raw)
+
     def read_file_queries(self, path: Path, single_transaction=False) -> list[str]:
         '''
         Read a sql file that can contain multiple queries
+        Use single_transaction to keep the whole file as one query
         '''
         try:
             queries= []
@@ -116,39 +281,55 @@ class ScriptParser:
                 if single_transaction:
                     queries = [self.read_clean_file(path)]
                 else:
-                    queries = self.read_clean_file(path).strip(';').split(';')
+                    queries = [statement.text for statement in self.read_file_statements(path)]
             return queries
         except Exception as e:
             logging.error(e)
             return []
 
-    def get_path_queries(self, path: Path, single_transaction: bool = False) -> list[str]:
+    def get_path_file_queries(self, path: Path, single_transaction: bool = False) -> dict[Path, list[str]]:
         """
-        Loop over path, return contents of files in a list of queries.
+        Loop over path, return the queries of each file keyed by the file path, in file name order.
         Looks in the current working directory
         """
         user_path = os.path.join(os.getcwd(), path)
-        queries = []
-        for f in sorted(Path(user_path).glob("*.sql")):
+        file_queries = {}
+        for f in cache.get_project_cache().list_files(user_path, "*.sql"):
             if single_transaction:
-                queries.append(self.read_clean_file(f))
+                file_queries[f] = [self.read_clean_file(f)]
             else:
-                queries.extend(self.read_file_queries(f))
+                file_queries[f] = self.read_file_queries(f)
+        return file_queries
+
+    def get_path_queries(self, path: Path, single_transaction: bool = False) -> list[str]:
+        """
+        Loop over path, return contents of files in a list of queries.
+        Looks in the current working directory
+        """
+        queries = []
+        for file_queries in self.get_path_file_queries(path, single_transaction).values():
+            queries.extend(file_queries)
     
         logging.debug(queries)
         return queries
 
 class SQLTemplates:
+    # Templates ship with the package and do not change while running, so they are read once per process
+    _templates = {}
+
     def __init__(self):
         self.sf_task_template = self.get_template('sf_task_template.sql')
         self.sql_procedure_template = self.get_template('sql_procedure_template.sql')
         self.user_task_template = self.get_template('user_task_template.sql')
 
     def get_template(self, name):
+        if name in SQLTemplates._templates:
+            return SQLTemplates._templates[name]
         p = Path(__file__).with_name(name)
         try:
             with p.open('r') as f:
-                return f.read()
+                SQLTemplates._templates[name] = f.read()
+                return SQLTemplates._templates[name]
         except FileNotFoundError as e:
             logging.error(e)
             logging.error('Could not find sql template')
@@ -204,8 +385,9 @@ class Environment:
         self.sp = ScriptParser()
         self.query_variables_file = 'query_variables.yaml'
         self.env_var = environment  
-        self.query_variables = self.get_query_variables(self.env_var) 
-        self.sp.substitutions = self.query_variables or {}
+        self.query_variables = self.get_query_variables(self.env_var) or {}
+        self.scope = VariableScope(self.query_variables)
+        self.sp = ScriptParser(self.scope)
 
     def get_query_variables(self, env):
         try:
@@ -215,7 +397,7 @@ class Environment:
             if not local_path.exists():
                 local_path.touch()
                 return {}
-            raw_vars = self.sp.parse_yaml_file(local_path)
+            raw_vars = self.sp.parse_yaml_file(local_path, substitute=False)
 
             if raw_vars is None:
                 logging.debug("query_variables.yaml is empty.")
@@ -256,13 +438,24 @@ class SnowflakeAcct:
         Path(self.env_dir, 'init.sql').touch()
         Path(self.env_dir, 'grants.sql').touch()
 
-    def get_path_objects(self, obj_type:str, single_transaction: bool=False) -> list[str]:
+    def get_path_objects(self, obj_type:str, single_transaction: bool=None) -> list[str]:
         '''
         Look up scripts based on string type (roles, tables, views, etc)
-        Use single transaction is a file shouldn't be split into multiple transactions by semicolons
+        Use single transaction is a file shouldn't be split into multiple transactions by semicolons,
+        by default only for the SINGLE_TRANSACTION_TYPES
         '''
+        if single_transaction is None:
+            single_transaction = is_single_transaction(obj_type)
         return self.sp.get_path_queries(self.child_lookup[obj_type],single_transaction)
 
+    def get_path_object_files(self, obj_type:str, single_transaction: bool=None) -> dict[Path, list[str]]:
+        '''
+        Same as get_path_objects, but keeps the queries grouped by the file they came from
+        '''
+        if single_transaction is None:
+            single_transaction = is_single_transaction(obj_type)
+        return self.sp.get_path_file_queries(self.child_lookup[obj_type],single_transaction)
+
     def get_grants(self) -> list[str]:
         return self.sp.read_file_queries(Path(self.env_dir, 'grants.sql'))
     
@@ -273,6 +466,32 @@ class SnowflakeAcct:
         #return all the database objects
         return [SnowflakeDB(d.stem,self) for d in self.child_lookup['databases'].iterdir() if d.is_dir()]
 
+    def get_schema_digraph(self, schemas: list) -> nx.DiGraph:
+        '''
+        Graph of "db.schema" names with an edge from a schema to every schema that references it,
+        so independent schemas can be deployed concurrently.
+        Falls back to a chain in the given order if the schemas reference each other in a cycle.
+        '''
+        digraph = nx.DiGraph()
+        digraph.add_nodes_from(str(schema) for schema in schemas)
+        texts = {str(schema): schema.get_source_text() for schema in schemas}
+        for schema in schemas:
+            for other in schemas:
+                if other is schema:
+                    continue
+                if other.database.name.lower() == schema.database.name.lower():
+                    pattern = r'(?<![\w$])(?:' + re.escape(other.database.name) + r'\s*\.\s*)?' + re.escape(other.name) + r'\s*\.'
+                else:
+                    pattern = r'(?<![\w$])' + re.escape(other.database.name) + r'\s*\.\s*' + re.escape(other.name) + r'\s*\.'
+                if re.search(pattern, texts[str(schema)], re.I):
+                    digraph.add_edge(str(other), str(schema))
+        if not nx.is_directed_acyclic_graph(digraph):
+            logging.warning('Schemas reference each other in a cycle. Deploying them one at a time.')
+            digraph = nx.DiGraph()
+            digraph.add_nodes_from(str(schema) for schema in schemas)
+            nx.add_path(digraph, [str(schema) for schema in schemas])
+        return digraph
+
 class SnowflakeDB:
     def __init__(self, name: str, account: SnowflakeAcct):
         self.account=account
@@ -315,7 +534,6 @@ class SnowflakeSchema:
         self.environment = self.account.environment
         self.query_variables = self.environment.query_variables
         self.sp = database.sp
-        self.sp.substitutions = self.sp.substitutions | self.query_variables
         self.dh = database.dh
         self.schema_path = Path(os.getcwd(), 'snowflake', 'databases', self.database.name, 'schemas', self.name)
         self.child_objects= ['file_formats', 'tables','streams','stages','views','tasks','dags','udfs', 'stored_procs', 'staged_files', 'post_deploy']
@@ -339,18 +557,35 @@ class SnowflakeSchema:
         self.dh.initialize_directory(self.schema_path, self.path_lookup)
         return True
     
-    def get_path_objects(self, obj_type:str, single_transaction: bool=False) -> list[str]:
+    def get_path_objects(self, obj_type:str, single_transaction: bool=None) -> list[str]:
         '''
         Look up scripts based on string type (roles, tables, views, etc)
-        Use single transaction is a file shouldn't be split into multiple transactions by semicolons
+        Use single transaction is a file shouldn't be split into multiple transactions by semicolons,
+        by default only for the SINGLE_TRANSACTION_TYPES
         '''
+        if single_transaction is None:
+            single_transaction = is_single_transaction(obj_type)
         return self.sp.get_path_queries(self.path_lookup[obj_type],single_transaction)
 
+    def get_path_object_files(self, obj_type:str, single_transaction: bool=None) -> dict[Path, list[str]]:
+        '''
+        Same as get_path_objects, but keeps the queries grouped by the file they came from
+        '''
+        if single_transaction is None:
+            single_transaction = is_single_transaction(obj_type)
+        return self.sp.get_path_file_queries(self.path_lookup[obj_type],single_transaction)
+
+    def get_source_text(self) -> str:
+        '''
+        Raw text of every sql file in the schema folder, used to find references to other schemas
+        '''
+        return '\n'.join(self.sp.read_file(f) for f in sorted(self.schema_path.glob('**/*.sql')))
+
     def get_tables(self) -> list[str]:
         return self.sp.get_path_queries(self.path_lookup.get('tables'))
     
     def get_stored_procs(self) -> list[str]:
-        return self.sp.get_path_queries(self.path_lookup.get('stored_procs'), single_transaction=True) if self.path_lookup.get('stored_procs') else []
+        return self.get_path_objects('stored_procs') if self.path_lookup.get('stored_procs') else []
     
     def get_grants(self) -> list[str]:
         return self.sp.read_file_queries(Path(self.schema_path,'grants.sql')) 
@@ -362,19 +597,31 @@ class SnowflakeSchema:
             queries.extend(dag.get_all_queries())
         return queries
 
+    def get_dag_files(self) -> dict[Path, list[str]]:
+        '''
+        Return the generated queries of each DAG keyed by the DAG yaml file, in file name order
+        '''
+        dag_files = {}
+        for f in cache.get_project_cache().list_files(self.path_lookup['dags'], "*.yaml"):
+            dag_files[f] = TaskDAG(self.sp.parse_yaml_file(f), self).get_all_queries()
+        return dag_files
+
     def get_dag_objs(self):
         return [TaskDAG(cd, self) for cd in self.sp.get_path_yamls(self.path_lookup['dags'])]
     
     def get_dag(self, file_name) -> list[str]:
+        dag = self.get_task_dag(file_name)
+        return dag.get_all_queries() if dag else []
+
+    def get_task_dag(self, file_name) -> TaskDAG:
         curr_dag_path = Path(self.path_lookup['dags'], file_name) if self.path_lookup.get('dags') else None
         if curr_dag_path:
             logging.debug(curr_dag_path)
             cd = self.sp.parse_yaml_file(curr_dag_path)
-            dag = TaskDAG(cd, self)
-            return dag.get_all_queries()
+            return TaskDAG(cd, self)
         else:
             logging.debug(f"Skipping dag {file_name}, folder does not exist.")
-            return []
+            return None
     
     def get_staged_files(self) -> list[dict]:
         """
@@ -387,16 +634,37 @@ class SnowflakeSchema:
         if staged_files_path.exists():
             stages = [p for p in list(staged_files_path.glob('*')) if p.is_dir()]
             for stage in stages:
-                local_stage = Path(staged_files_path, stage)
                 files = [f for f in list(stage.glob('**/*')) if f.is_file()]
                 for file in files:
-                    local_path = str(file)
-                    stage_path = '@' + stage.name + '/' + file.relative_to(local_stage).parent.as_posix()
-                    outp.append({'local_path': local_path, 'stage_path': stage_path})
+                    outp.append(self.get_staged_file(file))
         else:
             logging.debug(f"Skipping staged files, folder does not exist.")
         return outp
 
+    def get_staged_file(self, file: Path) -> dict:
+        '''
+        The {'local_path': ,'stage_path':} of one file under staged_files/<stage>/
+        '''
+        relative = Path(file).relative_to(Path(self.schema_path, 'staged_files'))
+        stage_path = '@' + relative.parts[0] + '/' + relative.relative_to(relative.parts[0]).parent.as_posix()
+        return {'local_path': str(file), 'stage_path': stage_path}
+
+    def get_object_type(self, path: Path) -> str:
+        '''
+        The path_lookup key of the folder a file of this schema is in, 'init' or 'grants' for the
+        schema's own init.sql and grants.sql, or None for a file outside the schema
+        '''
+        path = Path(path)
+        if path.parent == self.schema_path and path.name in ('init.sql', 'grants.sql'):
+            return path.stem
+        for object_type, folder in self.path_lookup.items():
+            if folder in path.parents:
+                if object_type == 'staged_files' and len(path.relative_to(folder).parts) < 2:
+                    # Files directly in staged_files belong to no stage
+                    return None
+                return object_type
+        return None
+
 class TaskDAG:
     def __init__(self, config_dict: dict, schema: SnowflakeSchema):
         self.config_dict=config_dict
@@ -405,11 +673,10 @@ class TaskDAG:
         self.schema= schema
         self.name = self.config_dict.get('DAG_NAME')
         self.root= self.config_dict.get('ROOT_TASK')
-        self.sp = schema.sp
         self.dh = schema.dh
         self.query_variables = self.get_query_variables()
+        self.sp = schema.sp.with_variables(self.query_variables)
         self.task_template: str = self._get_task_template()
-        self.sp.substitutions = self.query_variables
         self.task_dict, self.digraph = self._get_structs()
          
         
@@ -453,9 +720,24 @@ class TaskDAG:
             root_disable = "ALTER TASK "+self.root+" SUSPEND"
             query_list.append(root_disable)
         return query_list
+
+    def get_tasks_running(self, script_path: Path) -> list[Task]:
+        '''
+        The tasks whose SCRIPT_PATH is script_path
+        '''
+        return [task for task in self.task_dict.values() if task.script_path.resolve() == Path(script_path).resolve()]
+
+    def get_task_queries(self) -> dict:
+        '''
+        Returns {task name: [statements of its SCRIPT_PATH]}, the DML the tasks run when the DAG fires
+        '''
+        return {name: task.get_script_queries() for name, task in self.task_dict.items()}
     
     def get_query_variables(self) -> dict:
-        var_dict = self.schema.query_variables
+        '''
+        The DAG settings templates refer to, layered over the schema's variables
+        '''
+        var_dict = dict()
         keys = ['ROOT_TASK','INITIAL_WAREHOUSE_SIZE','ALLOW_OVERLAPPING_EXECUTION','WAREHOUSE']
         for key in keys:
             var_dict['!!!'+key+'!!!'] = self.config_dict.get(key)
@@ -488,8 +770,7 @@ class Task:
         self.account= self.database.account
         self.is_root = self._is_root()
         self.script_path = Path(self.database.dml_path, self.config_dict.get('SCRIPT_PATH'))
-        self.sp = ScriptParser(self.dag.sp.substitutions.copy())
-        self.sp.substitutions.update(self.get_query_variables())
+        self.sp = self.dag.sp.with_variables(self.get_query_variables())
     
     def get_create_queries(self) -> list[str]:
         l = list()
@@ -539,8 +820,14 @@ class Task:
         return var_dict
 
     def get_script_code(self) -> str:
-        query_list =  self.sp.read_file_queries(self.script_path)
-        return ';'.join(query_list)
+        return ';'.join(self.get_script_queries())
+
+    def get_script_queries(self) -> list[str]:
+        '''
+        The statements of SCRIPT_PATH with the DAG's variables. They become !!!SCRIPT_CODE!!! of the
+        task's own scope, so the task's variables are not substituted into them, here or in the procedure
+        '''
+        return self.dag.sp.read_file_queries(self.script_path)
     
     def get_schedule(self) -> str:
         #if root, "SCHEDULE = 'USING CRON 0 8 * * * America/New_York'"
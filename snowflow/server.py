@@ -0,0 +1,321 @@
+from multiprocessing.connection import Listener, Client, Connection, answer_challenge, deliver_challenge
+from multiprocessing import AuthenticationError
+from pathlib import Path
+from .lazy import LazyModule
+from . import commands
+from . import cache
+from . import watch
+# The client side of this module runs on every served command, so it must not load Snowpark
+runner = LazyModule('snowflow.runner')
+import threading
+import secrets
+import socket
+import logging
+import json
+import time
+import sys
+import os
+
+# Commands a running server takes over from the command line
+SERVED_COMMANDS = {'deploy': commands.Deploy, 'run_script': commands.RunScript, 'test_dag': commands.TestDAG}
+DEFAULT_WATCH_INTERVAL = 1.0
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s'
+# Seconds to wait for a server to start the handshake, so a port now held by another program does not hang the command
+CONNECT_TIMEOUT = 5.0
+
+def get_server_file(root: str = None) -> Path:
+    '''
+    Where a running server writes its address and key, in the .snowflow folder of the project it serves
+    '''
+    return Path(root or os.getcwd(), '.snowflow', 'server.json')
+
+def read_server_file(root: str = None) -> dict:
+    path = get_server_file(root)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def connect(root: str = None):
+    '''
+    A connection to the server of the project in root, or None when no server is running there.
+    A server file left behind by a server that is gone, or whose port another program or another
+    server now holds, counts as no server, so the command runs locally.
+    '''
+    info = read_server_file(root)
+    if info is None:
+        return None
+    if not is_process_running(info.get('pid')):
+        logging.debug(f"The snowflow server of {get_server_file(root)} is no longer running")
+        return None
+    try:
+        return open_connection(tuple(info['address']), bytes.fromhex(info['authkey']))
+    except (OSError, EOFError, KeyError, ValueError, AuthenticationError) as e:
+        logging.debug(f"No snowflow server at {get_server_file(root)}: {e}")
+        return None
+
+def open_connection(address: tuple, authkey: bytes, timeout: float = None) -> Connection:
+    '''
+    Client(address, authkey), but giving up when nothing starts the handshake within timeout seconds
+    '''
+    timeout = CONNECT_TIMEOUT if timeout is None else timeout
+    sock = socket.create_connection(address, timeout=timeout)
+    sock.setblocking(True)
+    conn = Connection(sock.detach())
+    try:
+        # A server sends its challenge as soon as it accepts
+        if not conn.poll(timeout):
+            raise TimeoutError(f"{address} did not start the handshake within {timeout} seconds")
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def is_process_running(pid) -> bool:
+    if not isinstance(pid, int) or pid <= 0:
+        return False
+    if os.name == 'nt':
+        # os.kill would end the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        process_query_limited_information, still_active = 0x1000, 259
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == still_active
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        # Running, as another user
+        return True
+    except OSError:
+        return False
+    return True
+
+def send_command(command: str, environment: str, args: dict) -> int:
+    '''
+    Run a command on the server of the current project, printing its log as it arrives.
+    Returns the exit status, or None when no server is running so the command should run locally.
+    '''
+    conn = connect()
+    if conn is None:
+        return None
+    with conn:
+        conn.send({'command': command, 'environment': environment, 'args': args, 'cwd': os.getcwd()})
+        while True:
+            try:
+                kind, value = conn.recv()
+            except EOFError:
+                logging.error('The snowflow server closed the connection before the command finished')
+                return 1
+            if kind == 'log':
+                print(value, flush=True)
+            elif kind == 'done':
+                if value['status'] != 'ok':
+                    logging.error(f"{command} failed on the snowflow server: {value['error']}")
+                return 0 if value['status'] == 'ok' else 1
+
+def stop_server(root: str = None) -> bool:
+    conn = connect(root)
+    if conn is None:
+        logging.info('No snowflow server is running for this project')
+        return False
+    with conn:
+        conn.send({'command': 'stop'})
+        conn.recv()
+    logging.info('Stopped the snowflow server')
+    return True
+
+class ForwardingHandler(logging.Handler):
+    '''
+    Sends the log records of a request to the client that made it
+    '''
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.conn.send(('log', self.format(record)))
+        except (OSError, ValueError):
+            # The client went away. The command still finishes, its log stays on the server
+            pass
+
+class ProjectWatcher(watch.FileWatcher):
+    '''
+    Polls the project files and connections.toml for changes. Changed project files are dropped from
+    the project cache, and a changed connections.toml closes the pooled sessions so the next command
+    logs in with the new settings.
+    '''
+    def __init__(self, root: str, interval: float = DEFAULT_WATCH_INTERVAL):
+        self.root = Path(root)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        super().__init__(self.get_paths)
+
+    def get_paths(self) -> list[Path]:
+        paths = [Path(self.root, 'query_variables.yaml')] + [Path(path) for path in runner.get_connection_paths()]
+        return paths + list(Path(self.root, 'snowflake').glob('**/*'))
+
+    def check(self) -> list[str]:
+        '''
+        Invalidate what changed since the last check, returns the changed paths
+        '''
+        with self._lock:
+            changed = self.get_changes()
+        if not changed:
+            return []
+        connection_paths = set(runner.get_connection_paths())
+        if connection_paths & set(changed):
+            logging.info('connections.toml changed, closing the pooled sessions')
+            runner.clear_connection_files()
+            runner.close_session_pools()
+        dropped = cache.get_project_cache().invalidate([Path(path) for path in changed])
+        logging.info(f"{len(changed)} project files changed, dropped {dropped} cached entries")
+        return changed
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='snowflow-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.warning(f"Could not check the project for changes: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+class SnowflowServer:
+    '''
+    Serves deploy, run_script and test_dag requests from the command line of one project, over a
+    local socket that only clients knowing the key in .snowflow/server.json can use.
+    Sessions stay open in the process's session pools and parsed files in its project cache between
+    requests, so a command pays neither the login nor the project parse again.
+    Requests run one at a time, and their log is sent back to the client as it is written.
+    '''
+    def __init__(self, root: str, environments: list[str] = None, port: int = 0, watch_interval: float = DEFAULT_WATCH_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.environments = environments or []
+        self.port = port
+        self.watcher = ProjectWatcher(self.root, watch_interval)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.listener = None
+        self.authkey = None
+
+    def warm_up(self) -> None:
+        '''
+        Log in to the environments given on the command line and parse the project before the first request
+        '''
+        for env in self.environments:
+            pool = runner.get_session_pool(env)
+            pool.release_session(pool.acquire_session())
+            logging.info(f"Logged in to {env}")
+        for env in self.environments or [None]:
+            try:
+                commands.Deploy(env).compile_plans({'all': True})
+            except Exception as e:
+                logging.warning(f"Could not parse the project ahead of the first request: {e}")
+
+    def write_server_file(self, authkey: bytes) -> None:
+        path = get_server_file(self.root)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The key lets anyone who can read it run commands as this user, so only the owner can
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'address': list(self.listener.address), 'authkey': authkey.hex(), 'root': self.root}, f)
+
+    def serve_forever(self) -> None:
+        self.authkey = secrets.token_bytes(32)
+        self.listener = Listener(('127.0.0.1', self.port), authkey=self.authkey)
+        try:
+            self.warm_up()
+            # Logging in read connections.toml, watch it from here on
+            self.watcher.reset()
+            self.write_server_file(self.authkey)
+            self.watcher.start()
+            logging.info(f"Serving {self.root} on port {self.listener.address[1]}. Stop with: snowflow serve --stop")
+            while not self.stopped.is_set():
+                try:
+                    conn = self.listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    # A client with the wrong key, or one that hung up during the handshake
+                    logging.warning(f"Refused a connection: {e}")
+                    continue
+                if self.stopped.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            logging.info('Interrupted')
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        self.watcher.stop()
+        info = read_server_file(self.root)
+        if info is not None and info.get('pid') == os.getpid():
+            get_server_file(self.root).unlink()
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        cache.get_project_cache().save()
+        runner.close_session_pools()
+
+    def handle(self, conn) -> None:
+        with conn:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            if request.get('command') == 'stop':
+                conn.send(('done', {'status': 'ok', 'error': ''}))
+                self.stopped.set()
+                # Wake up accept() so serve_forever can return
+                Client(self.listener.address, authkey=self.authkey).close()
+                return
+            conn.send(('done', self.run_request(request, conn)))
+
+    def run_request(self, request: dict, conn) -> dict:
+        command = request.get('command')
+        if command not in SERVED_COMMANDS:
+            return {'status': 'failed', 'error': f"The server does not run {command}"}
+        if os.path.abspath(request.get('cwd', '')) != self.root:
+            return {'status': 'failed', 'error': f"The server serves {self.root}, not {request.get('cwd')}"}
+        with self.lock:
+            # The watcher polls on its own schedule, check once more so this request sees every saved file
+            self.watcher.check()
+            # Sessions are shared by every client, start each request from the context they were opened in
+            runner.reset_session_pools()
+            handler = ForwardingHandler(conn)
+            root_logger = logging.getLogger()
+            root_logger.addHandler(handler)
+            start = time.perf_counter()
+            try:
+                SERVED_COMMANDS[command](request.get('environment')).run(request.get('args') or {})
+                return {'status': 'ok', 'error': ''}
+            except BaseException as e:
+                if isinstance(e, KeyboardInterrupt):
+                    raise
+                logging.error(f"{command} failed: {e}")
+                return {'status': 'failed', 'error': str(e) or type(e).__name__}
+            finally:
+                logging.info(f"{command} took {time.perf_counter() - start:.2f}s on the server")
+                root_logger.removeHandler(handler)
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=LOG_FORMAT)
@@ -0,0 +1,240 @@
+from pathlib import Path
+from typing import Iterable, Iterator
+import logging
+import sys
+import re
+
+NORMAL_TOKEN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<line_comment>--|//)
+    | (?P<block_comment>/\*)
+    | (?P<single_quote>')
+    | (?P<double_quote>")
+    | (?P<dollar_quote>\$\$)
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<semicolon>;)
+    | (?P<other>.)
+    """, re.S | re.X)
+
+# Words after BEGIN that make it a transaction instead of a scripting block
+TRANSACTION_WORDS = {'TRANSACTION', 'WORK', 'NAME'}
+# Words after END that close a scripting construct which is not counted as a block
+CONSTRUCT_WORDS = {'IF', 'FOR', 'LOOP', 'WHILE', 'REPEAT'}
+
+class Statement:
+    '''
+    One SQL statement and where it starts in its source
+    '''
+    def __init__(self, text: str, line: int, path: Path = None):
+        self.text = text
+        self.line = line
+        self.path = path
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"Statement({self.get_location()})"
+
+    def get_location(self) -> str:
+        return f"{self.path}:{self.line}" if self.path else f"line {self.line}"
+
+class StatementSplitter:
+    '''
+    Splits SQL text into statements on semicolons, one chunk at a time.
+    Semicolons inside string literals, quoted identifiers, comments, $$ quoted bodies and
+    Snowflake Scripting blocks (BEGIN ... END, DECLARE ... END, CASE ... END) do not split, whether the
+    block is the statement itself or the body of a procedure after AS.
+    Feed chunks with feed() and call close() at the end; both yield finished statements.
+    '''
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.buffer = ''
+        self.parts = []
+        self.state = 'normal'
+        self.line = 1
+        self.start_line = None
+        self.depth = 0
+        # The last word of the statement so far, '' after any other token, None at its start
+        self.previous_word = None
+        self.declare_open = False
+        self.pending_word = None
+        self.has_code = False
+
+    def feed(self, chunk: str) -> Iterator[Statement]:
+        self.buffer += chunk
+        yield from self._scan(final=False)
+
+    def close(self) -> Iterator[Statement]:
+        yield from self._scan(final=True)
+        self._resolve_pending(None)
+        statement = self._finish(last=True)
+        if statement is not None:
+            yield statement
+        if self.state != 'normal' or self.depth > 0:
+            logging.warning(f"Unterminated {self.state if self.state != 'normal' else 'block'} at the end of {self.path or 'script'}")
+
+    def _consume(self, text: str) -> None:
+        if self.start_line is None and text.strip():
+            self.start_line = self.line + text[:len(text) - len(text.lstrip())].count('\n')
+        self.parts.append(text)
+        self.line += text.count('\n')
+
+    def _scan(self, final: bool) -> Iterator[Statement]:
+        pos = 0
+        buffer = self.buffer
+        while pos < len(buffer):
+            if self.state == 'normal':
+                match = NORMAL_TOKEN.match(buffer, pos)
+                kind = match.lastgroup
+                if match.end() == len(buffer) and not final and kind in ('space', 'word', 'other'):
+                    # The token may continue in the next chunk
+                    break
+                if not final and buffer[pos] in '-/$' and pos + 1 == len(buffer):
+                    break
+                text = match.group(0)
+                pos = match.end()
+                if kind == 'semicolon':
+                    self._resolve_pending(';')
+                    if self.depth > 0:
+                        self._consume(text)
+                    else:
+                        statement = self._finish()
+                        if statement is not None:
+                            yield statement
+                    continue
+                self._consume(text)
+                if kind == 'word':
+                    self.has_code = True
+                    self._on_word(text.upper())
+                elif kind in ('line_comment', 'block_comment', 'single_quote', 'double_quote', 'dollar_quote'):
+                    self.state = kind
+                    if kind in ('single_quote', 'double_quote', 'dollar_quote'):
+                        self.has_code = True
+                        self.previous_word = ''
+                        self._resolve_pending(text)
+                elif kind == 'other':
+                    self.has_code = True
+                    self.previous_word = ''
+                    self._resolve_pending(text)
+            else:
+                end = self._find_state_end(buffer, pos, final)
+                if end is None:
+                    if final:
+                        self._consume(buffer[pos:])
+                        pos = len(buffer)
+                        if self.state == 'line_comment':
+                            # A comment on the last line of a file does not need a newline
+                            self.state = 'normal'
+                    break
+                self._consume(buffer[pos:end])
+                pos = end
+                self.state = 'normal'
+        self.buffer = buffer[pos:]
+
+    def _find_state_end(self, buffer: str, pos: int, final: bool) -> int:
+        '''
+        Return the position just after the end of the current quote or comment, or None if it is not in the buffer yet
+        '''
+        if self.state == 'line_comment':
+            end = buffer.find('\n', pos)
+            return None if end == -1 else end + 1
+        if self.state == 'block_comment':
+            end = buffer.find('*/', pos)
+            return None if end == -1 else end + 2
+        if self.state == 'dollar_quote':
+            end = buffer.find('$$', pos)
+            return None if end == -1 else end + 2
+        quote = "'" if self.state == 'single_quote' else '"'
+        index = pos
+        while True:
+            end = buffer.find(quote, index)
+            if end == -1:
+                return None
+            backslashes = len(buffer[index:end]) - len(buffer[index:end].rstrip('\\'))
+            if quote == "'" and backslashes % 2 == 1:
+                index = end + 1
+                continue
+            if end + 1 == len(buffer) and not final:
+                # Could be the first half of a doubled quote
+                return None
+            if end + 1 < len(buffer) and buffer[end + 1] == quote:
+                index = end + 2
+                continue
+            return end + 1
+
+    def _on_word(self, word: str) -> None:
+        closes_case = self.pending_word == 'END' and word == 'CASE'
+        self._resolve_pending(word)
+        previous_word = self.previous_word
+        self.previous_word = word
+        if word == 'DECLARE' and self.depth == 0 and (previous_word is None or previous_word == 'AS'):
+            # An anonymous block, or the body of a procedure: CREATE PROCEDURE ... AS DECLARE ... BEGIN ... END
+            self.depth += 1
+            self.declare_open = True
+            return
+        if word in ('BEGIN', 'END'):
+            self.pending_word = word
+        elif word == 'CASE' and not closes_case:
+            self.depth += 1
+
+    def _resolve_pending(self, next_token: str) -> None:
+        '''
+        BEGIN and END are only counted once the following token shows what they mean
+        '''
+        word = self.pending_word
+        if word is None:
+            return
+        self.pending_word = None
+        next_word = next_token.upper() if next_token else None
+        if word == 'BEGIN':
+            if next_word in TRANSACTION_WORDS or next_word == ';' or next_word is None:
+                return
+            if self.declare_open:
+                self.declare_open = False
+                return
+            self.depth += 1
+        elif word == 'END':
+            if next_word in CONSTRUCT_WORDS:
+                return
+            self.depth = max(self.depth - 1, 0)
+
+    def _finish(self, last: bool = False) -> Statement:
+        text = ''.join(self.parts)
+        has_code = self.has_code
+        start_line = self.start_line
+        self.parts = []
+        self.start_line = None
+        self.previous_word = None
+        self.declare_open = False
+        self.pending_word = None
+        self.has_code = False
+        self.depth = 0
+        if last:
+            text = text.rstrip()
+        if not has_code:
+            return None
+        return Statement(text, start_line, self.path)
+
+def split_statements(chunks: Iterable[str], path: Path = None) -> Iterator[Statement]:
+    '''
+    Lazily split an iterable of SQL text chunks into statements
+    '''
+    splitter = StatementSplitter(path)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+def split_text(text: str, path: Path = None) -> list[Statement]:
+    return list(split_statements([text], path))
+
+def split_file(path: Path, chunk_size: int = 64 * 1024) -> Iterator[Statement]:
+    '''
+    Lazily split a SQL file into statements, reading it chunk_size characters at a time
+    '''
+    with open(path, 'r') as f:
+        yield from split_statements(iter(lambda: f.read(chunk_size), ''), path)
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,209 @@
+import threading
+import logging
+import sys
+import re
+
+# How to fetch the existing objects of each object type, one query per type and schema
+METADATA_QUERIES = {
+    'views': "SELECT TABLE_NAME, VIEW_DEFINITION FROM {database}.INFORMATION_SCHEMA.VIEWS WHERE TABLE_SCHEMA = '{schema}'",
+    'udfs': "SELECT FUNCTION_NAME, ARGUMENT_SIGNATURE, DATA_TYPE, FUNCTION_LANGUAGE, FUNCTION_DEFINITION "
+            "FROM {database}.INFORMATION_SCHEMA.FUNCTIONS WHERE FUNCTION_SCHEMA = '{schema}'",
+    'stored_procs': "SELECT PROCEDURE_NAME, ARGUMENT_SIGNATURE, DATA_TYPE, PROCEDURE_LANGUAGE, PROCEDURE_DEFINITION "
+                    "FROM {database}.INFORMATION_SCHEMA.PROCEDURES WHERE PROCEDURE_SCHEMA = '{schema}'"
+}
+OBJECT_TYPES = list(METADATA_QUERIES)
+
+SQL_TOKEN_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\$\$.*?\$\$|\"[^\"]*\"|--[^\n]*|//[^\n]*|/\*.*?\*/|\s+|[^\s'\"$/-]+|.", re.S)
+PUNCTUATION = set('(),.=<>!+-*/|')
+NAME = r'(?:"[^"]+"|[\w$]+)(?:\s*\.\s*(?:"[^"]+"|[\w$]+))*'
+VIEW_PATTERN = re.compile(
+    r"^CREATE (?:OR REPLACE )?((?:SECURE |RECURSIVE )*)VIEW (?:IF NOT EXISTS )?(" + NAME + r")(.*)$", re.S)
+ROUTINE_PATTERN = re.compile(
+    r"^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:SECURE|TEMPORARY|TEMP)\s+)*(FUNCTION|PROCEDURE)\s+(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"(" + NAME + r")\s*\((.*?)\)\s*RETURNS\s+(.*?)\s+(?:LANGUAGE\s+(\w+)\b.*?)?\bAS\s+(\$\$.*\$\$|'(?:[^'\\]|\\.|'')*')\s*;?\s*$",
+    re.I | re.S)
+RETURN_OPTIONS_PATTERN = re.compile(r'\s+(?:NOT\s+NULL|NULL|CALLED|RETURNS\s+NULL|STRICT|IMMUTABLE|VOLATILE|LANGUAGE|COMMENT|'
+                                    r'EXECUTE|RUNTIME_VERSION|PACKAGES|IMPORTS|HANDLER|COPY\s+GRANTS)\b.*$', re.I | re.S)
+# Options the metadata views do not report, so statements using them are always run
+UNCOMPARED_OPTIONS_PATTERN = re.compile(r'\b(?:SECURE|COMMENT|EXECUTE\s+AS\s+CALLER|HANDLER|PACKAGES|IMPORTS|RUNTIME_VERSION|'
+                                        r'MEMOIZABLE|EXTERNAL_ACCESS_INTEGRATIONS|SECRETS|TARGET_PATH)\b', re.I)
+# Type names Snowflake reports under another name. Types whose meaning depends on account
+# parameters (TIMESTAMP) or that change the default length (CHAR) are left alone.
+TYPE_ALIASES = {'INT': 'NUMBER', 'INTEGER': 'NUMBER', 'BIGINT': 'NUMBER', 'SMALLINT': 'NUMBER', 'TINYINT': 'NUMBER',
+                'BYTEINT': 'NUMBER', 'DECIMAL': 'NUMBER', 'NUMERIC': 'NUMBER', 'STRING': 'VARCHAR', 'TEXT': 'VARCHAR',
+                'DOUBLE': 'FLOAT', 'DOUBLE PRECISION': 'FLOAT', 'REAL': 'FLOAT', 'FLOAT4': 'FLOAT', 'FLOAT8': 'FLOAT',
+                'VARBINARY': 'BINARY', 'DATETIME': 'TIMESTAMP_NTZ'}
+DEFAULT_TYPE_PARAMETERS = {'NUMBER': '(38,0)', 'VARCHAR': '(16777216)', 'BINARY': '(8388608)', 'TIMESTAMP_NTZ': '(9)'}
+
+def normalize_sql(text: str) -> str:
+    '''
+    SQL with comments removed, whitespace collapsed and everything but quoted text upper cased,
+    so two statements that only differ in formatting compare equal
+    '''
+    tokens = []
+    for token in SQL_TOKEN_PATTERN.findall(text):
+        if token.startswith(('--', '//', '/*')) or token.isspace():
+            if tokens and tokens[-1] != ' ':
+                tokens.append(' ')
+        elif token[0] in '\'"$':
+            tokens.append(token)
+        else:
+            tokens.append(token.upper())
+    # Spacing around punctuation and operators does not matter. Quoted tokens start and end
+    # with their quote, so the spacing inside them is kept.
+    tokens = [token for index, token in enumerate(tokens) if token != ' ' or not (
+        tokens[index - 1][-1:] in PUNCTUATION or (index + 1 < len(tokens) and tokens[index + 1][:1] in PUNCTUATION))]
+    return ''.join(tokens).strip().rstrip(';').strip()
+
+def normalize_name(name: str) -> str:
+    parts = re.findall(r'"[^"]+"|[\w$]+', name)
+    last = parts[-1]
+    return last.strip('"') if last.startswith('"') else last.upper()
+
+def normalize_type(data_type: str) -> str:
+    data_type = ' '.join(data_type.upper().replace('(', ' (').split()).replace(' (', '(').replace(', ', ',')
+    base, _, parameters = data_type.partition('(')
+    base = TYPE_ALIASES.get(base.strip(), base.strip())
+    parameters = '(' + parameters if parameters else DEFAULT_TYPE_PARAMETERS.get(base, '')
+    return base + parameters
+
+def split_arguments(arguments: str) -> list[str]:
+    '''
+    Split an argument list on the commas that are not inside parentheses
+    '''
+    parts, depth, current = [], 0, ''
+    for char in arguments:
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        current += char
+    if current.strip():
+        parts.append(current)
+    return [part.strip() for part in parts]
+
+def get_argument_types(arguments: str) -> tuple:
+    '''
+    The normalized types of "(a INT, b VARCHAR DEFAULT 'x')", ignoring argument names and defaults
+    '''
+    arguments = arguments.strip()
+    if arguments.startswith('(') and arguments.endswith(')'):
+        arguments = arguments[1:-1]
+    types = []
+    for argument in split_arguments(arguments):
+        argument = re.split(r'\s+DEFAULT\s+', argument, flags=re.I)[0]
+        _, _, data_type = argument.partition(' ')
+        types.append(normalize_type(data_type))
+    return tuple(types)
+
+def get_body(definition: str) -> str:
+    '''
+    The code of a function or procedure without its $$ or quote delimiters, with trailing whitespace removed
+    '''
+    definition = definition.strip()
+    if definition.startswith('$$') and definition.endswith('$$'):
+        definition = definition[2:-2]
+    elif definition.startswith("'") and definition.endswith("'"):
+        definition = definition[1:-1].replace("''", "'").replace("\\'", "'")
+    return '\n'.join(line.rstrip() for line in definition.strip().splitlines())
+
+def get_view_key(query: str) -> tuple:
+    '''
+    (name, comparable definition) of a CREATE VIEW statement, or None for anything else
+    '''
+    match = VIEW_PATTERN.match(normalize_sql(query))
+    if not match:
+        return None
+    secure, name, rest = match.groups()
+    return normalize_name(name), secure + 'VIEW ' + rest.strip()
+
+def get_routine_key(query: str) -> tuple:
+    '''
+    ((name, argument types), (return type, language, body)) of a CREATE FUNCTION or PROCEDURE statement,
+    or None when it cannot be parsed
+    '''
+    match = ROUTINE_PATTERN.match(strip_leading_comments(query))
+    if not match or UNCOMPARED_OPTIONS_PATTERN.search(match.string[:match.start(6)]):
+        return None
+    _, name, arguments, returns, language, body = match.groups()
+    returns = RETURN_OPTIONS_PATTERN.sub('', returns)
+    if returns.upper().startswith('TABLE'):
+        # Table functions report their columns in a form that is not worth reconstructing
+        return None
+    return ((normalize_name(name), get_argument_types(arguments)),
+            (normalize_type(returns), (language or 'SQL').upper(), get_body(body)))
+
+def strip_leading_comments(query: str) -> str:
+    return re.sub(r"^(?:\s+|--[^\n]*|//[^\n]*|/\*.*?\*/)*", '', query, flags=re.S)
+
+class SchemaState:
+    '''
+    Definitions of the views, functions and procedures that exist in a schema. Each object type is
+    fetched with one query the first time it is needed and cached for the rest of the deploy.
+    The user only needs a run_query method, and the metadata queries run untracked so they are never
+    checkpointed as statements of the deploy. For a check without an account, load rows from a local
+    fixture instead, in the column order of METADATA_QUERIES.
+    '''
+    def __init__(self, user, database: str, schema: str):
+        self.user = user
+        self.database = database
+        self.schema = schema
+        self.definitions = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"{self.database}.{self.schema}"
+
+    def get_definitions(self, object_type: str) -> dict:
+        with self._lock:
+            if object_type not in self.definitions:
+                query = METADATA_QUERIES[object_type].format(database=self.database, schema=normalize_name(self.schema))
+                logging.info(f"Fetching the existing {object_type} of {self}")
+                self.load(object_type, self.user.run_query(query, object_type, tracked=False) or [])
+            return self.definitions[object_type]
+
+    def load(self, object_type: str, rows: list) -> dict:
+        '''
+        Cache the existing objects of object_type from metadata rows
+        '''
+        definitions = {}
+        for row in rows:
+            if object_type == 'views':
+                key = get_view_key(row[1] or '')
+                if key is not None:
+                    definitions[row[0]] = key[1]
+            else:
+                name, arguments, returns, language, body = row[0], row[1], row[2], row[3], row[4]
+                definitions[(name, get_argument_types(arguments or ''))] = (normalize_type(returns or ''), (language or '').upper(), get_body(body or ''))
+        self.definitions[object_type] = definitions
+        return definitions
+
+    def is_unchanged(self, object_type: str, query: str) -> bool:
+        '''
+        Whether query would create an object exactly as it already exists
+        '''
+        key = get_view_key(query) if object_type == 'views' else get_routine_key(query)
+        if key is None:
+            return False
+        name, definition = key
+        return self.get_definitions(object_type).get(name) == definition
+
+    def get_changed(self, object_type: str, file_queries: dict) -> dict:
+        '''
+        {file: queries} without the statements that would not change anything
+        '''
+        changed = {}
+        skipped = 0
+        for path, queries in file_queries.items():
+            remaining = [query for query in queries if not self.is_unchanged(object_type, query)]
+            skipped += len(queries) - len(remaining)
+            if remaining:
+                changed[path] = remaining
+        if skipped:
+            logging.info(f"Skipping {skipped} {object_type} statements that match the objects in {self}")
+        return changed
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,175 @@
+from __future__ import annotations
+from .lazy import LazyModule
+from pathlib import Path
+import logging
+import time
+import sys
+import os
+scripts = LazyModule('snowflow.scripts')
+errors = LazyModule('snowflake.connector.errors')
+
+DEFAULT_INTERVAL = 1.0
+
+class FileWatcher:
+    '''
+    Polls the modification time and size of a set of files. get_paths is called on every scan,
+    so files added to a watched folder are picked up.
+    '''
+    def __init__(self, get_paths):
+        self.get_paths = get_paths
+        self.stamps = self.scan()
+
+    def scan(self) -> dict:
+        stamps = {}
+        for path in self.get_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isdir(path):
+                stamps[str(path)] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def reset(self) -> None:
+        self.stamps = self.scan()
+
+    def get_changes(self) -> list[str]:
+        '''
+        Files added, changed or removed since the last call, sorted
+        '''
+        stamps = self.scan()
+        changed = sorted(path for path in stamps.keys() | self.stamps.keys() if stamps.get(path) != self.stamps.get(path))
+        self.stamps = stamps
+        return changed
+
+class DeployWatch:
+    '''
+    Redeploys the files of a set of schemas as they are saved, over the session the deploy ran on.
+    A changed object file reruns only that file's statements, a changed staged file is uploaded again,
+    a changed DML script recreates only the procedures of the tasks that run it, and a changed DAG
+    yaml recreates that DAG. A change to query_variables.yaml redeploys the watched schemas, skipping
+    the files whose statements did not change.
+    '''
+    def __init__(self, deploy, user, schemas: list[tuple[str, str]], interval: float = DEFAULT_INTERVAL):
+        self.deploy = deploy
+        self.user = user
+        self.schemas = schemas
+        self.interval = interval
+        self.variables_file = Path(os.getcwd(), 'query_variables.yaml')
+        self.current_schema = None
+        self.watcher = FileWatcher(self.get_paths)
+
+    def get_schemas(self) -> list:
+        '''
+        The watched schemas, built again on every change so they see the files as they are now
+        '''
+        acct = scripts.SnowflakeAcct(self.deploy.environment)
+        return [scripts.SnowflakeSchema(schema_name, scripts.SnowflakeDB(db_name, acct)) for db_name, schema_name in self.schemas]
+
+    def get_paths(self) -> list[Path]:
+        paths = [self.variables_file]
+        folders = set()
+        for db_name, schema_name in self.schemas:
+            db_path = Path(os.getcwd(), 'snowflake', 'databases', db_name)
+            folders.add(Path(db_path, 'schemas', schema_name))
+            folders.add(Path(db_path, 'dml'))
+        for folder in sorted(folders):
+            paths.extend(folder.glob('**/*'))
+        return paths
+
+    def run(self) -> None:
+        logging.info(f"Watching {', '.join(f'{db}.{schema}' for db, schema in self.schemas)} for changes. Press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(self.interval)
+                changed = self.watcher.get_changes()
+                if changed:
+                    self.apply_changes(changed)
+        except KeyboardInterrupt:
+            logging.info('Stopped watching')
+
+    def apply_changes(self, changed: list[str]) -> None:
+        if str(self.variables_file) in changed:
+            logging.info('query_variables.yaml changed, redeploying the watched schemas')
+            self.deploy.plans.clear()
+            for db_name, schema_name in self.schemas:
+                self.run_change(f"{db_name}.{schema_name}", self.redeploy_schema, db_name, schema_name)
+            return
+        schemas = self.get_schemas()
+        for path in changed:
+            if not os.path.exists(path):
+                logging.info(f"{path} was removed. Objects are not dropped, drop them by hand if they should go.")
+                continue
+            if not self.run_change(path, self.apply_file, schemas, Path(path)):
+                logging.info(f"{path} does not change any object of the watched schemas")
+
+    def run_change(self, name: str, apply, *args) -> bool:
+        '''
+        Apply one change, logging a failure instead of raising so watching goes on after a bad save
+        '''
+        start = time.perf_counter()
+        try:
+            applied = apply(*args)
+            if applied is not False:
+                logging.info(f"Deployed {name} in {time.perf_counter() - start:.2f}s")
+            return applied is not False
+        except (errors.ProgrammingError, errors.DatabaseError) as db_error:
+            logging.error(f"Could not deploy {name}: {db_error}")
+        except Exception as e:
+            logging.error(f"Unexpected error while deploying {name}: {e}")
+        return True
+
+    def use_schema(self, schema) -> None:
+        key = (schema.database.name, schema.name)
+        if self.current_schema != key:
+            self.user.session.use_database(schema.database.name)
+            self.user.session.use_schema(schema.name)
+            self.current_schema = key
+
+    def redeploy_schema(self, db_name: str, schema_name: str) -> None:
+        self.current_schema = None
+        self.user.session.use_database(db_name)
+        self.deploy.schema(self.user, db_name, schema_name)
+
+    def apply_file(self, schemas: list, path: Path) -> bool:
+        '''
+        Deploy what one saved file defines, returns False if no watched schema uses the file
+        '''
+        applied = False
+        for schema in schemas:
+            object_type = schema.get_object_type(path)
+            if object_type is not None:
+                return self.apply_object_file(schema, object_type, path)
+            if schema.database.dml_path in path.parents:
+                for dag in schema.get_dag_objs():
+                    tasks = dag.get_tasks_running(path)
+                    if tasks:
+                        self.use_schema(schema)
+                        logging.info(f"Recreating the procedures of {', '.join(task.name for task in tasks)} in {schema} DAG {dag.name}")
+                        self.user.run_queries([task.get_sql_proc_code() for task in tasks], object_type='dags')
+                        applied = True
+        return applied
+
+    def apply_object_file(self, schema, object_type: str, path: Path) -> bool:
+        if object_type == 'staged_files':
+            queries = None
+        elif object_type == 'dags' and path.suffix == '.yaml':
+            queries = scripts.TaskDAG(schema.sp.parse_yaml_file(path), schema).get_all_queries()
+        elif object_type != 'dags' and path.suffix == '.sql':
+            queries = schema.sp.read_file_queries(path, scripts.is_single_transaction(object_type))
+        else:
+            return False
+        logging.info(f"{path.name} changed, deploying it as {object_type} of {schema}")
+        self.use_schema(schema)
+        if object_type == 'staged_files':
+            self.deploy.post_files(self.user, [schema.get_staged_file(path)])
+        elif object_type in ('init', 'grants', 'post_deploy'):
+            # Untracked in plans as well, these always run in full
+            self.user.run_queries(queries, object_type=object_type)
+        else:
+            self.deploy.run_files(self.user, {path: queries}, object_type=object_type, parallel=False)
+        return True
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
@@ -0,0 +1,15 @@
+import pytest
+from snowflow import runner
+from fake_snowflake import FakeSessionFactory
+
+@pytest.fixture
+def fake_sessions():
+    '''
+    Open every pooled session of the test on a FakeSessionFactory, connected to DEMO.PUBLIC on COMPUTE_WH
+    '''
+    factory = FakeSessionFactory(database='DEMO', schema='PUBLIC', warehouse='COMPUTE_WH')
+    runner.close_session_pools()
+    runner.set_session_factory(factory)
+    yield factory
+    runner.close_session_pools()
+    runner.set_session_factory(None)
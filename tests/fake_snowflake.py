@@ -0,0 +1,262 @@
+'''
+A local stand-in for a Snowpark session, for tests and benchmarks that should not need a Snowflake account.
+Every round trip sleeps for the configured latency and is counted. Nothing is executed, except that
+USE statements and the query tag change the session's context like they would in Snowflake.
+
+Install it for a process with snowflow.runner.set_session_factory(FakeSessionFactory(latency)).
+'''
+import itertools
+import json
+import threading
+import time
+import re
+
+USE_STATEMENT = re.compile(r'^\s*USE\s+(DATABASE|SCHEMA|ROLE|WAREHOUSE|SECONDARY\s+ROLES)\s+(.+?)\s*;?\s*$', re.I)
+SET_VARIABLE = re.compile(r'^\s*SET\s+(\w+)\s*=\s*(.*?)\s*;?\s*$', re.I | re.S)
+UNSET_VARIABLES = re.compile(r'^\s*UNSET\s+\(?(.*?)\)?\s*;?\s*$', re.I | re.S)
+CONTEXT_QUERY = re.compile(r'^\s*SELECT\s+CURRENT_DATABASE\(\)\s*,\s*CURRENT_SCHEMA\(\)\s*,\s*CURRENT_ROLE\(\)\s*,'
+                           r'\s*CURRENT_WAREHOUSE\(\)\s*,\s*CURRENT_SECONDARY_ROLES\(\)\s*$', re.I)
+
+def get_name(identifier: str) -> str:
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier.upper()
+
+class FakeJob:
+    '''
+    An async query that finishes duration seconds after it was submitted, or never when duration is None.
+    A query that failed raises its error from result(), like a Snowpark AsyncJob does.
+    '''
+    def __init__(self, result: list, query_id: str, duration: float = 0.0, error: Exception = None):
+        self.query_id = query_id
+        self._result = result
+        self.duration = duration
+        self.error = error
+        self.submitted = time.monotonic()
+        self.cancelled = False
+
+    def is_done(self) -> bool:
+        return self.duration is not None and time.monotonic() - self.submitted >= self.duration
+
+    def result(self) -> list:
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+class FakeDataFrame:
+    def __init__(self, session: 'FakeSession', query: str):
+        self.session = session
+        self.query = query
+
+    def collect(self) -> list:
+        self.session.round_trip(1)
+        return self.session.get_rows(self.query)
+
+    def collect_nowait(self) -> FakeJob:
+        self.session.round_trip(1)
+        result, error = None, None
+        try:
+            result = self.session.get_rows(self.query)
+        except Exception as e:
+            error = e
+        job = FakeJob(result, self.session.next_query_id(), self.session.get_job_duration(self.query), error)
+        with self.session.lock:
+            self.session.jobs.append(job)
+        return job
+
+    def to_local_iterator(self):
+        self.session.round_trip(1)
+        return self.session.iter_rows(self.query)
+
+class FakeCursor:
+    '''
+    The part of a connector cursor multi-statement batches use. The statements of a batch run one
+    after another, and the first that fails raises with the ones before it already run, like in Snowflake.
+    Rows of batched statements are dicts, as a DictCursor returns them.
+    '''
+    def __init__(self, session: 'FakeSession'):
+        self.session = session
+        self.sfqid = None
+        self._results = []
+
+    def execute(self, text: str, num_statements: int = 1) -> 'FakeCursor':
+        self.session.round_trip(num_statements)
+        self.sfqid = self.session.next_query_id()
+        statements = text.split('\n;\n') if num_statements > 1 else [text]
+        self._results = [self.session.get_rows(statement) for statement in statements]
+        return self
+
+    def fetchall(self) -> list:
+        return self._results.pop(0) if self._results else []
+
+    def nextset(self):
+        return True if self._results else None
+
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    def __init__(self, session: 'FakeSession'):
+        self.session = session
+
+    def cursor(self, cursor_class=None) -> FakeCursor:
+        return FakeCursor(self.session)
+
+class FakeFileOperation:
+    def __init__(self, session: 'FakeSession'):
+        self.session = session
+
+    def put(self, local_path: str, stage_path: str, **kwargs) -> list:
+        time.sleep(self.session.put_latency)
+        with self.session.lock:
+            self.session.puts += 1
+        return [local_path]
+
+class FakeSession:
+    '''
+    Counts round trips, statements and uploads. latency and put_latency are in seconds.
+    rows, if given, returns the rows of a query, e.g. to stand in for metadata queries.
+    job_duration is how long an async query runs, in seconds or as a function of the query,
+    where None never finishes.
+    database, schema, role and warehouse are the context the session opens in, like those of a connection
+    in connections.toml.
+    '''
+    query_ids = itertools.count(1)
+
+    def __init__(self, latency: float = 0.0, put_latency: float = 0.0, rows=None, database: str = None, schema: str = None,
+                 job_duration=0.0, role: str = 'SYSADMIN', warehouse: str = None):
+        self.latency = latency
+        self.put_latency = put_latency
+        self.rows = rows
+        self.job_duration = job_duration
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.statements = 0
+        self.puts = 0
+        self.database = database
+        self.schema = schema
+        self.role = role
+        self.warehouse = warehouse
+        self.secondary_roles = 'NONE'
+        self._query_tag = None
+        self.variables = {}
+        self.closed = False
+        self.file = FakeFileOperation(self)
+        self.connection = FakeConnection(self)
+
+    @property
+    def query_tag(self) -> str:
+        return self._query_tag
+
+    @query_tag.setter
+    def query_tag(self, tag: str) -> None:
+        self.round_trip(1)
+        self._query_tag = tag
+
+    def round_trip(self, statements: int) -> None:
+        time.sleep(self.latency)
+        with self.lock:
+            self.round_trips += 1
+            self.statements += statements
+
+    def get_job_duration(self, query: str) -> float:
+        return self.job_duration(query) if callable(self.job_duration) else self.job_duration
+
+    def next_query_id(self) -> str:
+        return f"fake-{next(self.query_ids)}"
+
+    def get_rows(self, query: str) -> list:
+        return list(self.iter_rows(query))
+
+    def iter_rows(self, query: str):
+        use = USE_STATEMENT.match(query)
+        if use:
+            kind = ' '.join(use.group(1).upper().split())
+            if kind == 'DATABASE':
+                self.use_database(use.group(2), round_trip=False)
+            elif kind == 'SCHEMA':
+                self.use_schema(use.group(2), round_trip=False)
+            elif kind == 'ROLE':
+                self.role = get_name(use.group(2))
+            elif kind == 'WAREHOUSE':
+                self.warehouse = get_name(use.group(2))
+            else:
+                self.secondary_roles = use.group(2).upper()
+            return iter([])
+        if CONTEXT_QUERY.match(query):
+            return iter([(self.database, self.schema, self.role, self.warehouse, self.get_secondary_roles())])
+        set_variable = SET_VARIABLE.match(query)
+        if set_variable:
+            self.variables[set_variable.group(1).upper()] = set_variable.group(2)
+            return iter([])
+        if query.strip().upper() == 'SHOW VARIABLES':
+            return iter([{'name': name, 'value': value} for name, value in self.variables.items()])
+        unset = UNSET_VARIABLES.match(query)
+        if unset:
+            for name in unset.group(1).split(','):
+                self.variables.pop(get_name(name.strip()), None)
+            return iter([])
+        return iter(self.rows(query)) if self.rows is not None else iter([])
+
+    def get_secondary_roles(self) -> str:
+        if self.secondary_roles == 'ALL':
+            return json.dumps({'roles': '', 'value': 'ALL'})
+        roles = '' if self.secondary_roles == 'NONE' else ','.join(get_name(role.strip()) for role in self.secondary_roles.split(','))
+        return json.dumps({'roles': roles, 'value': ''})
+
+    def sql(self, query: str) -> FakeDataFrame:
+        return FakeDataFrame(self, query)
+
+    def use_database(self, name: str, round_trip: bool = True) -> None:
+        if round_trip:
+            self.round_trip(1)
+        self.database = get_name(name)
+        self.schema = 'PUBLIC'
+
+    def use_schema(self, name: str, round_trip: bool = True) -> None:
+        if round_trip:
+            self.round_trip(1)
+        if '.' in name and not name.startswith('"'):
+            database, name = name.split('.', 1)
+            self.database = get_name(database)
+        self.schema = get_name(name)
+
+    def close(self) -> None:
+        self.closed = True
+
+class FakeSessionFactory:
+    '''
+    Opens FakeSessions, optionally taking login_latency seconds like a real login does
+    '''
+    def __init__(self, latency: float = 0.0, put_latency: float = 0.0, login_latency: float = 0.0, rows=None,
+                 database: str = None, schema: str = None, role: str = 'SYSADMIN', warehouse: str = None):
+        self.latency = latency
+        self.put_latency = put_latency
+        self.login_latency = login_latency
+        self.rows = rows
+        self.database = database
+        self.schema = schema
+        self.role = role
+        self.warehouse = warehouse
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def create(self, environment: str) -> FakeSession:
+        time.sleep(self.login_latency)
+        session = FakeSession(self.latency, self.put_latency, self.rows, self.database, self.schema,
+                              role=self.role, warehouse=self.warehouse)
+        with self.lock:
+            self.sessions.append(session)
+        return session
+
+    def get_totals(self) -> dict:
+        with self.lock:
+            sessions = list(self.sessions)
+        return {'sessions': len(sessions),
+                'round_trips': sum(session.round_trips for session in sessions),
+                'statements': sum(session.statements for session in sessions),
+                'puts': sum(session.puts for session in sessions)}
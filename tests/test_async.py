@@ -0,0 +1,80 @@
+import time
+import pytest
+from snowflake.connector.errors import ProgrammingError
+from snowflow import runner
+from fake_snowflake import FakeDataFrame, FakeJob, FakeSession
+
+def make_user(rows=None, job_duration=0.0):
+    session = FakeSession(rows=rows, job_duration=job_duration)
+    return runner.SnowflakeUser('test', session=session), session
+
+def test_results_are_in_submission_order():
+    durations = {'select 1': 0.06, 'select 2': 0.03, 'select 3': 0.0}
+    user, session = make_user(rows=lambda query: [query], job_duration=lambda query: durations[query])
+    done = []
+    user.on_query_done = done.append
+    results = user.run_queries_async(list(durations), object_type='views', poll_interval=0.01)
+    assert results == [['select 1'], ['select 2'], ['select 3']]
+    assert sorted(done) == sorted(durations)
+
+def test_empty_queries_are_not_submitted():
+    user, session = make_user()
+    results = user.run_queries_async(['select 1', '  '], poll_interval=0.01)
+    assert len(results) == 2 and len(session.jobs) == 1
+
+def test_first_error_is_raised_after_the_others_finish():
+    def rows(query):
+        if 'broken' in query:
+            raise ProgrammingError(f"failed: {query}")
+        return []
+
+    user, session = make_user(rows=rows, job_duration=lambda query: 0.05 if query == 'select slow' else 0.0)
+    done = []
+    user.on_query_done = done.append
+    with pytest.raises(ProgrammingError, match='broken one'):
+        user.run_queries_async(['select broken one', 'select slow', 'select broken two'], poll_interval=0.01)
+    assert all(job.is_done() for job in session.jobs)
+    assert not any(job.cancelled for job in session.jobs)
+    # Only the query that completed counts as done
+    assert done == ['select slow']
+
+def test_timed_out_queries_are_cancelled():
+    user, session = make_user(job_duration=lambda query: None if query == 'select forever' else 0.0)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        user.run_queries_async(['select 1', 'select forever'], timeout=0.05, poll_interval=0.01)
+    assert time.monotonic() - start < 1
+    assert [job.cancelled for job in session.jobs] == [False, True]
+
+def test_failed_submission_cancels_the_submitted_queries(monkeypatch):
+    collect_nowait = FakeDataFrame.collect_nowait
+
+    def failing_collect_nowait(data_frame):
+        if 'broken' in data_frame.query:
+            raise ProgrammingError('syntax error')
+        return collect_nowait(data_frame)
+    monkeypatch.setattr(FakeDataFrame, 'collect_nowait', failing_collect_nowait)
+
+    user, session = make_user(job_duration=None)
+    with pytest.raises(ProgrammingError):
+        user.run_queries_async(['select 1', 'select 2', 'select broken', 'select 4'], poll_interval=0.01)
+    assert len(session.jobs) == 2
+    assert all(job.cancelled for job in session.jobs)
+
+def test_poll_records_the_result_or_error():
+    finished = runner.AsyncQuery(0, 'select 1', FakeJob([1], 'q1'))
+    assert finished.poll() and finished.result == [1] and finished.error is None
+    failed = runner.AsyncQuery(1, 'select 2', FakeJob(None, 'q2', error=ProgrammingError('failed')))
+    assert failed.poll() and isinstance(failed.error, ProgrammingError)
+    running = runner.AsyncQuery(2, 'select 3', FakeJob(None, 'q3', duration=None), timeout=10)
+    assert not running.poll() and not running.job.cancelled
+
+def test_cancel_only_cancels_running_queries():
+    job = FakeJob([1], 'q1')
+    finished = runner.AsyncQuery(0, 'select 1', job)
+    finished.poll()
+    finished.cancel()
+    assert not job.cancelled
+    running = runner.AsyncQuery(1, 'select 2', FakeJob(None, 'q2', duration=None))
+    running.cancel()
+    assert running.job.cancelled and running.poll()
@@ -0,0 +1,67 @@
+import logging
+import pytest
+from snowflake.connector.errors import ProgrammingError
+from snowflow import executor, runner
+from fake_snowflake import FakeSession
+
+def make_user(fail_on: str = None):
+    executed = []
+
+    def rows(query):
+        executed.append(query.strip())
+        if fail_on is not None and fail_on in query:
+            raise ProgrammingError(f"failed: {query}")
+        return [{'STATUS': query.strip()}]
+
+    session = FakeSession(rows=rows)
+    return runner.SnowflakeUser('test', session=session), session, executed
+
+FILES = {'a.sql': ['grant usage on database demo to role analyst', 'grant usage on schema demo.public to role analyst'],
+         'b.sql': ['grant select on table orders to role analyst', 'grant select on table customers to role analyst'],
+         'c.sql': ['create or replace role loader']}
+
+def test_batches_break_around_statements_that_cannot_run_twice():
+    statements = [('a.sql', 1, 'grant role a to role b'),
+                  ('a.sql', 2, 'grant role c to role b'),
+                  ('a.sql', 3, 'insert into audit values (1)'),
+                  ('b.sql', 1, 'create or replace role d'),
+                  ('b.sql', 2, 'create role if not exists e'),
+                  ('b.sql', 3, 'alter role d set comment = \'x\''),
+                  ('b.sql', 4, 'drop role if exists f'),
+                  ('c.sql', 1, '')]
+    assert executor.BatchExecutor(None, batch_size=3).get_batches(statements) == [[0, 1], [2], [3, 4, 5], [6], [7]]
+    assert executor.BatchExecutor(None, batch_size=1).get_batches(statements[:2]) == [[0], [1]]
+
+def test_results_map_back_to_their_statements():
+    user, session, executed = make_user()
+    results = executor.BatchExecutor(user, batch_size=2).run(FILES, object_type='grants')
+    statements = [query for queries in FILES.values() for query in queries]
+    assert [result[0]['STATUS'] for result in results] == statements
+    assert executed == statements
+    assert session.round_trips == 3
+
+@pytest.mark.parametrize('position', [0, 2, 4])
+def test_failed_statement_is_reported_with_its_file(position, caplog):
+    statements = [(path, number, query) for path, queries in FILES.items() for number, query in enumerate(queries, start=1)]
+    path, number, failing = statements[position]
+    user, session, executed = make_user(fail_on=failing)
+    with caplog.at_level(logging.ERROR):
+        with pytest.raises(ProgrammingError):
+            executor.BatchExecutor(user, batch_size=50).run(FILES, object_type='grants')
+    assert f"Statement {number} of {path} failed" in caplog.text
+    # The batch ran up to the failure, then every statement up to the failure ran again on its own
+    queries = [query for _, _, query in statements]
+    assert executed == queries[:position + 1] + queries[:position + 1]
+
+def test_statements_that_cannot_run_twice_are_not_rerun():
+    files = {'a.sql': ['grant role a to role b', 'insert into audit values (1)', 'grant role broken to role b']}
+    user, session, executed = make_user(fail_on='broken')
+    with pytest.raises(ProgrammingError):
+        executor.BatchExecutor(user, batch_size=50).run(files, object_type='grants')
+    assert executed.count('insert into audit values (1)') == 1
+
+def test_sessions_without_a_connection_run_one_statement_at_a_time():
+    user, session, executed = make_user()
+    del session.connection
+    results = executor.BatchExecutor(user, batch_size=50).run(FILES, object_type='grants')
+    assert len(results) == 5 and session.round_trips == 5
@@ -0,0 +1,109 @@
+import json
+from pathlib import Path
+from snowflow import manifest
+
+class Plan:
+    def __init__(self, name: str, plan_hash: str = '1'):
+        self.name = name
+        self.plan_hash = plan_hash
+
+    def __str__(self):
+        return self.name
+
+    def get_hash(self):
+        return self.plan_hash
+
+def read_journal(path: Path) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def run_until_failure(path: Path) -> dict:
+    '''
+    Complete the first step and two statements of the second step of plan 'demo'
+    '''
+    checkpoint = manifest.DeployCheckpoint(path)
+    progress = checkpoint.start(Plan('demo'))
+    progress.complete_step(0)
+    progress.mark_statement('create view a as select 1')
+    progress.mark_statement('create view b as select 1')
+    return {Path('a.sql'): ['create view a as select 1', 'create view b as select 1'],
+            Path('c.sql'): ['create view c as select 1']}
+
+def test_resume_skips_completed_steps_and_statements(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    file_queries = run_until_failure(path)
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    assert progress.is_step_done(0)
+    assert not progress.is_step_done(1)
+    assert progress.get_remaining(file_queries) == {Path('c.sql'): ['create view c as select 1']}
+
+def test_resume_runs_session_statements_again(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    progress = manifest.DeployCheckpoint(path).start(Plan('demo'))
+    progress.mark_statement('USE SCHEMA demo.public')
+    progress.mark_statement('create view a as select 1')
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    remaining = progress.get_remaining({Path('a.sql'): ['USE SCHEMA demo.public', 'create view a as select 1']})
+    assert remaining == {Path('a.sql'): ['USE SCHEMA demo.public']}
+
+def test_repeated_statements_are_counted(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    progress = manifest.DeployCheckpoint(path).start(Plan('demo'))
+    progress.mark_statement('insert into t values (1)')
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    remaining = progress.get_remaining({Path('a.sql'): ['insert into t values (1)', 'insert into t values (1)']})
+    assert remaining == {Path('a.sql'): ['insert into t values (1)']}
+
+def test_changed_plan_starts_over(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    file_queries = run_until_failure(path)
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo', plan_hash='2'))
+    assert not progress.is_step_done(0)
+    assert progress.get_remaining(file_queries) == file_queries
+
+def test_without_resume_starts_over(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    file_queries = run_until_failure(path)
+    progress = manifest.DeployCheckpoint(path).start(Plan('demo'))
+    assert not progress.is_step_done(0)
+    assert progress.get_remaining(file_queries) == file_queries
+
+def test_completing_a_step_clears_its_statements(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    file_queries = run_until_failure(path)
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    progress.complete_step(1)
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    assert progress.is_step_done(1)
+    assert progress.get_remaining(file_queries) == file_queries
+
+def test_finished_plans_are_dropped(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    run_until_failure(path)
+    checkpoint = manifest.DeployCheckpoint(path, resume=True)
+    checkpoint.start(Plan('demo'))
+    checkpoint.finish(Plan('demo'))
+    assert manifest.DeployCheckpoint(path).entries == {}
+
+def test_compaction_keeps_unfinished_plans(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    run_until_failure(path)
+    checkpoint = manifest.DeployCheckpoint(path, resume=True)
+    checkpoint.start(Plan('other'))
+    checkpoint.finish(Plan('other'))
+    assert len(read_journal(path)) == 5
+    compacted = manifest.DeployCheckpoint(path, resume=True)
+    journal = read_journal(path)
+    assert {record['plan'] for record in journal} == {'demo'}
+    assert len(journal) == 3
+    assert compacted.entries['demo']['steps'] == 1
+    assert sum(compacted.entries['demo']['statements'].values()) == 2
+
+def test_incomplete_lines_are_ignored(tmp_path):
+    path = Path(tmp_path, 'checkpoint.jsonl')
+    file_queries = run_until_failure(path)
+    with open(path, 'a') as f:
+        f.write('{"plan": "demo", "statem')
+    progress = manifest.DeployCheckpoint(path, resume=True).start(Plan('demo'))
+    assert progress.get_remaining(file_queries) == {Path('c.sql'): ['create view c as select 1']}
+    assert all(read_journal(path))
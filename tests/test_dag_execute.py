@@ -0,0 +1,56 @@
+import threading
+import time
+from types import SimpleNamespace
+import networkx as nx
+from snowflow import commands, executor, runner
+from fake_snowflake import FakeSession
+
+def make_dag(task_queries: dict, edges: list):
+    digraph = nx.DiGraph()
+    digraph.add_nodes_from(task_queries)
+    digraph.add_edges_from(edges)
+    schema = SimpleNamespace(name='RAW', database=SimpleNamespace(name='ANALYTICS'))
+    return SimpleNamespace(name='nightly', schema=schema, digraph=digraph, get_task_queries=lambda: task_queries)
+
+def test_concurrent_tasks_run_on_their_own_sessions(fake_sessions, monkeypatch):
+    task_queries = {'root': ['select root'],
+                    'branch_a': ['use schema scratch', "set region = 'EU'", 'select branch_a'],
+                    'branch_b': ['select branch_b'],
+                    'end': ['select end']}
+    dag = make_dag(task_queries, [('root', 'branch_a'), ('root', 'branch_b'), ('branch_a', 'end'), ('branch_b', 'end')])
+    lock = threading.Lock()
+    seen = {}
+    fake_sql = FakeSession.sql
+
+    def sql(session, query):
+        if query.startswith('select '):
+            # Both branches are running before either of them checks its context
+            time.sleep(0.02)
+            with lock:
+                seen[query[len('select '):]] = (id(session), session.database, session.schema, dict(session.variables))
+        return fake_sql(session, query)
+    monkeypatch.setattr(FakeSession, 'sql', sql)
+
+    with runner.SnowflakeUser('test') as user:
+        timings = commands.TestDAG('test').execute(user, dag, max_workers=2)
+    assert {name: status for name, (_, _, status) in timings.items()} == dict.fromkeys(task_queries, 'succeeded')
+    assert seen['branch_a'][1:] == ('ANALYTICS', 'SCRATCH', {'REGION': "'EU'"})
+    assert seen['branch_b'][1:] == ('ANALYTICS', 'RAW', {})
+    assert seen['branch_a'][0] != seen['branch_b'][0]
+    # The user's own session was left alone
+    assert id(user.session) not in {session_id for session_id, *_ in seen.values()}
+
+def test_one_worker_runs_on_the_users_session():
+    session = FakeSession()
+    user = runner.SnowflakeUser('test', session=session)
+    dag = make_dag({'root': ['select 1'], 'next': ['select 2']}, [('root', 'next')])
+    timings = commands.TestDAG('test').execute(user, dag, max_workers=1)
+    assert set(timings) == {'root', 'next'}
+    assert session.statements == 2
+
+def test_critical_path_is_the_slowest_chain():
+    digraph = nx.DiGraph([('root', 'a'), ('root', 'b'), ('a', 'end'), ('b', 'end')])
+    path, seconds = executor.get_critical_path(digraph, {'root': 1.0, 'a': 5.0, 'b': 2.0, 'end': 1.0})
+    assert path == ['root', 'a', 'end']
+    assert seconds == 7.0
+    assert executor.get_critical_path(nx.DiGraph(), {}) == ([], 0.0)
@@ -0,0 +1,47 @@
+import threading
+import time
+import networkx as nx
+from snowflow import executor, runner
+from fake_snowflake import FakeSession
+
+QUERIES = ['create view a as select 1',
+           'create view b as select 1',
+           'create schema staging',
+           'create view c as select 1',
+           'use schema demo.public',
+           'create view d as select * from a',
+           'create view e as select 1',
+           "alter session set query_tag = 'deploy'",
+           'create view f as select 1']
+
+def test_session_statements_run_on_their_own():
+    digraph = executor.StatementGraph(QUERIES).digraph
+    for index, query in enumerate(QUERIES):
+        if executor.changes_session(query):
+            others = set(range(len(QUERIES))) - {index}
+            assert others == nx.ancestors(digraph, index) | nx.descendants(digraph, index), query
+
+def test_creates_run_concurrently():
+    digraph = executor.StatementGraph(QUERIES).digraph
+    assert not nx.has_path(digraph, 0, 1)
+    assert nx.has_path(digraph, 0, 5)
+    assert not nx.has_path(digraph, 5, 6) and nx.has_path(digraph, 4, 6)
+
+def test_no_statement_overlaps_a_session_statement():
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+
+    def rows(query):
+        with lock:
+            if running and (executor.changes_session(query) or any(executor.changes_session(other) for other in running)):
+                overlaps.append((query, set(running)))
+            running.add(query)
+        time.sleep(0.01)
+        with lock:
+            running.discard(query)
+        return []
+
+    user = runner.SnowflakeUser('test', session=FakeSession(rows=rows))
+    executor.ParallelExecutor(user, max_workers=4).run(QUERIES, object_type='views')
+    assert overlaps == []
@@ -0,0 +1,60 @@
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from snowflow import loader, runner
+from fake_snowflake import FakeFileOperation
+
+def make_loader(tmp_path, user, workers=4):
+    schema = SimpleNamespace(name='PUBLIC', database=SimpleNamespace(name='DEMO'))
+    journal = loader.LoadJournal(Path(tmp_path, 'journal.json'))
+    return loader.BulkLoader(user, schema, journal, chunk_size=1, workers=workers)
+
+def make_source(tmp_path, lines=20):
+    path = Path(tmp_path, 'orders.csv')
+    path.write_text('id,amount\n' + ''.join(f'{index},{index * 7919 % 1000}\n' for index in range(lines)))
+    return loader.SourceFile(path, 'raw', 'orders', 'csv', False)
+
+def record_puts(monkeypatch):
+    '''
+    Record the stage path of every upload and each time two uploads run on one session at once
+    '''
+    lock = threading.Lock()
+    uploading = set()
+    overlaps = []
+    stage_paths = []
+    put = FakeFileOperation.put
+
+    def recording_put(self, local_path, stage_path, **kwargs):
+        with lock:
+            if self.session in uploading:
+                overlaps.append(local_path)
+            uploading.add(self.session)
+            stage_paths.append(stage_path)
+        try:
+            return put(self, local_path, stage_path, **kwargs)
+        finally:
+            with lock:
+                uploading.discard(self.session)
+
+    monkeypatch.setattr(FakeFileOperation, 'put', recording_put)
+    return overlaps, stage_paths
+
+def test_uploads_borrow_their_own_sessions(tmp_path, monkeypatch, fake_sessions):
+    fake_sessions.put_latency = 0.01
+    overlaps, stage_paths = record_puts(monkeypatch)
+    with runner.SnowflakeUser('test') as user:
+        chunks = make_loader(tmp_path, user).upload(make_source(tmp_path), 'orders_1', set())
+    assert len(chunks) > 4
+    assert overlaps == []
+    assert set(stage_paths) == {'@DEMO.PUBLIC.raw/snowflow_load/orders'}
+    assert fake_sessions.get_totals()['puts'] == len(chunks)
+    assert 1 < len(fake_sessions.sessions) <= 5
+    # The user's own session is left for COPY
+    assert user.session.puts == 0
+
+def test_uploads_without_a_pool_run_one_at_a_time(tmp_path, monkeypatch, fake_sessions):
+    overlaps, _ = record_puts(monkeypatch)
+    user = runner.SnowflakeUser('test', session=fake_sessions.create('test'))
+    chunks = make_loader(tmp_path, user).upload(make_source(tmp_path), 'orders_1', set())
+    assert overlaps == []
+    assert user.session.puts == len(chunks)
@@ -0,0 +1,96 @@
+from pathlib import Path
+import pytest
+from snowflake.connector.errors import ProgrammingError
+from snowflow import commands, manifest, runner
+from fake_snowflake import FakeSession
+
+def make_manifest(path: Path, full: bool = False) -> manifest.DeployManifest:
+    return manifest.DeployManifest(manifest.LocalManifestStore(path), full)
+
+def make_deploy(tmp_path: Path, monkeypatch, full: bool = False) -> commands.Deploy:
+    monkeypatch.chdir(tmp_path)
+    deploy = commands.Deploy('test')
+    deploy.set_options({})
+    deploy.manifest = make_manifest(Path(tmp_path, 'manifest.json'), full)
+    return deploy
+
+def failing_on(text: str):
+    def rows(query):
+        if text in query:
+            raise ProgrammingError(f"failed: {query}")
+        return []
+    return rows
+
+def test_local_store_keeps_updates(tmp_path):
+    store = manifest.LocalManifestStore(Path(tmp_path, 'state', 'manifest.json'))
+    assert store.load() == {}
+    store.save({'a.sql': '1'})
+    store.save({'b.sql': '2'})
+    assert store.load() == {'a.sql': '1', 'b.sql': '2'}
+
+def test_unchanged_files_are_skipped(tmp_path):
+    path = Path(tmp_path, 'manifest.json')
+    files = {Path(tmp_path, 'a.sql'): ['create view a as select 1'], Path(tmp_path, 'b.sql'): ['create view b as select 2']}
+    make_manifest(path).mark_deployed(files)
+    changed = dict(files)
+    changed[Path(tmp_path, 'b.sql')] = ['create view b as select 3']
+    assert list(make_manifest(path).get_changed(changed)) == [Path(tmp_path, 'b.sql')]
+
+def test_full_deploys_every_file(tmp_path):
+    path = Path(tmp_path, 'manifest.json')
+    files = {Path(tmp_path, 'a.sql'): ['create view a as select 1']}
+    make_manifest(path).mark_deployed(files)
+    assert make_manifest(path, full=True).get_changed(files) == files
+
+def test_staged_files_are_skipped_until_they_change(tmp_path):
+    path = Path(tmp_path, 'manifest.json')
+    data = Path(tmp_path, 'data.csv')
+    data.write_text('id\n1\n')
+    configs = [{'local_path': str(data), 'stage_path': '@stage/'}]
+    make_manifest(path).mark_staged_files(configs)
+    assert make_manifest(path).get_changed_staged_files(configs) == []
+    data.write_text('id\n2\n')
+    assert make_manifest(path).get_changed_staged_files(configs) == configs
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_failed_files_are_not_recorded(tmp_path, monkeypatch, parallel):
+    deploy = make_deploy(tmp_path, monkeypatch)
+    deploy.max_workers = 2 if parallel else 1
+    files = {Path(tmp_path, 'a.sql'): ['create view a as select 1'],
+             Path(tmp_path, 'b.sql'): ['create view b as select 1', 'create view broken as select x'],
+             Path(tmp_path, 'c.sql'): ['create view c as select 1']}
+    user = runner.SnowflakeUser('test', session=FakeSession(rows=failing_on('broken')))
+    with pytest.raises(ProgrammingError):
+        deploy.run_files(user, files, object_type='views', parallel=parallel)
+    recorded = make_manifest(Path(tmp_path, 'manifest.json')).hashes
+    assert 'a.sql' in recorded
+    assert 'b.sql' not in recorded
+    # The next deploy runs the failed file again
+    assert Path(tmp_path, 'b.sql') in make_manifest(Path(tmp_path, 'manifest.json')).get_changed(files)
+
+def test_non_database_errors_are_raised(tmp_path, monkeypatch):
+    deploy = make_deploy(tmp_path, monkeypatch)
+    def rows(query):
+        raise RuntimeError('connection reset')
+    user = runner.SnowflakeUser('test', session=FakeSession(rows=rows))
+    with pytest.raises(RuntimeError):
+        deploy.run_files(user, {Path(tmp_path, 'a.sql'): ['create view a as select 1']}, object_type='views', parallel=False)
+    assert make_manifest(Path(tmp_path, 'manifest.json')).hashes == {}
+
+def test_completed_files_are_recorded(tmp_path, monkeypatch):
+    deploy = make_deploy(tmp_path, monkeypatch)
+    files = {Path(tmp_path, 'a.sql'): ['create view a as select 1', ''], Path(tmp_path, 'b.sql'): ['create view b as select 1']}
+    user = runner.SnowflakeUser('test', session=FakeSession())
+    deploy.run_files(user, files, object_type='views', parallel=False)
+    assert set(make_manifest(Path(tmp_path, 'manifest.json')).hashes) == {'a.sql', 'b.sql'}
+    assert deploy.run_files(user, files, object_type='views', parallel=False) == []
+
+def test_state_table_queries_are_not_tracked(tmp_path, monkeypatch):
+    deploy = make_deploy(tmp_path, monkeypatch)
+    user = runner.SnowflakeUser('test', session=FakeSession(rows=lambda query: []))
+    deploy.manifest = manifest.DeployManifest(manifest.SnowflakeManifestStore(user, 'demo.public.snowflow_state'))
+    done = []
+    user.on_query_done = done.append
+    files = {Path(tmp_path, 'a.sql'): ['create view a as select 1']}
+    deploy.run_files(user, files, object_type='views', parallel=False)
+    assert done == ['create view a as select 1']
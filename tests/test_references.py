@@ -0,0 +1,36 @@
+from pathlib import Path
+import pytest
+from snowflow.references import DependencyGraph
+
+def test_order_honors_references():
+    views = {Path('c.sql'): ['create or replace view c as select * from b'],
+             Path('a.sql'): ['create or replace view a as select 1 as id'],
+             Path('b.sql'): ['create or replace view b as select * from a join d using (id)'],
+             Path('d.sql'): ['create or replace view d as select 1 as id']}
+    graph = DependencyGraph([('views', views)])
+    graph.check()
+    assert list(graph.order('views', views)) == [Path('a.sql'), Path('d.sql'), Path('b.sql'), Path('c.sql')]
+
+def test_independent_files_keep_their_order():
+    views = {Path('b.sql'): ['create view b as select 1'], Path('a.sql'): ['create view a as select 1']}
+    assert list(DependencyGraph([('views', views)]).order('views', views)) == [Path('b.sql'), Path('a.sql')]
+
+def test_qualified_and_quoted_names_match():
+    views = {Path('orders.sql'): ['create view demo.public.orders_by_day as select * from "ORDERS"'],
+             Path('base.sql'): ['create view ORDERS as select 1 as id']}
+    assert list(DependencyGraph([('views', views)]).order('views', views)) == [Path('base.sql'), Path('orders.sql')]
+
+def test_cycle_raises():
+    views = {Path('a.sql'): ['create view a as select * from b'],
+             Path('b.sql'): ['create view b as select * from a']}
+    graph = DependencyGraph([('views', views)])
+    with pytest.raises(ValueError, match='Circular references'):
+        graph.check()
+
+def test_references_across_object_types_are_only_ordered_by_phase():
+    tables = {Path('orders.sql'): ['create table orders (id int)']}
+    views = {Path('v.sql'): ['create view v as select * from orders']}
+    graph = DependencyGraph([('tables', tables), ('views', views)])
+    graph.check()
+    assert list(graph.order('views', views)) == [Path('v.sql')]
+    assert graph.digraph.has_edge(('tables', Path('orders.sql')), ('views', Path('v.sql')))
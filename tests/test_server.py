@@ -0,0 +1,95 @@
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+from pathlib import Path
+import subprocess
+import threading
+import secrets
+import socket
+import json
+import time
+import sys
+import os
+from snowflow import server
+from fake_snowflake import FakeSession
+
+class FakeConnection:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message) -> None:
+        self.messages.append(message)
+
+def test_served_requests_do_not_inherit_session_context(fake_sessions, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path(tmp_path, 'snowflake').mkdir()
+    Path(tmp_path, 'snowflake', 'first.sql').write_text("SET region = 'EU';\nselect 'first';\n")
+    Path(tmp_path, 'snowflake', 'second.sql').write_text("select 'second';\n")
+    seen = []
+    fake_sql = FakeSession.sql
+
+    def sql(session, query):
+        if query.strip().startswith('select '):
+            seen.append((query.strip(), session.database, session.schema, session.query_tag, dict(session.variables)))
+        return fake_sql(session, query)
+    monkeypatch.setattr(FakeSession, 'sql', sql)
+
+    snowflow_server = server.SnowflowServer(str(tmp_path))
+    first = snowflow_server.run_request({'command': 'run_script', 'environment': 'test', 'cwd': str(tmp_path),
+                                         'args': {'d': 'other_db', 's': 'raw', 'f': 'first.sql'}}, FakeConnection())
+    fake_sessions.sessions[0].query_tag = 'left behind by the first client'
+    second = snowflow_server.run_request({'command': 'run_script', 'environment': 'test', 'cwd': str(tmp_path),
+                                          'args': {'f': 'second.sql'}}, FakeConnection())
+
+    assert first['status'] == 'ok' and second['status'] == 'ok'
+    assert len(fake_sessions.sessions) == 1
+    assert seen[0] == ("select 'first'", 'OTHER_DB', 'RAW', None, {'REGION': "'EU'"})
+    assert seen[1] == ("select 'second'", 'DEMO', 'PUBLIC', None, {})
+
+def write_server_file(root: Path, address: tuple, authkey: bytes, pid: int = None) -> None:
+    path = server.get_server_file(str(root))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'pid': os.getpid() if pid is None else pid, 'address': list(address),
+                                'authkey': authkey.hex(), 'root': str(root)}))
+
+def accept_in_background(listener) -> threading.Thread:
+    def accept():
+        try:
+            listener.accept().close()
+        except (OSError, EOFError, AuthenticationError):
+            pass
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    return thread
+
+def test_connect_reaches_a_running_server(tmp_path):
+    authkey = secrets.token_bytes(32)
+    with Listener(('127.0.0.1', 0), authkey=authkey) as listener:
+        write_server_file(tmp_path, listener.address, authkey)
+        accept_in_background(listener)
+        conn = server.connect(str(tmp_path))
+        assert conn is not None
+        conn.close()
+
+def test_connect_ignores_a_server_that_is_gone(tmp_path):
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    with Listener(('127.0.0.1', 0), authkey=b'key') as listener:
+        write_server_file(tmp_path, listener.address, b'key', pid=process.pid)
+        assert server.connect(str(tmp_path)) is None
+
+def test_connect_ignores_another_server_on_the_port(tmp_path):
+    with Listener(('127.0.0.1', 0), authkey=secrets.token_bytes(32)) as listener:
+        write_server_file(tmp_path, listener.address, secrets.token_bytes(32))
+        thread = accept_in_background(listener)
+        assert server.connect(str(tmp_path)) is None
+        thread.join(timeout=5)
+
+def test_connect_gives_up_on_a_listener_that_never_answers(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'CONNECT_TIMEOUT', 0.2)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        write_server_file(tmp_path, sock.getsockname(), b'key')
+        start = time.monotonic()
+        assert server.connect(str(tmp_path)) is None
+        assert time.monotonic() - start < 2
@@ -0,0 +1,121 @@
+import threading
+import time
+from snowflow import runner
+from fake_snowflake import FakeSession, FakeSessionFactory
+
+def make_pool(size: int = 1, **kwargs) -> runner.SessionPool:
+    return runner.SessionPool('test', size, factory=FakeSessionFactory(database='DEMO', schema='PUBLIC', **kwargs))
+
+def test_released_session_is_reused():
+    pool = make_pool()
+    session = pool.acquire_session()
+    pool.release_session(session)
+    assert pool.acquire_session() is session
+    assert len(pool.factory.sessions) == 1
+
+def test_acquire_without_wait_opens_beyond_size():
+    pool = make_pool(size=1)
+    first = pool.acquire_session()
+    second = pool.acquire_session(wait=False)
+    assert first is not second
+    assert len(pool.factory.sessions) == 2
+
+def test_acquire_waits_for_a_release_until_resized():
+    pool = make_pool(size=1)
+    first = pool.acquire_session()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire_session()))
+    waiter.start()
+    time.sleep(0.1)
+    assert acquired == []
+    pool.resize(2)
+    waiter.join(timeout=2)
+    assert len(acquired) == 1 and acquired[0] is not first
+    pool.release_session(first)
+    assert pool.acquire_session() is first
+
+def test_release_restores_database_schema_and_query_tag():
+    pool = make_pool()
+    session = pool.acquire_session()
+    session.use_database('OTHER_DB')
+    session.use_schema('RAW')
+    session.query_tag = 'Snowflow Deploy Schema: OTHER_DB.RAW'
+    pool.release_session(session)
+    assert (session.database, session.schema, session.query_tag) == ('DEMO', 'PUBLIC', None)
+    assert pool.acquire_session() is session
+
+def test_release_restores_context_changed_by_sql():
+    pool = make_pool()
+    session = pool.acquire_session()
+    session.sql('USE SCHEMA other_schema').collect()
+    pool.release_session(session)
+    assert (session.database, session.schema) == ('DEMO', 'PUBLIC')
+
+def test_session_that_cannot_be_reset_is_closed():
+    pool = runner.SessionPool('test', factory=FakeSessionFactory())
+    session = pool.acquire_session()
+    session.use_database('SOME_DB')
+    pool.release_session(session)
+    assert session.closed
+    assert pool.acquire_session() is not session
+
+def test_heartbeat_drops_failed_sessions():
+    pool = make_pool(size=2)
+    good = pool.acquire_session()
+    bad = pool.acquire_session()
+    pool.release_session(good)
+    pool.release_session(bad)
+    def fail(query):
+        raise RuntimeError('session expired')
+    bad.sql = fail
+    assert pool.heartbeat() == 1
+    assert bad.closed and not good.closed
+    assert pool.acquire_session() is good
+
+def test_close_logs_out_idle_sessions():
+    pool = make_pool()
+    session = pool.acquire_session()
+    pool.release_session(session)
+    pool.close()
+    assert session.closed
+
+def test_pooled_user_gives_its_session_back(fake_sessions):
+    with runner.SnowflakeUser('test') as user:
+        user.session.use_database('OTHER_DB')
+        session = user.session
+    with runner.SnowflakeUser('test') as user:
+        assert user.session is session
+        assert (user.session.database, user.session.schema) == ('DEMO', 'PUBLIC')
+    assert len(fake_sessions.sessions) == 1
+
+def test_release_restores_role_warehouse_and_secondary_roles():
+    pool = make_pool(warehouse='COMPUTE_WH')
+    session = pool.acquire_session()
+    session.sql('USE ROLE accountadmin').collect()
+    session.sql('USE WAREHOUSE big_wh').collect()
+    session.sql('USE SECONDARY ROLES ALL').collect()
+    pool.release_session(session)
+    assert (session.role, session.warehouse, session.secondary_roles) == ('SYSADMIN', 'COMPUTE_WH', 'NONE')
+    assert pool.acquire_session() is session
+
+def test_release_restores_a_list_of_secondary_roles():
+    session = FakeSession(database='DEMO', schema='PUBLIC', warehouse='COMPUTE_WH')
+    session.secondary_roles = 'ANALYST, LOADER'
+    pool = runner.SessionPool('test', user=runner.SnowflakeUser('test', session=session))
+    session.sql('USE SECONDARY ROLES NONE').collect()
+    pool.release_session(pool.acquire_session())
+    assert session.get_secondary_roles() == '{"roles": "ANALYST,LOADER", "value": ""}'
+
+def test_unchanged_session_is_released_in_one_round_trip():
+    pool = make_pool(warehouse='COMPUTE_WH')
+    session = pool.acquire_session()
+    round_trips = session.round_trips
+    pool.release_session(session)
+    assert session.round_trips == round_trips + 1
+
+def test_session_opened_without_a_warehouse_that_has_one_is_closed():
+    pool = make_pool()
+    session = pool.acquire_session()
+    session.sql('USE WAREHOUSE big_wh').collect()
+    pool.release_session(session)
+    assert session.closed
@@ -0,0 +1,64 @@
+from snowflow.splitter import split_text, split_statements
+
+def texts(sql: str) -> list[str]:
+    return [statement.text.strip() for statement in split_text(sql)]
+
+def test_splits_on_semicolons():
+    assert texts('select 1; select 2;') == ['select 1', 'select 2']
+
+def test_procedure_body_with_declare():
+    proc = ('CREATE OR REPLACE PROCEDURE p() RETURNS INT LANGUAGE SQL AS DECLARE x INT DEFAULT 1; '
+            'BEGIN x := x + 1; RETURN x; END')
+    assert texts(proc + '; select 1;') == [proc, 'select 1']
+
+def test_procedure_body_with_begin():
+    proc = "CREATE OR REPLACE PROCEDURE p() RETURNS VARCHAR LANGUAGE SQL AS BEGIN INSERT INTO t VALUES (1); RETURN 'done'; END"
+    assert texts(proc + ';\ngrant usage on procedure p() to role r;') == [proc, 'grant usage on procedure p() to role r']
+
+def test_anonymous_declare_block():
+    block = 'DECLARE c INT; BEGIN c := 1; RETURN c; END'
+    assert texts(block + '; select 2') == [block, 'select 2']
+
+def test_nested_blocks_and_constructs():
+    proc = ('CREATE PROCEDURE p() RETURNS INT LANGUAGE SQL AS DECLARE i INT DEFAULT 0; BEGIN '
+            'FOR j IN 1 TO 3 DO i := i + j; END FOR; '
+            'IF (i > 2) THEN BEGIN i := 0; END; END IF; '
+            'WHILE (i < 2) DO i := i + 1; END WHILE; '
+            'RETURN i; END')
+    assert texts(proc + '; select 3;') == [proc, 'select 3']
+
+def test_case_end():
+    proc = ("CREATE PROCEDURE p(x INT) RETURNS VARCHAR LANGUAGE SQL AS BEGIN "
+            "LET y VARCHAR := CASE WHEN x > 0 THEN 'pos' ELSE 'neg' END; "
+            "CASE (x) WHEN 1 THEN RETURN 'one'; ELSE RETURN y; END CASE; END")
+    assert texts(proc + '; select 4;') == [proc, 'select 4']
+    assert texts("select case when a then 1 end from t; select 5") == ['select case when a then 1 end from t', 'select 5']
+
+def test_begin_transaction_is_not_a_block():
+    assert texts('begin transaction; insert into t values (1); commit;') == ['begin transaction', 'insert into t values (1)', 'commit']
+    assert texts('begin; select 1; commit;') == ['begin', 'select 1', 'commit']
+
+def test_declare_as_identifier_does_not_open_a_block():
+    assert texts('select (declare) from t; select 6') == ['select (declare) from t', 'select 6']
+
+def test_quoted_and_commented_semicolons():
+    sql = ("select 'a;b', \"c;d\" from t; -- a comment; with a semicolon\n"
+           "/* block; comment */ select 'it''s;' ; "
+           "create function f() returns int language javascript as $$ return 1; $$;")
+    assert texts(sql) == ["select 'a;b', \"c;d\" from t",
+                          "-- a comment; with a semicolon\n/* block; comment */ select 'it''s;'",
+                          'create function f() returns int language javascript as $$ return 1; $$']
+
+def test_comment_only_fragments_are_dropped():
+    assert texts('select 1; -- trailing comment\n') == ['select 1']
+
+def test_chunks_split_anywhere():
+    sql = "CREATE PROCEDURE p() RETURNS INT LANGUAGE SQL AS DECLARE x INT; BEGIN RETURN 'a;''b'; END; select 1 -- c;\n;"
+    expected = texts(sql)
+    for size in (1, 2, 3, 7):
+        chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+        assert [statement.text.strip() for statement in split_statements(chunks)] == expected
+
+def test_statement_lines():
+    statements = split_text('select 1;\n\nselect\n2;')
+    assert [statement.line for statement in statements] == [1, 3]
@@ -0,0 +1,102 @@
+from pathlib import Path
+from snowflow.state import SchemaState
+
+VIEW_ROWS = [('ORDERS', 'create or replace view ORDERS as\nselect id, amount from raw.orders where amount > 0;')]
+UDF_ROWS = [('ADD_TAX', '(AMOUNT NUMBER, RATE FLOAT)', 'NUMBER(38,0)', 'SQL', '\n  amount * (1 + rate)\n')]
+PROC_ROWS = [('CLEAN_UP', '(DAYS NUMBER)', 'VARCHAR(16777216)', 'SQL',
+              "\nBEGIN\n  DELETE FROM logs WHERE age > :days;\n  RETURN 'done';\nEND\n")]
+
+def make_state() -> SchemaState:
+    state = SchemaState(None, 'DEMO', 'PUBLIC')
+    state.load('views', VIEW_ROWS)
+    state.load('udfs', UDF_ROWS)
+    state.load('stored_procs', PROC_ROWS)
+    return state
+
+def test_view_formatting_is_ignored():
+    query = '''-- orders with an amount
+    CREATE OR REPLACE VIEW demo.public.orders AS
+        SELECT ID,
+               AMOUNT /* in cents */
+        FROM RAW.ORDERS
+        WHERE AMOUNT>0'''
+    assert make_state().is_unchanged('views', query)
+
+def test_view_literals_are_compared_exactly():
+    state = SchemaState(None, 'DEMO', 'PUBLIC')
+    state.load('views', [('LABELS', "create view LABELS as select 'Open' as status")])
+    assert state.is_unchanged('views', "CREATE VIEW labels AS SELECT 'Open' AS STATUS")
+    assert not state.is_unchanged('views', "CREATE VIEW labels AS SELECT 'OPEN' AS STATUS")
+    state.load('views', [('LABELS', "create view LABELS as select 'a = b' as status")])
+    assert not state.is_unchanged('views', "create view LABELS as select 'a=b' as status")
+
+def test_udf_formatting_and_type_aliases_are_ignored():
+    query = '''create or replace function add_tax(amount int, rate double)
+returns integer
+as
+$$
+  amount * (1 + rate)   
+$$;'''
+    assert make_state().is_unchanged('udfs', query)
+
+def test_proc_formatting_is_ignored():
+    query = '''/* nightly clean up */
+CREATE OR REPLACE PROCEDURE Clean_Up(days INTEGER)
+RETURNS STRING
+LANGUAGE SQL
+AS
+$$
+BEGIN
+  DELETE FROM logs WHERE age > :days;
+  RETURN 'done';
+END
+$$;'''
+    assert make_state().is_unchanged('stored_procs', query)
+
+def test_changed_objects_are_detected():
+    state = make_state()
+    assert not state.is_unchanged('views', 'create or replace view orders as select id from raw.orders')
+    assert not state.is_unchanged('udfs', 'create or replace function add_tax(amount int, rate double) returns int as $$ amount * rate $$')
+    # A different signature is another function
+    assert not state.is_unchanged('udfs', 'create or replace function add_tax(amount int) returns int as $$ amount * (1 + rate) $$')
+    assert not state.is_unchanged('stored_procs', "create or replace procedure clean_up(days int) returns string language sql as $$ BEGIN RETURN 'done'; END $$")
+
+def test_added_objects_are_detected():
+    state = make_state()
+    assert not state.is_unchanged('views', 'create or replace view customers as select id from raw.customers')
+    assert not state.is_unchanged('udfs', 'create or replace function add_fee(amount int) returns int as $$ amount + 1 $$')
+
+def test_removed_objects_are_deployed_again():
+    state = make_state()
+    query = 'create or replace view orders as select id, amount from raw.orders where amount > 0'
+    assert state.is_unchanged('views', query)
+    state.load('views', [])
+    assert not state.is_unchanged('views', query)
+
+def test_uncompared_options_always_run():
+    query = "create or replace secure function add_tax(amount int, rate double) returns int as $$ amount * (1 + rate) $$"
+    assert not make_state().is_unchanged('udfs', query)
+
+def test_get_changed_keeps_only_changed_statements():
+    unchanged = 'create or replace view orders as select id, amount from raw.orders where amount > 0'
+    changed = 'create or replace view customers as select id from raw.customers'
+    file_queries = {Path('orders.sql'): [unchanged], Path('customers.sql'): [changed]}
+    assert make_state().get_changed('views', file_queries) == {Path('customers.sql'): [changed]}
+
+def test_definitions_are_fetched_once_per_type():
+    class User:
+        def __init__(self):
+            self.queries = []
+
+        def run_query(self, query, object_type='', tracked=True):
+            assert not tracked
+            self.queries.append(query)
+            return VIEW_ROWS
+
+    user = User()
+    state = SchemaState(user, 'DEMO', 'public')
+    query = 'create or replace view orders as select id, amount from raw.orders where amount > 0'
+    assert state.is_unchanged('views', query)
+    assert state.is_unchanged('views', query)
+    assert len(user.queries) == 1
+    assert "TABLE_SCHEMA = 'PUBLIC'" in user.queries[0]
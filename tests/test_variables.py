@@ -0,0 +1,67 @@
+from pathlib import Path
+import yaml
+from snowflow import scripts
+from snowflow.scripts import VariableScope, VariableSubstituter
+
+def test_longest_name_wins():
+    substituter = VariableSubstituter({'DB': 'dev', 'DB_NAME': 'analytics', 'DB_NAME_SUFFIX': '_v2'})
+    assert substituter.substitute('DB DB_NAME DB_NAME_SUFFIX') == 'dev analytics _v2'
+
+def test_order_of_variables_does_not_matter():
+    text = 'USE !!!DB!!!; USE !!!DB_NAME!!!;'
+    forward = VariableSubstituter({'!!!DB': 'x', '!!!DB!!!': 'dev', '!!!DB_NAME!!!': 'analytics'})
+    backward = VariableSubstituter({'!!!DB_NAME!!!': 'analytics', '!!!DB!!!': 'dev', '!!!DB': 'x'})
+    assert forward.substitute(text) == backward.substitute(text) == 'USE dev; USE analytics;'
+
+def test_values_are_not_substituted_again():
+    substituter = VariableSubstituter({'!!!A!!!': '!!!B!!!', '!!!B!!!': 'b'})
+    assert substituter.substitute('!!!A!!! !!!B!!!') == '!!!B!!! b'
+
+def test_unknown_variables_are_left_intact():
+    substituter = VariableSubstituter({'!!!DB!!!': 'dev'})
+    text = 'select * from !!!DB!!!.!!!SCHEMA!!!.orders where !!!DB_ID!!! = 1'
+    substituted = substituter.substitute(text)
+    assert substituted == 'select * from dev.!!!SCHEMA!!!.orders where !!!DB_ID!!! = 1'
+    assert substituter.get_unresolved(substituted) == {'!!!SCHEMA!!!', '!!!DB_ID!!!'}
+
+def test_no_variables():
+    substituter = VariableSubstituter({'': 'ignored'})
+    assert substituter.substitute('select !!!DB!!!') == 'select !!!DB!!!'
+
+def test_inner_scope_wins():
+    scope = VariableScope({'!!!DB!!!': 'dev', '!!!DB_NAME!!!': 'analytics'})
+    child = scope.child({'!!!DB!!!': 'task'})
+    assert child.substitute('!!!DB!!! !!!DB_NAME!!!') == 'task analytics'
+    assert scope.substitute('!!!DB!!! !!!DB_NAME!!!') == 'dev analytics'
+
+def write_dag(schema_path: Path, warehouse: str) -> None:
+    Path(schema_path, 'dags').mkdir(parents=True)
+    Path(schema_path, 'dags', 'nightly.yaml').write_text(yaml.safe_dump({
+        'DAG_NAME': 'nightly', 'SCHEDULE': 'USING CRON 0 0 * * * UTC', 'WAREHOUSE': warehouse, 'ROOT_TASK': 'root',
+        'INITIAL_WAREHOUSE_SIZE': 'XSMALL', 'ALLOW_OVERLAPPING_EXECUTION': 'FALSE', 'ENABLED': 'FALSE',
+        'TASKS': [{'NAME': 'root', 'SCRIPT_PATH': 'nightly/root.sql', 'SCRIPT_TYPE': 'sql'}]}))
+
+def test_dags_and_schemas_do_not_share_variables(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path(tmp_path, 'query_variables.yaml').write_text(yaml.safe_dump({'test': {'!!!ENV!!!': 'dev'}}))
+    database_path = Path(tmp_path, 'snowflake', 'databases', 'demo')
+    Path(database_path, 'dml', 'nightly').mkdir(parents=True)
+    Path(database_path, 'dml', 'nightly', 'root.sql').write_text("insert into runs select '!!!WAREHOUSE!!!', '!!!ENV!!!';\n")
+    write_dag(Path(database_path, 'schemas', 'first'), 'load_a')
+    write_dag(Path(database_path, 'schemas', 'second'), 'load_b')
+
+    db = scripts.SnowflakeDB('demo', scripts.SnowflakeAcct('test'))
+    first = scripts.SnowflakeSchema('first', db)
+    second = scripts.SnowflakeSchema('second', db)
+    first_dag = first.get_task_dag('nightly.yaml')
+    first_queries = first_dag.get_all_queries()
+    second_queries = second.get_task_dag('nightly.yaml').get_all_queries()
+
+    assert "insert into runs select 'load_a', 'dev'" in '\n'.join(first_queries)
+    assert "insert into runs select 'load_b', 'dev'" in '\n'.join(second_queries)
+    assert 'load_a' not in '\n'.join(second_queries)
+    # Compiling the second DAG did not change the first, and neither DAG changed its schema's variables
+    assert first_dag.get_all_queries() == first_queries
+    assert first_dag.task_dict['root'].get_script_queries() == ["insert into runs select 'load_a', 'dev'"]
+    assert first.sp.scope.substitute('!!!WAREHOUSE!!! !!!ENV!!!') == '!!!WAREHOUSE!!! dev'
+    assert second.sp.scope.substitute('!!!TASK_NAME!!!') == '!!!TASK_NAME!!!'
@@ -0,0 +1,37 @@
+from pathlib import Path
+from snowflow import commands, manifest, plan, runner, watch
+from fake_snowflake import FakeSession
+
+PROCEDURE = '''CREATE OR REPLACE PROCEDURE clean_up()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+BEGIN
+  DELETE FROM logs;
+  RETURN 'done';
+END;
+$$;
+'''
+
+def test_saved_procedures_are_recorded_as_deploy_records_them(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    procs_path = Path(tmp_path, 'snowflake', 'databases', 'demo', 'schemas', 'opendata', 'stored_procs')
+    procs_path.mkdir(parents=True)
+    path = Path(procs_path, 'clean_up.sql')
+    path.write_text(PROCEDURE)
+    queries = []
+    session = FakeSession(rows=lambda query: queries.append(query.strip()) or [])
+    deploy = commands.Deploy('test')
+    deploy.set_options({})
+    deploy.manifest = manifest.DeployManifest(manifest.LocalManifestStore(Path(tmp_path, 'manifest.json')))
+    user = runner.SnowflakeUser('test', session=session)
+    deploy_watch = watch.DeployWatch(deploy, user, [('demo', 'opendata')])
+
+    assert deploy_watch.apply_file(deploy_watch.get_schemas(), path)
+    assert [query for query in queries if 'clean_up' in query] == [PROCEDURE.strip()]
+
+    compiled = plan.PlanCompiler('test').compile('demo', 'opendata')
+    files = next(step['files'] for step in compiled.steps if step.get('object_type') == 'stored_procs')
+    recorded = manifest.DeployManifest(manifest.LocalManifestStore(Path(tmp_path, 'manifest.json')))
+    assert recorded.get_changed({Path(tmp_path, name): queries for name, queries in files.items()}) == {}